@@ -0,0 +1 @@
+# Stage-level benchmarks; run with `python -m benchmarks.run` from backend/
@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.run import _real_engines_available
+from benchmarks.synthetic import PAGE_KINDS, SyntheticPage, generate_page
+
+'''
+Accuracy and latency of the inference profiles on a synthetic reference set.
+
+Each profile runs in its own process (the engines are built at import from
+LEVIOSA_INFERENCE_PROFILE) over the same pages, and is compared with the fp32
+`default` profile. `onnx` runs the ONNX Runtime backend instead
+(LEVIOSA_ENGINE_BACKEND=onnx):
+
+- OCR: line recall (ground-truth lines matched by a detected box) and
+  character error rate of the matched lines
+- Layout: region recall and the share of matched regions with the right type
+- Latency per page for both engines
+
+Run from backend/ after tools/quantize_models.py:
+    python -m benchmarks.compare_profiles --output profiles.json
+'''
+
+MATCH_IOU = 0.5
+
+
+def _iou(a: List[float], b: List[float]) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _quad_to_box(quad: List[List[float]]) -> List[float]:
+    xs, ys = [p[0] for p in quad], [p[1] for p in quad]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def _edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _best_match(box: List[float], candidates: List[List[float]]) -> Optional[int]:
+    scores = [_iou(box, c) for c in candidates]
+    if not scores or max(scores) < MATCH_IOU:
+        return None
+    return int(np.argmax(scores))
+
+
+def score_ocr(page: SyntheticPage, lines: List[Any]) -> Dict[str, float]:
+    """Line recall and character errors of one page's OCR result against ground truth."""
+    boxes = [_quad_to_box(quad) for quad, _ in lines]
+    matched, errors, chars = 0, 0, 0
+    for truth in page.lines:
+        chars += len(truth.text)
+        index = _best_match(truth.bbox, boxes)
+        if index is None:
+            errors += len(truth.text)
+            continue
+        matched += 1
+        errors += _edit_distance(truth.text, lines[index][1][0])
+    return {"lines": len(page.lines), "matched": matched, "char_errors": errors, "chars": chars}
+
+
+def score_layout(page: SyntheticPage, regions: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Region recall and type agreement of one page's layout result against ground truth."""
+    boxes = [region.get("bbox", [0, 0, 0, 0]) for region in regions]
+    matched, typed = 0, 0
+    for truth in page.regions:
+        index = _best_match(truth.bbox, boxes)
+        if index is None:
+            continue
+        matched += 1
+        typed += regions[index].get("type") == truth.region_type
+    return {"regions": len(page.regions), "matched": matched, "typed": typed}
+
+
+def run_profile(pages: List[SyntheticPage], repeat: int) -> Dict[str, Any]:
+    """Score and time the engines of the current process's profile."""
+    from services import engines
+
+    ocr_scores, layout_scores = [], []
+    ocr_times, layout_times = [], []
+    for page in pages:
+        image_np = np.array(page.image)
+        engines.ocr_engine.ocr(image_np, cls=False)  # warm-up
+        for _ in range(repeat):
+            start = time.perf_counter()
+            lines = engines.ocr_engine.ocr(image_np, cls=False)[0] or []
+            ocr_times.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            regions = engines.structure_engine(image_np)
+            layout_times.append((time.perf_counter() - start) * 1000)
+        ocr_scores.append(score_ocr(page, lines))
+        layout_scores.append(score_layout(page, regions))
+
+    total = lambda scores, key: sum(s[key] for s in scores)
+    return {
+        "profile": "onnx" if engines.ENGINE_BACKEND == "onnx" else engines.INFERENCE_PROFILE,
+        "profile_args": engines.profile_args(),
+        "ocr_line_recall": total(ocr_scores, "matched") / max(1, total(ocr_scores, "lines")),
+        "ocr_cer": total(ocr_scores, "char_errors") / max(1, total(ocr_scores, "chars")),
+        "layout_region_recall": total(layout_scores, "matched") / max(1, total(layout_scores, "regions")),
+        "layout_type_accuracy": total(layout_scores, "typed") / max(1, total(layout_scores, "matched")),
+        "ocr_median_ms": statistics.median(ocr_times),
+        "layout_median_ms": statistics.median(layout_times),
+    }
+
+
+def _reference_set(dpi: int, pages: int) -> List[SyntheticPage]:
+    return [generate_page(PAGE_KINDS[i % len(PAGE_KINDS)], dpi, seed=i) for i in range(pages)]
+
+
+def _run_in_subprocess(profile: str, args: argparse.Namespace) -> Dict[str, Any]:
+    if profile == "onnx":
+        env = dict(os.environ, LEVIOSA_ENGINE_BACKEND="onnx")
+    else:
+        env = dict(os.environ, LEVIOSA_ENGINE_BACKEND="paddle", LEVIOSA_INFERENCE_PROFILE=profile)
+    command = [sys.executable, "-m", "benchmarks.compare_profiles", "--worker",
+               "--dpi", str(args.dpi), "--pages", str(args.pages), "--repeat", str(args.repeat)]
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare inference profiles against fp32 on synthetic pages")
+    parser.add_argument("--profiles", nargs="+", default=["default", "mkldnn", "int8"],
+                        help="Inference profiles to run, plus 'onnx' for the ONNX Runtime backend")
+    parser.add_argument("--dpi", type=int, default=150)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="profiles.json")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_profile(_reference_set(args.dpi, args.pages), args.repeat)))
+        return 0
+
+    if not _real_engines_available():
+        print("[PROFILES] paddleocr or model weights not available; nothing to compare")
+        return 1
+
+    results = {}
+    for profile in args.profiles:
+        print(f"[PROFILES] Running '{profile}'...")
+        results[profile] = _run_in_subprocess(profile, args)
+
+    baseline = results.get("default")
+    print(f"\n{'profile':<10} {'line recall':>12} {'CER':>8} {'region recall':>14} {'type acc':>9} {'ocr ms':>9} {'layout ms':>10}")
+    for profile, r in results.items():
+        speedup = ""
+        if baseline and profile != "default":
+            speedup = f"  (ocr x{baseline['ocr_median_ms'] / r['ocr_median_ms']:.2f}, layout x{baseline['layout_median_ms'] / r['layout_median_ms']:.2f})"
+        print(f"{profile:<10} {r['ocr_line_recall']:>12.3f} {r['ocr_cer']:>8.3f} {r['layout_region_recall']:>14.3f} "
+              f"{r['layout_type_accuracy']:>9.3f} {r['ocr_median_ms']:>9.1f} {r['layout_median_ms']:>10.1f}{speedup}")
+
+    with open(args.output, "w") as f:
+        json.dump({"dpi": args.dpi, "pages": args.pages, "profiles": results}, f, indent=2)
+    print(f"[PROFILES] Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from fastapi import Request # type: ignore
+
+from benchmarks import stub_engines
+from benchmarks.synthetic import PAGE_KINDS, generate_document, generate_page, to_pdf
+
+'''
+Stage-level benchmark runner.
+
+Times each pipeline stage separately on synthetic pages and writes the
+results to a JSON file. Passing --compare with an earlier results file prints
+the change per stage and exits non-zero when a stage got slower than the
+threshold, so a baseline can be taken before a performance change and checked
+after it.
+
+Run from backend/:
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --output after.json --compare bench.json
+'''
+
+MODEL_FILES = [
+    "models/en_PP-OCRv3_det_infer/inference.pdiparams",
+    "models/en_PP-OCRv3_rec_infer/inference.pdiparams",
+    "models/layout_ppv3_infer/inference.pdiparams",
+]
+
+
+def _real_engines_available() -> bool:
+    try:
+        import paddleocr  # noqa: F401
+    except ImportError:
+        return False
+    return all(os.path.exists(p) for p in MODEL_FILES)
+
+
+def measure(fn: Callable[..., Any], repeat: int, warmup: int = 1,
+            setup: Optional[Callable[[], Any]] = None) -> Dict[str, float]:
+    """
+    Time fn over several runs.
+
+    Args:
+        fn: The code to time; called with setup()'s result when setup is given
+        repeat: Number of timed runs
+        warmup: Untimed runs before measuring
+        setup: Untimed per-run preparation, for stages that mutate their input
+
+    Returns:
+        Summary statistics in milliseconds
+    """
+    times = []
+    for run in range(warmup + repeat):
+        prepared = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            fn(prepared)
+        else:
+            fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        if run >= warmup:
+            times.append(elapsed)
+    times.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(times[0], 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "p95_ms": round(times[min(int(len(times) * 0.95), len(times) - 1)], 3),
+    }
+
+
+class BenchmarkSuite:
+    def __init__(self, dpis: List[int], kinds: List[str], repeat: int, real_engines: bool):
+        self.dpis = dpis
+        self.kinds = kinds
+        self.repeat = repeat
+        self.real_engines = real_engines
+        self.loop = asyncio.new_event_loop()
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+        # Imported here so the stub paddleocr module can be installed first
+        from services import engines, layout_analyzer, ocr_paddleocr
+        from services.layout_postprocessor import LayoutPostprocessor
+        from services.markdown_processor import MarkdownProcessor
+        from services.response_encoding import encode_response
+        self.engines = engines
+        self.encode_response = encode_response
+        self.layout_analyzer = layout_analyzer
+        self.ocr_paddleocr = ocr_paddleocr
+        self.postprocessor = LayoutPostprocessor()
+        self.markdown_processor = MarkdownProcessor(llm_api_key="benchmark")
+
+    def record(self, stage: str, case: str, stats: Dict[str, Any]) -> None:
+        self.results.setdefault(stage, {})[case] = stats
+        if "median_ms" in stats:
+            print(f"  {stage:<22} {case:<24} median {stats['median_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms")
+        else:
+            print(f"  {stage:<22} {case:<24} {stats}")
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def bench_rasterize(self) -> None:
+        if shutil.which("pdftoppm") is None:
+            self.record("convert_pdf_to_images", "all", {"skipped": "poppler (pdftoppm) not installed"})
+            return
+        from services.pdf_to_image import convert_pdf_to_images
+
+        for dpi in self.dpis:
+            pages = generate_document(self.kinds, dpi)
+            with tempfile.TemporaryDirectory() as tmp:
+                pdf_path = to_pdf(pages, os.path.join(tmp, f"bench_{dpi}.pdf"))
+
+                def rasterize():
+                    for path in convert_pdf_to_images(pdf_path):
+                        os.remove(path)
+
+                self.record("convert_pdf_to_images", f"{len(pages)}pages@{dpi}dpi", measure(rasterize, self.repeat))
+
+    @contextmanager
+    def stubbed_engines(self):
+        """Swap the shared engines for the stubs, restoring the real ones afterwards."""
+        real_structure, real_ocr = self.engines.structure_engine, self.engines.ocr_engine
+        self.engines.install(structure=stub_engines.PPStructure(), ocr=stub_engines.PaddleOCR())
+        try:
+            yield
+        finally:
+            self.engines.install(structure=real_structure, ocr=real_ocr)
+
+    def bench_parsing(self) -> None:
+        """Result parsing in the analyzers, with the model calls stubbed out."""
+        with self.stubbed_engines():
+            for dpi in self.dpis:
+                for kind in self.kinds:
+                    page = generate_page(kind, dpi)
+                    stub_engines.load_page(page)
+                    self.record(
+                        "layout_parse", page.name,
+                        measure(lambda: self.run_async(self.layout_analyzer._process_layout_from_image(page.image, 1)), self.repeat),
+                    )
+                    self.record(
+                        "ocr_parse", page.name,
+                        measure(lambda: self.run_async(self.ocr_paddleocr._process_pil_image(page.image, 1)), self.repeat),
+                    )
+
+    def _layout_document(self, dpi: int):
+        from models.document import LayoutDocument
+
+        pages = []
+        with self.stubbed_engines():
+            for i, page in enumerate(generate_document(self.kinds, dpi)):
+                stub_engines.load_page(page)
+                pages.append(self.run_async(self.layout_analyzer._process_layout_from_image(page.image, i + 1)))
+        return LayoutDocument(pages)
+
+    def bench_postprocess_and_payload(self) -> None:
+        from models.document import LayoutDocument
+
+        for dpi in self.dpis:
+            document = self._layout_document(dpi)
+            case = f"{len(document.pages)}pages@{dpi}dpi"
+
+            # process_regions reclassifies in place, so every run gets a fresh copy
+            fresh = lambda: LayoutDocument.from_response(document.to_dict())
+            self.record("process_regions", case, measure(lambda d: self.postprocessor.process_regions(d.pages), self.repeat, setup=fresh))
+
+            enhanced = fresh()
+            self.postprocessor.process_regions(enhanced.pages)
+
+            def payload():
+                return json.dumps(self.markdown_processor.build_structured_document(enhanced), indent=2)
+
+            stats = measure(payload, self.repeat)
+            stats["payload_bytes"] = len(payload())
+            self.record("llm_payload", case, stats)
+
+            # Encoded as the routes do, for a client that sends no Accept header
+            request = Request({"type": "http", "method": "POST", "path": "/", "headers": []})
+
+            def response():
+                return self.encode_response(request, enhanced).body
+
+            stats = measure(response, self.repeat)
+            stats["response_bytes"] = len(response())
+            self.record("layout_response", case, stats)
+
+    def bench_engines(self) -> None:
+        if not self.real_engines:
+            self.record("engines", "all", {"skipped": "paddleocr or model weights not available"})
+            return
+        for dpi in self.dpis:
+            for kind in self.kinds:
+                page = generate_page(kind, dpi)
+                image_np = np.array(page.image)
+                self.record("structure_engine", page.name, measure(lambda: self.engines.structure_engine(image_np), self.repeat))
+                self.record("ocr_engine", page.name, measure(lambda: self.engines.ocr_engine.ocr(image_np, cls=True), self.repeat))
+
+    def run(self, stages: List[str]) -> Dict[str, Dict[str, Any]]:
+        for stage in stages:
+            print(f"[BENCH] {stage}")
+            getattr(self, f"bench_{stage}")()
+        return self.results
+
+
+STAGES = ["rasterize", "parsing", "postprocess_and_payload", "engines"]
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """
+    Print the median change per stage and case against a baseline run.
+
+    Returns:
+        True when no stage regressed by more than threshold (a fraction)
+    """
+    ok = True
+    print(f"\n[BENCH] Comparison against {baseline['meta'].get('revision')} (threshold {threshold:.0%})")
+    for stage, cases in current["stages"].items():
+        for case, stats in cases.items():
+            before = baseline["stages"].get(stage, {}).get(case, {})
+            if "median_ms" not in stats or "median_ms" not in before:
+                continue
+            change = (stats["median_ms"] - before["median_ms"]) / before["median_ms"] if before["median_ms"] else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                ok = False
+            print(f"  {stage:<22} {case:<24} {before['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f} ms  {change:+7.1%}{flag}")
+    return ok
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Stage-level benchmarks for the Leviosa pipeline")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the results JSON")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown before a stage is flagged")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[72, 150, 300])
+    parser.add_argument("--kinds", nargs="+", default=PAGE_KINDS, choices=PAGE_KINDS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--engines", choices=["auto", "stub"], default="auto",
+                        help="'stub' never loads the real models, even when they are installed")
+    args = parser.parse_args(argv)
+
+    real_engines = args.engines == "auto" and _real_engines_available()
+    if not real_engines:
+        stub_engines.install()
+
+    suite = BenchmarkSuite(args.dpi, args.kinds, args.repeat, real_engines)
+    results = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "real_engines": real_engines,
+            "dpis": args.dpi,
+            "kinds": args.kinds,
+            "repeat": args.repeat,
+        },
+        "stages": suite.run(args.stages),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[BENCH] Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        return 0 if compare(results, baseline, args.threshold) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import sys
+import types
+from typing import List, Optional
+
+from benchmarks.synthetic import SyntheticPage
+
+'''
+Stand-ins for PaddleOCR and PPStructure used by the benchmarks.
+
+They return the ground truth of the page loaded with `load_page()` in the same
+shapes the real engines produce, so the parsing code in layout_analyzer and
+ocr_paddleocr runs unchanged while the model cost is taken out of the picture.
+`install()` registers them as the `paddleocr` module, which must happen before
+the services are imported.
+'''
+
+_current_page: Optional[SyntheticPage] = None
+
+
+def load_page(page: SyntheticPage) -> None:
+    """Select the page whose ground truth the stub engines return next."""
+    global _current_page
+    _current_page = page
+
+
+def _quad(bbox: List[float]) -> List[List[float]]:
+    x1, y1, x2, y2 = bbox
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+class PaddleOCR:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def text_classifier(self, img_list):
+        """Angle classifier: synthetic pages are always upright."""
+        return img_list, [("0", 0.99) for _ in img_list], 0.0
+
+    def text_recognizer(self, img_list):
+        """Line recognizer: crops carry no ground truth, so nothing beats the page pass."""
+        return [("", 0.0) for _ in img_list], 0.0
+
+    def ocr(self, img, det=True, rec=True, cls=True):
+        lines = _current_page.lines if _current_page else []
+        return [[[_quad(line.bbox), (line.text, 0.95)] for line in lines]]
+
+
+class PPStructure:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        # Like the real engine, sub-systems set to None are skipped (see services/engines.py)
+        self.table_system = object() if kwargs.get("table", True) else None
+        self.text_system = object() if kwargs.get("ocr", True) else None
+
+    def __call__(self, img, return_ocr_result_in_table=False, img_idx=0):
+        results = []
+        for region in (_current_page.regions if _current_page else []):
+            x1, y1, x2, y2 = [int(v) for v in region.bbox]
+            res = ""
+            if region.region_type == "table":
+                if self.table_system is not None:
+                    res = {"html": region.html, "boxes": [line.bbox for line in region.lines]}
+            elif self.text_system is not None:
+                res = [
+                    {"text": line.text, "confidence": 0.95, "text_region": _quad(line.bbox)}
+                    for line in region.lines
+                ]
+            results.append({"type": region.region_type, "bbox": [x1, y1, x2, y2], "img": img[y1:y2, x1:x2],
+                            "res": res, "img_idx": img_idx})
+        return results
+
+
+def save_structure_res(*args, **kwargs):
+    pass
+
+
+def install() -> None:
+    """Register the stubs as the `paddleocr` module."""
+    module = types.ModuleType("paddleocr")
+    module.PaddleOCR = PaddleOCR
+    module.PPStructure = PPStructure
+    module.save_structure_res = save_structure_res
+    sys.modules["paddleocr"] = module
@@ -0,0 +1,215 @@
+import random
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+'''
+Synthetic document pages for benchmarking.
+
+Pages are drawn with PIL at a given DPI (US Letter) and carry their own ground
+truth: the regions and text lines that were drawn, in pixel coordinates. The
+stub engines in benchmarks/stub_engines.py turn that ground truth into the
+same result shapes PaddleOCR and PPStructure return.
+'''
+
+PAGE_KINDS = ["text_columns", "table", "list", "figure", "mixed"]
+
+WORDS = (
+    "revenue forecast quarter analyst growth margin report patient record summary "
+    "invoice total amount balance statement period section figure table results "
+    "method sample value average increase decrease annual market share outlook"
+).split()
+
+
+@dataclass
+class SyntheticLine:
+    text: str
+    bbox: List[float]  # x1, y1, x2, y2 in pixels
+
+
+@dataclass
+class SyntheticRegion:
+    region_type: str
+    bbox: List[float]
+    lines: List[SyntheticLine] = field(default_factory=list)
+    html: str = ""
+
+
+@dataclass
+class SyntheticPage:
+    kind: str
+    dpi: int
+    image: Image.Image
+    regions: List[SyntheticRegion]
+
+    @property
+    def lines(self) -> List[SyntheticLine]:
+        return [line for region in self.regions for line in region.lines]
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}@{self.dpi}dpi"
+
+
+def _font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+class _PageBuilder:
+    def __init__(self, kind: str, dpi: int, seed: int):
+        self.kind = kind
+        self.dpi = dpi
+        self.rng = random.Random(f"{kind}-{dpi}-{seed}")
+        self.width = int(8.5 * dpi)
+        self.height = int(11 * dpi)
+        self.margin = int(0.75 * dpi)
+        self.line_height = max(int(dpi * 0.2), 10)
+        self.font = _font(max(int(self.line_height * 0.7), 8))
+        self.image = Image.new("RGB", (self.width, self.height), "white")
+        self.draw = ImageDraw.Draw(self.image)
+        self.regions: List[SyntheticRegion] = []
+
+    def text_line(self, x: float, y: float, text: str) -> SyntheticLine:
+        self.draw.text((x, y), text, fill="black", font=self.font)
+        x1, y1, x2, y2 = self.draw.textbbox((x, y), text, font=self.font)
+        return SyntheticLine(text=text, bbox=[float(x1), float(y1), float(x2), float(y2)])
+
+    def region(self, region_type: str, lines: List[SyntheticLine], html: str = "",
+               bbox: Tuple[float, float, float, float] = None) -> None:
+        if bbox is None:
+            bbox = (
+                min(l.bbox[0] for l in lines), min(l.bbox[1] for l in lines),
+                max(l.bbox[2] for l in lines), max(l.bbox[3] for l in lines),
+            )
+        self.regions.append(SyntheticRegion(region_type, [float(v) for v in bbox], lines, html))
+
+    def title(self, y: float) -> float:
+        line = self.text_line(self.margin, y, _sentence(self.rng, 4).upper())
+        self.region("title", [line])
+        return line.bbox[3] + self.line_height
+
+    def paragraph(self, x: float, y: float, width: float, rows: int) -> float:
+        chars_per_word = 8
+        words = max(int(width / (self.line_height * 0.45 * chars_per_word)), 2)
+        lines = []
+        for _ in range(rows):
+            lines.append(self.text_line(x, y, _sentence(self.rng, words)))
+            y += self.line_height * 1.3
+        self.region("text", lines)
+        return y + self.line_height
+
+    def columns(self, y: float, rows: int, count: int = 2) -> float:
+        gutter = self.line_height * 2
+        col_width = (self.width - 2 * self.margin - gutter * (count - 1)) / count
+        bottom = y
+        for c in range(count):
+            x = self.margin + c * (col_width + gutter)
+            bottom = max(bottom, self.paragraph(x, y, col_width, rows))
+        return bottom
+
+    def table(self, y: float, rows: int = 8, cols: int = 4) -> float:
+        cell_w = (self.width - 2 * self.margin) / cols
+        cell_h = self.line_height * 1.6
+        lines = []
+        html_rows = []
+        for r in range(rows):
+            cells = []
+            for c in range(cols):
+                x1 = self.margin + c * cell_w
+                y1 = y + r * cell_h
+                self.draw.rectangle([x1, y1, x1 + cell_w, y1 + cell_h], outline="black")
+                text = self.rng.choice(WORDS).title() if r == 0 else f"{self.rng.uniform(0, 9999):.2f}"
+                lines.append(self.text_line(x1 + 4, y1 + 4, text))
+                cells.append(f"<td>{text}</td>")
+            html_rows.append(f"<tr>{''.join(cells)}</tr>")
+        html = f"<html><body><table>{''.join(html_rows)}</table></body></html>"
+        bbox = (self.margin, y, self.width - self.margin, y + rows * cell_h)
+        self.region("table", lines, html=html, bbox=bbox)
+        return bbox[3] + self.line_height * 2
+
+    def bullets(self, y: float, items: int = 6) -> float:
+        lines = []
+        for i in range(items):
+            lines.append(self.text_line(self.margin, y, f"{i + 1}. {_sentence(self.rng, 6)}"))
+            y += self.line_height * 1.4
+        self.region("list", lines)
+        return y + self.line_height
+
+    def figure(self, y: float) -> float:
+        w = (self.width - 2 * self.margin) * 0.8
+        h = w * 0.5
+        x1 = self.margin + (self.width - 2 * self.margin - w) / 2
+        self.draw.rectangle([x1, y, x1 + w, y + h], outline="black", width=max(self.dpi // 100, 1))
+        points = [(x1 + w * i / 10, y + h - h * self.rng.uniform(0.1, 0.9)) for i in range(11)]
+        self.draw.line(points, fill="blue", width=max(self.dpi // 75, 1))
+        self.region("figure", [], bbox=(x1, y, x1 + w, y + h))
+        caption = self.text_line(x1, y + h + self.line_height * 0.5, f"Figure 1: {_sentence(self.rng, 5)}")
+        self.region("text", [caption])
+        return caption.bbox[3] + self.line_height * 2
+
+    def build(self) -> SyntheticPage:
+        y = self.title(self.margin)
+        bottom = self.height - self.margin
+        if self.kind == "text_columns":
+            while y < bottom - self.line_height * 12:
+                y = self.columns(y, rows=8)
+        elif self.kind == "table":
+            y = self.paragraph(self.margin, y, self.width - 2 * self.margin, 3)
+            y = self.table(y, rows=12, cols=5)
+            self.table(y, rows=6, cols=3)
+        elif self.kind == "list":
+            while y < bottom - self.line_height * 10:
+                y = self.bullets(y, items=6)
+        elif self.kind == "figure":
+            y = self.paragraph(self.margin, y, self.width - 2 * self.margin, 4)
+            y = self.figure(y)
+            self.paragraph(self.margin, y, self.width - 2 * self.margin, 4)
+        elif self.kind == "mixed":
+            y = self.columns(y, rows=6)
+            y = self.table(y, rows=5, cols=4)
+            y = self.bullets(y, items=4)
+            self.figure(y)
+        else:
+            raise ValueError(f"Unknown page kind: {self.kind}")
+        return SyntheticPage(self.kind, self.dpi, self.image, self.regions)
+
+
+def generate_page(kind: str, dpi: int, seed: int = 0) -> SyntheticPage:
+    """
+    Draw a synthetic page.
+
+    Args:
+        kind: One of PAGE_KINDS
+        dpi: Rendering resolution; the page is US Letter sized
+        seed: Seed for the generated text, so runs are reproducible
+
+    Returns:
+        The rendered page with its ground-truth regions and lines
+    """
+    return _PageBuilder(kind, dpi, seed).build()
+
+
+def generate_document(kinds: List[str], dpi: int, seed: int = 0) -> List[SyntheticPage]:
+    """Generate one page per entry in kinds."""
+    return [generate_page(kind, dpi, seed + i) for i, kind in enumerate(kinds)]
+
+
+def to_pdf(pages: List[SyntheticPage], path: str) -> str:
+    """Save pages as a multi-page PDF at their own resolution."""
+    images = [p.image for p in pages]
+    images[0].save(path, "PDF", save_all=True, append_images=images[1:], resolution=float(pages[0].dpi))
+    return path
+
+
+def ground_truth_text(page: SyntheticPage) -> Dict[str, Any]:
+    """Plain-text ground truth of a page, in drawing order."""
+    return {"page": page.name, "lines": [line.text for line in page.lines]}
@@ -0,0 +1,49 @@
+import gc
+import os
+
+'''
+Pre-fork multi-worker server (./serve.sh, or `gunicorn main:app` from
+backend/, which picks this file up).
+
+The master imports the application once, which builds the model engines
+(services/engines.py), and then forks WEB_CONCURRENCY uvicorn workers. The
+workers share the loaded model weights copy-on-write instead of each loading
+their own copy, so the memory of N workers is roughly one set of models plus
+N times the per-request working memory. `python -m tools.worker_memory`
+reports what each process really uses.
+
+Following the gc module documentation, garbage collection is off in the
+master while the application is imported and everything imported is frozen
+before forking, so a collection in a worker does not write to (and copy) the
+pages of the long-lived objects it inherited.
+
+Set the worker count with WEB_CONCURRENCY, not -w: the engines and the LLM
+rate limiter read it at import to split the CPUs and the LLM quota between
+the workers. LEVIOSA_PRELOAD=0 loads the application in every worker instead,
+for comparison.
+'''
+
+os.makedirs("data", exist_ok=True)
+
+workers = int(os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("LEVIOSA_BIND", "0.0.0.0:8000")
+preload_app = os.getenv("LEVIOSA_PRELOAD", "1").lower() not in ("0", "false", "no")
+pidfile = os.getenv("LEVIOSA_PIDFILE", os.path.join("data", "gunicorn.pid"))
+timeout = 120  # inference runs off the event loop, so only a stuck worker misses this
+graceful_timeout = 30
+
+if preload_app:
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()
+        from services import engines
+        engines.after_fork()
@@ -0,0 +1 @@
+# Offline load testing: an OpenAI-compatible stub server and a load generator
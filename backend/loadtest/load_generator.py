@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+'''
+Load generator for the Leviosa API.
+
+Uploads one document, then drives each selected route at the requested
+concurrency levels and reports throughput and p50/p95/p99 latency per route.
+Run the backend against the stub LLM server to load-test offline:
+
+    python -m loadtest.stub_llm_server --latency lognormal --latency-ms 800 &
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=stub uvicorn main:app --port 8000 &
+    python -m loadtest.load_generator --concurrency 1 4 16 --requests 64
+'''
+
+ROUTES = {
+    "layout": ("/layout/path", "path"),
+    "layout_enhanced": ("/layout/path/enhanced", "path"),
+    "ocr": ("/ocr/path", "path"),
+    "markdown": ("/layout/enhanced/markdown", "path"),
+    "markdown_stream": ("/layout/enhanced/markdown/stream", "path"),
+    "markdown_multipage": ("/layout/enhanced/markdown/direct/multipage", "path"),
+    "refine": ("/markdown/refine", "markdown"),
+}
+
+SAMPLE_MARKDOWN = (
+    "# Quarterly Report\n\nRevenue grew 12% year over year.\n\n"
+    "| Metric | Value |\n|---|---|\n| Revenue | 1,234 |\n| Margin | 23% |\n\n"
+    "- Outlook remains positive\n- Costs stable\n\n"
+)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+async def upload_document(session: aiohttp.ClientSession, api: str, file_path: str) -> str:
+    content_type = "application/pdf" if file_path.lower().endswith(".pdf") else "image/png"
+    form = aiohttp.FormData()
+    with open(file_path, "rb") as f:
+        form.add_field("file", f.read(), filename=os.path.basename(file_path), content_type=content_type)
+    async with session.post(f"{api}/upload", data=form) as response:
+        response.raise_for_status()
+        return (await response.json())["path"]
+
+
+def synthetic_document(pages: int) -> str:
+    """Write a synthetic multi-page PDF to a temporary file."""
+    from benchmarks.synthetic import PAGE_KINDS, generate_document, to_pdf
+
+    kinds = [PAGE_KINDS[i % len(PAGE_KINDS)] for i in range(pages)]
+    path = os.path.join(tempfile.mkdtemp(), "loadtest.pdf")
+    return to_pdf(generate_document(kinds, dpi=150), path)
+
+
+async def _one_request(session: aiohttp.ClientSession, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        async with session.post(url, json=payload) as response:
+            # Read the full body so streamed routes are timed to completion
+            await response.read()
+            status = response.status
+    except aiohttp.ClientError as e:
+        status = f"error: {type(e).__name__}"
+    return {"latency": time.perf_counter() - start, "status": status}
+
+
+async def run_route(session: aiohttp.ClientSession, url: str, payload: Dict[str, Any],
+                    concurrency: int, total: int) -> Dict[str, Any]:
+    """Send `total` requests to one route with at most `concurrency` in flight."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    samples: List[Dict[str, Any]] = []
+
+    async def worker():
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            samples.append(await _one_request(session, url, payload))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ok = [s["latency"] for s in samples if s["status"] == 200]
+    statuses: Dict[str, int] = {}
+    for s in samples:
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile(ok, 50) * 1000, 1),
+        "p95_ms": round(percentile(ok, 95) * 1000, 1),
+        "p99_ms": round(percentile(ok, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(ok) * 1000, 1) if ok else 0.0,
+    }
+
+
+async def main_async(args) -> Dict[str, Any]:
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency) * 2)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        file_path = args.file or synthetic_document(args.pages)
+        document_path = await upload_document(session, args.api, file_path)
+        print(f"[LOAD] Uploaded {file_path} as {document_path}")
+
+        markdown = SAMPLE_MARKDOWN * args.markdown_repeat
+        report: Dict[str, Any] = {"document": document_path, "routes": {}}
+        print(f"{'route':<20} {'conc':>5} {'ok':>6} {'rps':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        for route in args.routes:
+            path, kind = ROUTES[route]
+            payload = {"path": document_path} if kind == "path" else {"markdown": markdown, "raw_text": ""}
+            for concurrency in args.concurrency:
+                total = max(args.requests, concurrency)
+                result = await run_route(session, f"{args.api}{path}", payload, concurrency, total)
+                report["routes"].setdefault(route, []).append(result)
+                print(
+                    f"{route:<20} {concurrency:>5} {result['ok']:>3}/{total:<3}"
+                    f"{result['throughput_rps']:>8.2f} {result['p50_ms']:>10.1f} {result['p95_ms']:>10.1f} {result['p99_ms']:>10.1f}"
+                )
+        return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load generator for the Leviosa API")
+    parser.add_argument("--api", default="http://127.0.0.1:8000/api", help="Base URL of the API router")
+    parser.add_argument("--routes", nargs="+", default=["markdown", "markdown_stream", "refine"], choices=list(ROUTES))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per route and concurrency level")
+    parser.add_argument("--file", help="Document to upload; a synthetic PDF is generated when omitted")
+    parser.add_argument("--pages", type=int, default=3, help="Pages in the synthetic PDF")
+    parser.add_argument("--markdown-repeat", type=int, default=20, help="Size of the /markdown/refine input")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[LOAD] Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
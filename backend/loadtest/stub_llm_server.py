@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request # type: ignore
+from fastapi.responses import JSONResponse, StreamingResponse # type: ignore
+
+'''
+Local OpenAI-compatible stub for offline load tests.
+
+Implements POST /v1/chat/completions, including `stream: true` (server-sent
+events), with configurable latency, error rate and response size. Point the
+backend at it with OPENAI_BASE_URL=http://127.0.0.1:8900/v1.
+
+    python -m loadtest.stub_llm_server --latency lognormal --latency-ms 800 \
+        --latency-sigma 0.5 --error-rate 0.02 --response-tokens 400
+
+With --rpm / --tpm it enforces requests- and tokens-per-minute quotas that
+replenish continuously, like the real API: requests over quota get a 429, and
+every response carries the x-ratelimit-* headers of what is left.
+'''
+
+
+class StubConfig:
+    def __init__(
+        self,
+        latency: str = "fixed",
+        latency_ms: float = 500.0,
+        latency_sigma: float = 0.5,
+        latency_max_ms: float = 30000.0,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        response_tokens: int = 300,
+        response_ratio: Optional[float] = None,
+        stream_chunk_tokens: int = 8,
+        rpm: int = 0,
+        tpm: int = 0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.latency_max_ms = latency_max_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_tokens = response_tokens
+        self.response_ratio = response_ratio
+        self.stream_chunk_tokens = stream_chunk_tokens
+        self.rpm = rpm
+        self.tpm = tpm
+        self.remaining = [float(rpm), float(tpm)]  # requests, tokens
+        self.refilled = time.monotonic()
+        self.rejected = 0
+        self.rng = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        """Total time to completion in seconds, drawn from the configured distribution."""
+        if self.latency == "uniform":
+            value = self.rng.uniform(0, 2 * self.latency_ms)
+        elif self.latency == "normal":
+            value = self.rng.gauss(self.latency_ms, self.latency_sigma * self.latency_ms)
+        elif self.latency == "lognormal":
+            # latency_ms is the median; sigma controls the tail
+            value = self.latency_ms * self.rng.lognormvariate(0, self.latency_sigma)
+        else:
+            value = self.latency_ms
+        return min(max(value, 0.0), self.latency_max_ms) / 1000
+
+    def completion_tokens(self, prompt_tokens: int) -> int:
+        if self.response_ratio is not None:
+            return max(int(prompt_tokens * self.response_ratio), 1)
+        return self.response_tokens
+
+
+config = StubConfig()
+app = FastAPI(title="Leviosa LLM stub")
+
+FILLER = (
+    "## Section\n\nLorem ipsum dolor sit amet, consectetur adipiscing elit. "
+    "| Column | Value |\n|---|---|\n| Revenue | 1,234 |\n\n- item one\n- item two\n"
+).split(" ")
+
+
+def _estimate_tokens(messages) -> int:
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + 1
+
+
+def _markdown_tokens(count: int):
+    for i in range(count):
+        yield FILLER[i % len(FILLER)] + " "
+
+
+def _refill() -> None:
+    now = time.monotonic()
+    elapsed, config.refilled = now - config.refilled, now
+    for i, limit in enumerate((config.rpm, config.tpm)):
+        config.remaining[i] = min(limit, config.remaining[i] + elapsed * limit / 60)
+
+
+def _admit(tokens: int) -> bool:
+    """Count a request against the quotas; False when it is over."""
+    _refill()
+    requests, remaining_tokens = config.remaining
+    if (config.rpm and requests < 1) or (config.tpm and remaining_tokens < tokens):
+        config.rejected += 1
+        return False
+    config.remaining = [requests - 1, remaining_tokens - tokens]
+    return True
+
+
+def _rate_limit_headers() -> Dict[str, str]:
+    if not (config.rpm or config.tpm):
+        return {
+            "x-ratelimit-limit-requests": "10000",
+            "x-ratelimit-remaining-requests": "9999",
+            "x-ratelimit-limit-tokens": "2000000",
+            "x-ratelimit-remaining-tokens": "1999000",
+            "x-ratelimit-reset-requests": "6ms",
+            "x-ratelimit-reset-tokens": "30ms",
+        }
+    _refill()
+    headers = {}
+    for kind, limit, remaining, default in zip(("requests", "tokens"), (config.rpm, config.tpm),
+                                                config.remaining, (10000, 2000000)):
+        if not limit:  # only the other quota is enforced
+            limit, remaining = default, default
+        headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+        headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(remaining)))
+        # Time until the quota is full again
+        headers[f"x-ratelimit-reset-{kind}"] = f"{max(0.0, (limit - remaining) * 60 / limit):.3f}s"
+    return headers
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body: Dict[str, Any] = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "stub")
+    prompt_tokens = _estimate_tokens(messages)
+    completion_tokens = config.completion_tokens(prompt_tokens)
+    latency = config.sample_latency()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+
+    if not _admit(prompt_tokens + completion_tokens):
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            headers=_rate_limit_headers(),
+        )
+
+    if config.rng.random() < config.error_rate:
+        await asyncio.sleep(latency * config.rng.uniform(0.05, 0.3))
+        return JSONResponse(
+            status_code=config.error_status,
+            content={"error": {"message": "Stub error injected", "type": "stub_error", "code": config.error_status}},
+            headers={"retry-after": "1", **_rate_limit_headers()},
+        )
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency)
+        return JSONResponse(
+            content={
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(_markdown_tokens(completion_tokens))},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+            headers=_rate_limit_headers(),
+        )
+
+    async def events():
+        chunks = max(completion_tokens // config.stream_chunk_tokens, 1)
+        # Spend roughly a third of the latency before the first token
+        await asyncio.sleep(latency / 3)
+        tokens = list(_markdown_tokens(completion_tokens))
+        for i in range(chunks):
+            piece = "".join(tokens[i * config.stream_chunk_tokens:(i + 1) * config.stream_chunk_tokens])
+            if i == chunks - 1:
+                piece += "".join(tokens[chunks * config.stream_chunk_tokens:])
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep((latency * 2 / 3) / chunks)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=_rate_limit_headers())
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "owned_by": "stub"}]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", choices=["fixed", "uniform", "normal", "lognormal"], default="fixed")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Fixed/mean/median latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Spread for normal (relative) and lognormal")
+    parser.add_argument("--latency-max-ms", type=float, default=30000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--response-tokens", type=int, default=300)
+    parser.add_argument("--response-ratio", type=float, help="Size responses relative to the prompt instead")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests-per-minute quota (0: none)")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute quota (0: none)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    global config
+    config = StubConfig(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        latency_max_ms=args.latency_max_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        response_tokens=args.response_tokens,
+        response_ratio=args.response_ratio,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        seed=args.seed,
+    )
+
+    import uvicorn # type: ignore
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
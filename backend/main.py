@@ -7,8 +7,13 @@ from dotenv import load_dotenv   # type: ignore
 load_dotenv(override=True)
 print(f"OPENAI_API_KEY loaded: {'OPENAI_API_KEY' in os.environ}")
 
-from fastapi import FastAPI # type: ignore
-from routes import upload
+from fastapi import FastAPI, Request # type: ignore
+from fastapi.responses import JSONResponse # type: ignore
+from routes import batch, search, upload
+from services import loop_monitor, memory, tracing
+from services.input_limits import InputTooLarge
+from services.languages import UnsupportedLanguage
+from services.llm_providers import close_providers
 
 # Create uploads directory if it doesn't exist
 os.makedirs("uploads", exist_ok=True)
@@ -30,14 +35,100 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[tracing.TRACE_ID_HEADER, memory.PEAK_HEADER],
 )
 
+# Inputs over the page or pixel budget (services/input_limits.py)
+@app.exception_handler(InputTooLarge)
+async def input_too_large(request: Request, exc: InputTooLarge):
+    return JSONResponse(status_code=413, content={"detail": str(exc)})
+
+# Language hints the server is not configured for (services/languages.py)
+@app.exception_handler(UnsupportedLanguage)
+async def unsupported_language(request: Request, exc: UnsupportedLanguage):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+# Sampled per-request memory accounting (X-Leviosa-Memory header or LEVIOSA_MEMORY_SAMPLE_RATE)
+@app.middleware("http")
+async def measure_memory(request: Request, call_next):
+    if not memory.should_sample(request.headers):
+        return await call_next(request)
+
+    report = memory.MemoryReport(f"{request.method} {request.url.path}")
+    report.start()
+    try:
+        response = await call_next(request)
+    except Exception:
+        report.finish()
+        raise
+    response.headers[memory.PEAK_HEADER] = f"{report.peak_so_far() / 2**20:.1f}"
+
+    # Keep measuring until the body is sent so streamed pages are included
+    body_iterator = response.body_iterator
+
+    async def measured_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            report.finish()
+
+    response.body_iterator = measured_body()
+    return response
+
+# Opt-in request tracing (X-Leviosa-Trace header or ?trace= query flag)
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    mode = tracing.requested_mode(request.headers, request.query_params)
+    if mode is None:
+        return await call_next(request)
+
+    trace = tracing.Trace(f"{request.method} {request.url.path}", profile=(mode == "profile"))
+    trace.start()
+    try:
+        response = await call_next(request)
+    except Exception:
+        await tracing.finish_and_save(trace)
+        raise
+    response.headers[tracing.TRACE_ID_HEADER] = trace.trace_id
+
+    # Keep the trace open until the body is sent so streamed pages are included
+    body_iterator = response.body_iterator
+
+    async def traced_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            await tracing.finish_and_save(trace)
+
+    response.body_iterator = traced_body()
+    return response
+
 # Mount the uploads directory
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # Include routers
 app.include_router(upload.router, prefix="/api", tags=["Upload"])
 app.include_router(ocr_routes.router, prefix="/api", tags=["Parse"])
+app.include_router(search.router, prefix="/api", tags=["Search"])
+app.include_router(batch.router, prefix="/api", tags=["Batch"])
+
+@app.on_event("startup")
+async def startup():
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await loop_monitor.stop()
+    await close_providers()
+
+# Event-loop lag: stalls over LEVIOSA_LOOP_LAG_MS with the blocking stack
+@app.get("/api/health/loop")
+async def loop_health():
+    if loop_monitor.monitor is None:
+        return {"enabled": False}
+    return {"enabled": True, **loop_monitor.monitor.snapshot()}
 
 @app.get("/")
 async def root():
@@ -0,0 +1,136 @@
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from models.schema import LayoutAnalysisResponse
+
+'''
+Internal layout document model.
+
+The analyzer, postprocessor and Markdown builder pass these records to each
+other directly; Pydantic models are only built once, by `to_response()`, when
+a result leaves the API. Attribute names match the Pydantic models
+(region_type, bbox_norm, results, ...) so code that reads either works.
+'''
+
+
+class LayoutRegion:
+    """A detected region with array-backed bounding boxes."""
+
+    __slots__ = ("region_id", "region_type", "bbox_raw", "bbox_norm", "content", "page")
+
+    def __init__(self, region_id: str, region_type: str, bbox_raw: Iterable[float],
+                 bbox_norm: Iterable[float], content: Dict[str, Any], page: int):
+        self.region_id = region_id
+        self.region_type = region_type
+        self.bbox_raw = array("d", bbox_raw)
+        self.bbox_norm = array("d", bbox_norm)
+        self.content = content
+        self.page = page
+
+    @property
+    def text(self) -> str:
+        return self.content.get("text", "") if self.content else ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "region_id": self.region_id,
+            "region_type": self.region_type,
+            "bbox_raw": self.bbox_raw.tolist(),
+            "bbox_norm": self.bbox_norm.tolist(),
+            "content": self.content,
+            "page": self.page,
+        }
+
+    @classmethod
+    def from_any(cls, region: Any) -> "LayoutRegion":
+        """Build a record from a LayoutResult model or an equivalent dict."""
+        if isinstance(region, LayoutRegion):
+            return region
+        get = region.get if isinstance(region, dict) else lambda name, default=None: getattr(region, name, default)
+        return cls(
+            get("region_id", ""),
+            get("region_type", "unknown"),
+            get("bbox_raw", []) or [],
+            get("bbox_norm", []) or [],
+            get("content", {}) or {},
+            get("page", 1),
+        )
+
+
+class LayoutPage:
+    """
+    The regions of one page, how far the page was turned before analysis,
+    whether it was skipped as blank or as a duplicate of an earlier page, and
+    the language it was read in.
+    """
+
+    __slots__ = ("page", "results", "rotation", "skipped", "duplicate_of", "lang")
+
+    def __init__(self, page: int, results: Optional[List[LayoutRegion]] = None, rotation: int = 0,
+                 skipped: Optional[str] = None, duplicate_of: Optional[int] = None, lang: Optional[str] = None):
+        self.page = page
+        self.results = results if results is not None else []
+        self.rotation = rotation
+        self.skipped = skipped
+        self.duplicate_of = duplicate_of
+        self.lang = lang
+
+    def to_dict(self, exclude: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """The page as a dict; regions whose id is in `exclude` are left out."""
+        results = [r.to_dict() for r in self.results if not exclude or r.region_id not in exclude]
+        return {"page": self.page, "results": results, "rotation": self.rotation,
+                "skipped": self.skipped, "duplicate_of": self.duplicate_of, "lang": self.lang}
+
+    @classmethod
+    def from_any(cls, page: Any) -> "LayoutPage":
+        if isinstance(page, LayoutPage):
+            return page
+        if isinstance(page, dict):
+            return cls(page.get("page", 1), [LayoutRegion.from_any(r) for r in page.get("results", [])],
+                       page.get("rotation", 0), page.get("skipped"), page.get("duplicate_of"), page.get("lang"))
+        return cls(page.page, [LayoutRegion.from_any(r) for r in page.results], getattr(page, "rotation", 0),
+                   getattr(page, "skipped", None), getattr(page, "duplicate_of", None), getattr(page, "lang", None))
+
+
+class LayoutDocument:
+    """A whole layout analysis result plus document-level metadata."""
+
+    __slots__ = ("pages", "metadata")
+
+    def __init__(self, pages: Optional[List[LayoutPage]] = None, metadata: Optional[Dict[str, Any]] = None):
+        self.pages = pages if pages is not None else []
+        self.metadata = metadata if metadata is not None else {}
+
+    def regions(self) -> Iterable[LayoutRegion]:
+        for page in self.pages:
+            yield from page.results
+
+    def raw_text(self) -> str:
+        """Concatenated region text, one region per line."""
+        return "".join(region.content["text"] + "\n" for region in self.regions() if "text" in region.content)
+
+    def to_dict(self, exclude: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """
+        The document as a dict, with the boilerplate found by services.boilerplate
+        listed once. Regions whose id is in `exclude` are left out of the pages.
+        """
+        return {"pages": [page.to_dict(exclude) for page in self.pages],
+                "boilerplate": self.metadata.get("boilerplate")}
+
+    def to_response(self) -> LayoutAnalysisResponse:
+        """Validate into the API response model; the only Pydantic construction on the way out."""
+        return LayoutAnalysisResponse(**self.to_dict())
+
+    @classmethod
+    def from_response(cls, response: Any) -> "LayoutDocument":
+        """Build a document from a LayoutAnalysisResponse (or its dict form) received by the API."""
+        if isinstance(response, LayoutDocument):
+            return response
+        if isinstance(response, dict):
+            pages, boilerplate = response.get("pages", []), response.get("boilerplate")
+        else:
+            pages, boilerplate = response.pages, getattr(response, "boilerplate", None)
+        metadata = {}
+        if boilerplate:
+            metadata["boilerplate"] = [entry if isinstance(entry, dict) else entry.dict() for entry in boilerplate]
+        return cls([LayoutPage.from_any(page) for page in pages], metadata)
@@ -17,13 +17,36 @@ class LayoutResult(BaseModel):
 class LayoutPageResult(BaseModel):
     page: int
     results: List[LayoutResult]
+    rotation: int = 0  # counter-clockwise degrees the page was turned before analysis
+    skipped: Optional[str] = None  # "blank" or "duplicate" when the page did not go through the models
+    duplicate_of: Optional[int] = None  # for duplicates, the page whose results are repeated
+    lang: Optional[str] = None  # language the page was read in
+
+class BoilerplateRegion(BaseModel):
+    """A region repeated across pages (running header, footer, page number, notice), reported once"""
+    text: str
+    region_type: str
+    bbox_norm: List[float]
+    pages: List[int]
 
 class LayoutAnalysisResponse(BaseModel):
     pages: List[LayoutPageResult]
+    boilerplate: Optional[List[BoilerplateRegion]] = None  # set by the enhanced routes
+
+class PipelineOptions(BaseModel):
+    """Which pipeline stages run for a request"""
+    text: bool = True  # recognize text in regions; False returns layout boxes only
+    tables: bool = True  # table structure recognition (table regions fall back to plain text when off)
+    angle_cls: bool = True  # page orientation detection, plus per-line angle classification when unclear
+    reocr: bool = True  # re-read low-confidence lines from a higher-DPI render of the page (PDFs)
+    page_filter: bool = True  # skip blank pages and reuse results for near-duplicate pages (PDFs)
+    lang: Optional[str] = None  # language hint from LEVIOSA_LANGS, or "auto" to detect it on the first page; LEVIOSA_DEFAULT_LANG when omitted
 
 class OCRRequest(BaseModel):
     path: str
     prompt: Optional[str] = None
+    llm_provider: Optional[str] = None  # "openai", "local-server" or "local"; LLM_PROVIDER when omitted
+    options: Optional[PipelineOptions] = None
 
 class OCRResult(BaseModel):
     line_id: str
@@ -39,16 +62,90 @@ class OCRResult(BaseModel):
 class OCRPageResult(BaseModel):
     page: int
     results: List[OCRResult]
+    rotation: int = 0  # counter-clockwise degrees the page was turned before detection
+    skipped: Optional[str] = None  # "blank" or "duplicate" when the page did not go through the models
+    duplicate_of: Optional[int] = None  # for duplicates, the page whose results are repeated
+    lang: Optional[str] = None  # language the page was read in
 
 class OCRResponse(BaseModel):
     pages: List[OCRPageResult]
 
+class DocumentPage(BaseModel):
+    page: int
+    layout: Optional[LayoutPageResult] = None
+    markdown: Optional[str] = None  # with markdown=true
+    error: Optional[str] = None  # why the page could not be processed
+
+class DocumentPagesResponse(BaseModel):
+    doc_id: str
+    page_count: int
+    pages: List[DocumentPage]
+
+class BatchRequest(BaseModel):
+    paths: List[str]  # files in uploads/
+    llm_provider: Optional[str] = None
+    options: Optional[PipelineOptions] = None
+    markdown: bool = True  # False stops after layout analysis
+
+class BatchDocumentStatus(BaseModel):
+    doc_id: str
+    status: str  # queued, analyzing, converting, done or failed
+    pages: int
+    pages_analyzed: int
+    pages_converted: int
+    error: Optional[str] = None
+    seconds: Optional[float] = None
+
+class BatchStatus(BaseModel):
+    batch_id: str
+    status: str  # running or done
+    documents: List[BatchDocumentStatus]
+    pages: int
+    pages_analyzed: int
+    pages_converted: int
+    seconds: float
+
+class BatchPageResult(BaseModel):
+    page: int
+    markdown: Optional[str] = None
+    skipped: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchDocumentResult(BatchDocumentStatus):
+    markdown: Optional[str] = None  # once the document is done
+    raw_text: Optional[str] = None
+    page_results: List[BatchPageResult]
+    layout_data: Optional[Dict[str, Any]] = None  # with markdown=false
+
+class SearchHit(BaseModel):
+    doc_id: str  # file name in uploads/
+    page: int
+    region_type: str  # "line" for OCR lines, else the layout region type
+    bbox_norm: List[float]
+    text: str
+    highlight: str  # text with the matched terms in <mark> tags
+    score: float  # higher is better
+
+class SearchResponse(BaseModel):
+    query: str
+    hits: List[SearchHit]
+
 class MarkdownRequest(BaseModel):
     """Request model for markdown conversion"""
     ocr_response: OCRResponse
 
+class LLMCallError(BaseModel):
+    """An LLM call that failed, after any retries"""
+    page: Optional[int] = None  # the page it converted
+    section: Optional[int] = None  # or the markdown section it refined
+    error: str
+    status: Optional[int] = None  # HTTP status of the last attempt
+    attempts: int = 1
+    retryable: bool = False
+
 class MarkdownResponse(BaseModel):
     """Response model for markdown conversion"""
     markdown: str
     raw_text: str
-    layout_data: Optional[Dict[str, Any]] = None
\ No newline at end of file
+    layout_data: Optional[Dict[str, Any]] = None
+    errors: Optional[List[LLMCallError]] = None  # pages or sections that could not be converted
\ No newline at end of file
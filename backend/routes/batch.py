@@ -0,0 +1,79 @@
+import os
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException # type: ignore
+from models.schema import BatchRequest, BatchStatus, BatchDocumentResult
+from services.batch import MAX_DOCUMENTS, BatchScheduler
+from services.file_handler import save_file
+from services.layout_postprocessor import LayoutPostprocessor
+from services.markdown_processor import MarkdownProcessor
+from routes.ocr_routes import parse_options
+
+router = APIRouter()
+scheduler = BatchScheduler(LayoutPostprocessor(), MarkdownProcessor())
+
+ALLOWED_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg")
+
+def _check_count(count: int) -> None:
+    if count == 0:
+        raise HTTPException(status_code=400, detail="No documents given")
+    if count > MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_DOCUMENTS} documents per batch")
+
+@router.post("/batch", response_model=BatchStatus, status_code=202)
+async def create_batch(request: BatchRequest):
+    """
+    Process many previously uploaded files as one batch.
+    Pages of all documents share the inference and LLM workers fairly; poll
+    GET /batch/{batch_id} for progress and fetch each document's results when it is done.
+    """
+    _check_count(len(request.paths))
+    paths = []
+    for path in request.paths:
+        filename = os.path.basename(path)
+        full_path = os.path.join("uploads", filename)
+        if not filename.lower().endswith(ALLOWED_EXTENSIONS):
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {filename}")
+        if not os.path.exists(full_path):
+            raise HTTPException(status_code=404, detail=f"File not found: {filename}")
+        paths.append(full_path)
+
+    batch = scheduler.submit(paths, request.options, request.llm_provider, request.markdown)
+    return batch.progress()
+
+@router.post("/batch/upload", response_model=BatchStatus, status_code=202)
+async def create_batch_from_uploads(files: List[UploadFile] = File(...), options: Optional[str] = Form(None),
+                                    llm_provider: Optional[str] = Form(None), markdown: bool = Form(True)):
+    """
+    Upload many files and process them as one batch (see POST /batch).
+    The files are saved to uploads/ first; document ids are the saved file names.
+    """
+    _check_count(len(files))
+    allowed_types = ["image/png", "image/jpeg", "image/jpg", "application/pdf"]
+    for file in files:
+        if (file.content_type or "") not in allowed_types:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type for {file.filename}. Supported: {', '.join(allowed_types)}"
+            )
+    pipeline_options = parse_options(options)
+
+    paths = [os.path.join("uploads", await save_file(file)) for file in files]
+    batch = scheduler.submit(paths, pipeline_options, llm_provider, markdown)
+    return batch.progress()
+
+@router.get("/batch/{batch_id}", response_model=BatchStatus)
+async def batch_status(batch_id: str):
+    """Progress of a batch and of each of its documents."""
+    batch = scheduler.batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch not found: {batch_id}")
+    return batch.progress()
+
+@router.get("/batch/{batch_id}/documents/{doc_id}", response_model=BatchDocumentResult)
+async def batch_document(batch_id: str, doc_id: str):
+    """Results of one document of a batch: per-page Markdown as it arrives, the full Markdown once done."""
+    batch = scheduler.batches.get(batch_id)
+    doc = batch.document(doc_id) if batch is not None else None
+    if doc is None:
+        raise HTTPException(status_code=404, detail=f"Document not found in batch: {doc_id}")
+    return scheduler.results(batch, doc)
@@ -1,15 +1,21 @@
 import traceback
-from fastapi import APIRouter, UploadFile, File, HTTPException, WebSocket # type: ignore
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, WebSocket, Request, Query # type: ignore
 from fastapi.responses import StreamingResponse
-from models.schema import LayoutAnalysisResponse, OCRResponse, OCRRequest, MarkdownRequest, MarkdownResponse
-from services.ocr_paddleocr import extract_text_and_boxes
-from services.layout_analyzer import analyze_layout
+from models.schema import LayoutAnalysisResponse, OCRResponse, OCRRequest, MarkdownRequest, MarkdownResponse, PipelineOptions, DocumentPage, DocumentPagesResponse
+from models.document import LayoutDocument
+from services.ocr_paddleocr import extract_text_and_boxes, extract_pdf_pages
+from services.layout_analyzer import analyze_layout_document
 from services.layout_postprocessor import LayoutPostprocessor
-from services.pdf_to_image import convert_pdf_to_images
+from services.boilerplate import mark_boilerplate
+from services.input_limits import InputTooLarge
+from services.languages import UnsupportedLanguage, check as check_language
 from services.markdown_processor import MarkdownProcessor
 from services.markdown_refiner import MarkdownRefiner
+from services.llm_providers import LLMError
+from services.page_pipeline import MAX_RANGE, PREFETCH_PAGES, PagePipeline
+from services.response_encoding import encode_response, stream_encoder
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import json
 import asyncio
 
@@ -17,13 +23,42 @@ router = APIRouter()
 markdown_processor = MarkdownProcessor()
 layout_postprocessor = LayoutPostprocessor()
 markdown_refiner = MarkdownRefiner()
+page_pipeline = PagePipeline(layout_postprocessor, markdown_processor)
+
+def parse_options(raw: Optional[str]) -> Optional[PipelineOptions]:
+    """
+    Parse the `options` form field of upload routes, a JSON object such as
+    {"tables": false}. Returns None (full pipeline) when the field is absent.
+    """
+    if not raw:
+        return None
+    try:
+        options = PipelineOptions(**json.loads(raw))
+        check_language(options.lang)
+        return options
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid options: {e}")
+
+async def enhanced_layout_document(source, options: Optional[PipelineOptions] = None) -> LayoutDocument:
+    """
+    Layout analysis followed by region reclassification and cross-page
+    boilerplate detection, kept in the internal document model; callers
+    convert to Pydantic only for the response.
+    """
+    document = await analyze_layout_document(source, options)
+    layout_postprocessor.process_regions(document.pages)
+    mark_boilerplate(document)
+    return document
 
 # Layout analysis endpoint
 @router.post("/layout", response_model=LayoutAnalysisResponse)
-async def layout_from_upload(file: UploadFile = File(...)):
+async def layout_from_upload(file: UploadFile = File(...), options: Optional[str] = Form(None),
+                             http_request: Request = None):
     """
     Upload and analyze layout of a document.
     Returns semantic regions with their types and locations.
+    The response format is negotiated from the Accept header (JSON, columnar JSON or msgpack).
+    An optional `options` form field (JSON) skips pipeline stages, e.g. {"tables": false}.
     """
     allowed_types = ["image/png", "image/jpeg", "image/jpg", "application/pdf"]
     content_type = file.content_type or ""
@@ -33,12 +68,13 @@ async def layout_from_upload(file: UploadFile = File(...)):
             status_code=400,
             detail=f"Invalid file type. Supported: {', '.join(allowed_types)}"
         )
+    pipeline_options = parse_options(options)
 
-    return await analyze_layout(file)
+    return encode_response(http_request, await analyze_layout_document(file, pipeline_options))
 
 # Layout analysis from saved file
 @router.post("/layout/path", response_model=LayoutAnalysisResponse)
-async def layout_from_path(request: OCRRequest):
+async def layout_from_path(request: OCRRequest, http_request: Request = None):
     """
     Perform layout analysis on a previously uploaded file.
     """
@@ -49,15 +85,18 @@ async def layout_from_path(request: OCRRequest):
         if not os.path.exists(full_path):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
-        return await analyze_layout(full_path)
+        return encode_response(http_request, await analyze_layout_document(full_path, request.options))
 
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 # Upload File → OCR directly
 @router.post("/ocr/file", response_model=OCRResponse)
-async def ocr_from_upload(file: UploadFile = File(...)):
+async def ocr_from_upload(file: UploadFile = File(...), options: Optional[str] = Form(None),
+                          http_request: Request = None):
     """
     Upload and OCR a single image file.
     Supports PNG, JPG, JPEG.
@@ -70,13 +109,14 @@ async def ocr_from_upload(file: UploadFile = File(...)):
             status_code=400,
             detail=f"Invalid file type. Supported: {', '.join(allowed_types)}"
         )
+    pipeline_options = parse_options(options)
 
-    return await extract_text_and_boxes(file)
+    return encode_response(http_request, await extract_text_and_boxes(file, pipeline_options))
 
 
 # OCR from saved file path (e.g., after /upload)
 @router.post("/ocr/path", response_model=OCRResponse)
-async def ocr_from_path(request: OCRRequest):
+async def ocr_from_path(request: OCRRequest, http_request: Request = None):
     """
     Perform OCR using a path to a previously uploaded file.
     Supports PDFs (multi-page) and images.
@@ -90,18 +130,15 @@ async def ocr_from_path(request: OCRRequest):
         if not os.path.exists(full_path):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
-        # Handle PDF (convert pages first)
+        # Handle PDF (all pages)
         if filename.lower().endswith(".pdf"):
-            image_paths = convert_pdf_to_images(full_path)
-            results = []
-            for i, image_path in enumerate(image_paths):
-                page_result = await extract_text_and_boxes(image_path)
-                results.append(page_result.pages[0])  # Assumes 1 page per image
-            return OCRResponse(pages=results)
+            return encode_response(http_request, await extract_pdf_pages(full_path, request.options))
 
         # Image case
-        return await extract_text_and_boxes(full_path)
+        return encode_response(http_request, await extract_text_and_boxes(full_path, request.options))
 
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -135,7 +172,7 @@ async def ocr_to_markdown(file: UploadFile = File(...)):
     """
     try:
         # First perform OCR
-        ocr_response = await ocr_from_upload(file)
+        ocr_response = await ocr_from_upload(file, options=None)
         
         # Then convert to markdown
         raw_text = markdown_processor.ocr_to_raw_text(ocr_response)
@@ -146,12 +183,15 @@ async def ocr_to_markdown(file: UploadFile = File(...)):
             raw_text=raw_text
         )
         
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/layout/enhanced", response_model=LayoutAnalysisResponse)
-async def enhanced_layout_from_upload(file: UploadFile = File(...)):
+async def enhanced_layout_from_upload(file: UploadFile = File(...), options: Optional[str] = Form(None),
+                                      http_request: Request = None):
     """
     Upload and analyze layout of a document with enhanced region classification.
     This endpoint applies advanced heuristics to better classify document regions.
@@ -164,21 +204,16 @@ async def enhanced_layout_from_upload(file: UploadFile = File(...)):
             status_code=400,
             detail=f"Invalid file type. Supported: {', '.join(allowed_types)}"
         )
+    pipeline_options = parse_options(options)
 
-    # First perform basic layout analysis
-    layout_result = await analyze_layout(file)
-    
-    # Convert Pydantic models to dictionaries for postprocessing
-    pages_dict = [page.dict() for page in layout_result.pages]
+    # Perform layout analysis with enhancement
+    document = await enhanced_layout_document(file, pipeline_options)
     
-    # Apply enhancement
-    enhanced_pages = layout_postprocessor.process_regions(pages_dict)
-    
-    # Return as Pydantic response model
-    return LayoutAnalysisResponse(pages=enhanced_pages)
+    # Return in the negotiated format
+    return encode_response(http_request, document)
 
 @router.post("/layout/path/enhanced", response_model=LayoutAnalysisResponse)
-async def enhanced_layout_from_path(request: OCRRequest):
+async def enhanced_layout_from_path(request: OCRRequest, http_request: Request = None):
     """
     Perform enhanced layout analysis on a previously uploaded file.
     """
@@ -189,16 +224,13 @@ async def enhanced_layout_from_path(request: OCRRequest):
         if not os.path.exists(full_path):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
-        # First perform basic layout analysis
-        layout_result = await analyze_layout(full_path)
-        
-        # Then enhance region classifications
-        enhanced_result = LayoutAnalysisResponse(
-            pages=layout_postprocessor.process_regions(layout_result.pages)
-        )
+        # Perform layout analysis with enhancement
+        document = await enhanced_layout_document(full_path, request.options)
         
-        return enhanced_result
+        return encode_response(http_request, document)
 
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -217,39 +249,34 @@ async def enhanced_layout_to_markdown(request: OCRRequest):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
         # Perform layout analysis with enhancement
-        layout_result = await analyze_layout(full_path)
-        
-        # Convert Pydantic models to dictionaries for postprocessing
-        pages_dict = [page.dict() for page in layout_result.pages]
-        
-        # Apply enhancement
-        enhanced_pages = layout_postprocessor.process_regions(pages_dict)
-        enhanced_result = LayoutAnalysisResponse(pages=enhanced_pages)
+        document = await enhanced_layout_document(full_path, request.options)
         
         # Convert to markdown using layout awareness
-        markdown = await markdown_processor.layout_to_markdown(enhanced_result)
+        markdown, errors = await markdown_processor.layout_to_markdown(document, llm_provider=request.llm_provider)
         
         # Get raw text for backward compatibility
-        raw_text = ""
-        for page in enhanced_result.pages:
-            for region in page.results:
-                if "text" in region.content:
-                    raw_text += region.content["text"] + "\n"
+        raw_text = document.raw_text()
         
         return MarkdownResponse(
             markdown=markdown,
-            raw_text=raw_text
+            raw_text=raw_text,
+            errors=errors or None
         )
         
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=e.to_dict())
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/layout/enhanced/markdown/stream")
-async def stream_enhanced_layout_to_markdown(request: OCRRequest):
+async def stream_enhanced_layout_to_markdown(request: OCRRequest, http_request: Request = None):
     """
     Stream layout-enhanced results to markdown page by page.
-    Returns a streaming response with each page's markdown as it's processed.
+    Returns a streaming response with each page's markdown as it's processed,
+    as NDJSON or (with Accept: application/msgpack) a stream of msgpack objects.
     """
     try:
         filename = os.path.basename(request.path)
@@ -259,22 +286,19 @@ async def stream_enhanced_layout_to_markdown(request: OCRRequest):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
         # Perform layout analysis with enhancement
-        layout_result = await analyze_layout(full_path)
-        
-        # Convert Pydantic models to dictionaries for postprocessing
-        pages_dict = [page.dict() for page in layout_result.pages]
-        
-        # Apply enhancement
-        enhanced_pages = layout_postprocessor.process_regions(pages_dict)
-        enhanced_result = LayoutAnalysisResponse(pages=enhanced_pages)
+        document = await enhanced_layout_document(full_path, request.options)
         
         # Set up streaming response
+        media_type, encode = stream_encoder(http_request)
+
         async def generate():
-            async for page_result in markdown_processor.process_layout_incrementally(enhanced_result):
-                yield json.dumps(page_result) + "\n"
+            async for page_result in markdown_processor.process_layout_incrementally(document, llm_provider=request.llm_provider):
+                yield encode(page_result)
                 
-        return StreamingResponse(generate(), media_type="application/x-ndjson")
+        return StreamingResponse(generate(), media_type=media_type)
 
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -302,13 +326,11 @@ async def websocket_enhanced_layout_to_markdown(websocket: WebSocket):
             return
             
         # Perform layout analysis with enhancement
-        layout_result = await analyze_layout(full_path)
-        pages_dict = [page.dict() for page in layout_result.pages]
-        enhanced_pages = layout_postprocessor.process_regions(pages_dict)
-        enhanced_result = LayoutAnalysisResponse(pages=enhanced_pages)
+        options = PipelineOptions(**data["options"]) if data.get("options") else None
+        document = await enhanced_layout_document(full_path, options)
         
         # Process each page and send results in real-time
-        async for page_result in markdown_processor.process_layout_incrementally(enhanced_result):
+        async for page_result in markdown_processor.process_layout_incrementally(document, llm_provider=data.get("llm_provider")):
             await websocket.send_json(page_result)
             
         # Signal completion
@@ -335,27 +357,18 @@ async def direct_layout_to_markdown(request: OCRRequest):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
         # Perform layout analysis with enhancement
-        layout_result = await analyze_layout(full_path)
-        
-        # Convert Pydantic models to dictionaries for postprocessing
-        pages_dict = [page.dict() for page in layout_result.pages]
-        
-        # Apply enhancement
-        enhanced_pages = layout_postprocessor.process_regions(pages_dict)
-        enhanced_result = LayoutAnalysisResponse(pages=enhanced_pages)
+        document = await enhanced_layout_document(full_path, request.options)
         
         # Convert enhanced result to dictionary for direct processing
-        layout_json = enhanced_result.dict()
+        layout_json = document.to_dict()
         
-        # Convert to markdown directly using the existing prompt or user-provided prompt
-        markdown = await markdown_processor.direct_layout_to_markdown(layout_json, prompt=request.prompt)
+        # Convert to markdown directly using the existing prompt or user-provided prompt;
+        # boilerplate goes to the LLM once, not with every page
+        payload = document.to_dict(exclude=document.metadata.get("boilerplate_ids"))
+        markdown = await markdown_processor.direct_layout_to_markdown(payload, prompt=request.prompt, llm_provider=request.llm_provider)
         
         # Get raw text for backward compatibility
-        raw_text = ""
-        for page in enhanced_result.pages:
-            for region in page.results:
-                if "text" in region.content:
-                    raw_text += region.content["text"] + "\n"
+        raw_text = document.raw_text()
         
         return MarkdownResponse(
             markdown=markdown,
@@ -363,6 +376,10 @@ async def direct_layout_to_markdown(request: OCRRequest):
             layout_data=layout_json
         )
         
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=e.to_dict())
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -382,54 +399,96 @@ async def direct_multipage_layout_to_markdown(request: OCRRequest):
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
 
         # Perform layout analysis with enhancement
-        layout_result = await analyze_layout(full_path)
-        
-        # Convert Pydantic models to dictionaries for postprocessing
-        pages_dict = [page.dict() for page in layout_result.pages]
-        
-        # Apply enhancement
-        enhanced_pages = layout_postprocessor.process_regions(pages_dict)
-        enhanced_result = LayoutAnalysisResponse(pages=enhanced_pages)
+        document = await enhanced_layout_document(full_path, request.options)
         
         # Process all pages, not just the first one
-        markdown = await markdown_processor.convert_layout_json_to_markdown(enhanced_result)
+        markdown = await markdown_processor.convert_layout_json_to_markdown(document, llm_provider=request.llm_provider)
         
         # Get raw text for backward compatibility
-        raw_text = ""
-        for page in enhanced_result.pages:
-            for region in page.results:
-                if "text" in region.content:
-                    raw_text += region.content["text"] + "\n"
+        raw_text = document.raw_text()
         
         return MarkdownResponse(
             markdown=markdown,
             raw_text=raw_text
         )
         
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=e.to_dict())
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/documents/{doc_id}/pages", response_model=DocumentPagesResponse)
+async def document_pages(doc_id: str, from_page: int = Query(1, alias="from", ge=1),
+                         to_page: Optional[int] = Query(None, alias="to", ge=1), markdown: bool = False,
+                         llm_provider: Optional[str] = None, options: Optional[str] = None):
+    """
+    Process only a range of pages of a previously uploaded file, for viewers.
+    Pages are rasterized, analyzed and (with markdown=true) converted the first
+    time they are requested and memoized afterwards; the pages after the range
+    are prefetched in the background. `to` defaults to `from`.
+    """
+    full_path = os.path.join("uploads", os.path.basename(doc_id))
+    if not os.path.exists(full_path):
+        raise HTTPException(status_code=404, detail=f"File not found: {doc_id}")
+    document = page_pipeline.document(full_path, parse_options(options))
+
+    try:
+        page_count = await document.page_count()
+    except (InputTooLarge, UnsupportedLanguage):
+        raise
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    to_page = min(to_page or from_page, page_count)
+    if from_page > to_page:
+        raise HTTPException(status_code=400, detail=f"Page {from_page} is outside the document ({page_count} pages)")
+    if to_page - from_page + 1 > MAX_RANGE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RANGE} pages per request")
+
+    pages = range(from_page, to_page + 1)
+    tasks = [document.markdown(page, llm_provider) if markdown else document.layout(page) for page in pages]
+    results = await asyncio.gather(*(asyncio.shield(task) for task in tasks), return_exceptions=True)
+    document.prefetch(range(to_page + 1, min(page_count, to_page + PREFETCH_PAGES) + 1), markdown, llm_provider)
+
+    response_pages = []
+    for page, result in zip(pages, results):
+        if isinstance(result, (InputTooLarge, UnsupportedLanguage)):
+            raise result
+        if isinstance(result, Exception):
+            response_pages.append(DocumentPage(page=page, error=str(result)))
+            continue
+        layout_page = document.layout(page).result()
+        response_pages.append(DocumentPage(page=page, layout=layout_page.to_dict(),
+                                           markdown=result if markdown else None))
+    return DocumentPagesResponse(doc_id=os.path.basename(doc_id), page_count=page_count, pages=response_pages)
 
 @router.post("/markdown/refine", response_model=MarkdownResponse)
-async def refine_existing_markdown(request: MarkdownResponse):
+async def refine_existing_markdown(request: MarkdownResponse, llm_provider: Optional[str] = None):
     """
     Takes existing markdown (typically from layout analysis) and performs a second refinement pass.
     This improves formatting, fixes OCR errors, and creates display-ready markdown.
     
     Input should be a MarkdownResponse object with the 'markdown' field containing the content to refine.
+    The optional `llm_provider` query parameter selects the LLM provider for this request.
     """
     try:
         if not request.markdown:
             raise HTTPException(status_code=400, detail="No markdown content provided for refinement")
             
         # Run the refinement process on the existing markdown
-        refined_markdown = markdown_refiner.refine_markdown(request.markdown)
+        refined_markdown, errors = await markdown_refiner.refine_markdown(request.markdown, llm_provider=llm_provider)
         
         return MarkdownResponse(
             markdown=refined_markdown,
-            raw_text=request.raw_text
+            raw_text=request.raw_text,
+            errors=errors or None
         )
         
+    except LLMError as e:
+        raise HTTPException(status_code=502, detail=e.to_dict())
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,20 @@
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query # type: ignore
+from models.schema import SearchResponse
+from services import search_index
+
+router = APIRouter()
+
+@router.get("/search", response_model=SearchResponse)
+async def search_documents(q: str = Query(..., min_length=1), doc_id: Optional[str] = None,
+                           limit: int = Query(50, ge=1, le=search_index.MAX_HITS), offset: int = Query(0, ge=0)):
+    """
+    Search the text of processed documents.
+    All words must match; "quoted" parts match as phrases. Each hit has the
+    document (its file in /uploads), page and normalized box for highlighting.
+    """
+    if not search_index.ENABLED:
+        raise HTTPException(status_code=404, detail="The search index is disabled (LEVIOSA_SEARCH_INDEX)")
+    hits = await asyncio.to_thread(search_index.get_index().search, q, doc_id, limit, offset)
+    return SearchResponse(query=q, hits=hits)
@@ -0,0 +1,12 @@
+#!/usr/bin/env sh
+# Multi-worker server: the models are loaded once and shared copy-on-write by
+# the workers (see gunicorn.conf.py).
+#
+#   WEB_CONCURRENCY   worker processes (default: one per CPU)
+#   LEVIOSA_BIND      listen address (default: 0.0.0.0:8000)
+#
+# Extra arguments are passed to gunicorn.
+set -e
+cd "$(dirname "$0")"
+export WEB_CONCURRENCY="${WEB_CONCURRENCY:-$(nproc)}"
+exec gunicorn main:app -c gunicorn.conf.py "$@"
@@ -0,0 +1,312 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional
+
+from models.document import LayoutDocument, LayoutPage
+from models.schema import PipelineOptions
+from services import languages, search_index
+from services.boilerplate import mark_boilerplate
+from services.input_limits import plan_rasterization
+from services.layout_analyzer import analyze_layout_page
+from services.layout_postprocessor import LayoutPostprocessor
+from services.llm_providers import LLMConfigError
+from services.markdown_processor import MarkdownProcessor
+from services.page_filter import PageFilter
+from services.pdf_to_image import RASTER_DPI, convert_pdf_to_images
+from services.tracing import span
+
+'''
+Batch processing of many documents with one cross-document page scheduler.
+
+Every document of every batch is split into pages, and two pools of workers
+pull from shared queues:
+
+- LEVIOSA_BATCH_INFERENCE_WORKERS workers rasterize and analyze one page at a
+  time (the models). Model calls run one at a time (engines.exclusive()), so
+  extra workers rasterize and filter the next pages meanwhile
+- LEVIOSA_BATCH_LLM_CONCURRENCY workers convert one page at a time to
+  Markdown (the LLM)
+
+The queues hand out work round-robin across documents, one page per turn, so
+a 500-page document gets the same share of the workers as a 2-page one and
+the small documents of a batch finish early instead of waiting behind it.
+Once all pages of a document are analyzed, its document-level passes run
+(region reclassification, boilerplate, search index), and its pages join the
+LLM queue, so the models and the LLM work on different documents at once.
+
+Results match /layout/enhanced/markdown, except that PDFs are processed in
+full. Batches are kept in memory, the last BATCHES_KEPT of them.
+'''
+
+INFERENCE_WORKERS = int(os.getenv("LEVIOSA_BATCH_INFERENCE_WORKERS", "2"))
+LLM_CONCURRENCY = int(os.getenv("LEVIOSA_BATCH_LLM_CONCURRENCY", "8"))
+BATCHES_KEPT = 32
+MAX_DOCUMENTS = 500  # per batch
+
+
+class FairQueue:
+    """Work items grouped by owner, handed out one at a time per owner in turn."""
+
+    def __init__(self):
+        self._queues: "OrderedDict[Hashable, Deque[Any]]" = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def put(self, owner: Hashable, item: Any) -> None:
+        self._queues.setdefault(owner, deque()).append(item)
+        self._ready.set()
+
+    async def get(self) -> Any:
+        while not self._queues:
+            self._ready.clear()
+            await self._ready.wait()
+        owner, items = self._queues.popitem(last=False)
+        item = items.popleft()
+        if items:
+            self._queues[owner] = items  # back of the line
+        return item
+
+    def discard(self, owner: Hashable) -> None:
+        self._queues.pop(owner, None)
+
+
+class BatchDocument:
+    """One document of a batch: its pages, results and progress."""
+
+    def __init__(self, doc_id: str, path: str):
+        self.key = uuid.uuid4().hex  # queue owner; the same file may be in several batches
+        self.doc_id = doc_id
+        self.path = path
+        self.status = "queued"  # queued, analyzing, converting, done, failed
+        self.error: Optional[str] = None
+        self.page_count = 0
+        self.pages: Dict[int, LayoutPage] = {}
+        self.document: Optional[LayoutDocument] = None
+        self.markdown: Dict[int, str] = {}
+        self.page_errors: Dict[int, str] = {}
+        self.to_convert = 0
+        self.page_filter: Optional[PageFilter] = None
+        self.lang: Optional[str] = None  # detected on the first page read, for lang="auto"
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status not in ("done", "failed")
+
+    def fail(self, error: Exception) -> None:
+        self.status = "failed"
+        self.error = str(error) or type(error).__name__
+        self.finished = time.time()
+        print(f"[BATCH] {self.doc_id} failed: {self.error}")
+
+    def progress(self) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        return {
+            "doc_id": self.doc_id,
+            "status": self.status,
+            "pages": self.page_count,
+            "pages_analyzed": len(self.pages),
+            "pages_converted": len(self.markdown),
+            "error": self.error,
+            "seconds": round(end - self.started, 2) if self.started else None,
+        }
+
+
+class Batch:
+    def __init__(self, documents: List[BatchDocument], options: Optional[PipelineOptions],
+                 llm_provider: Optional[str], markdown: bool):
+        self.batch_id = uuid.uuid4().hex
+        self.documents = documents
+        self.options = options
+        self.llm_provider = llm_provider
+        self.markdown = markdown
+        self.created = time.time()
+        self.finished: Optional[float] = None
+
+    def document(self, doc_id: str) -> Optional[BatchDocument]:
+        return next((doc for doc in self.documents if doc.doc_id == doc_id), None)
+
+    def progress(self) -> Dict[str, Any]:
+        documents = [doc.progress() for doc in self.documents]
+        active = any(doc.active for doc in self.documents)
+        return {
+            "batch_id": self.batch_id,
+            "status": "running" if active else "done",
+            "documents": documents,
+            "pages": sum(doc["pages"] for doc in documents),
+            "pages_analyzed": sum(doc["pages_analyzed"] for doc in documents),
+            "pages_converted": sum(doc["pages_converted"] for doc in documents),
+            "seconds": round((self.finished or time.time()) - self.created, 2),
+        }
+
+
+class BatchScheduler:
+    """The process-wide scheduler: shared page queues and the worker pools that drain them."""
+
+    def __init__(self, postprocessor: LayoutPostprocessor, markdown_processor: MarkdownProcessor,
+                 inference_workers: int = INFERENCE_WORKERS, llm_concurrency: int = LLM_CONCURRENCY):
+        self.postprocessor = postprocessor
+        self.markdown_processor = markdown_processor
+        self.inference_workers = inference_workers
+        self.llm_concurrency = llm_concurrency
+        self.batches: "OrderedDict[str, Batch]" = OrderedDict()
+        self._inference: Optional[FairQueue] = None
+        self._llm: Optional[FairQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _start_workers(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        self._loop = loop
+        self._inference, self._llm = FairQueue(), FairQueue()
+        self._workers = ([loop.create_task(self._inference_worker()) for _ in range(self.inference_workers)]
+                         + [loop.create_task(self._llm_worker()) for _ in range(self.llm_concurrency)])
+
+    def submit(self, paths: List[str], options: Optional[PipelineOptions] = None,
+               llm_provider: Optional[str] = None, markdown: bool = True) -> Batch:
+        """
+        Queue files from uploads/ for processing.
+
+        Args:
+            paths: File paths
+            options: Pipeline stages, as for the single-document routes
+            llm_provider: Provider for the Markdown conversion
+            markdown: Convert to Markdown; False stops after layout analysis
+
+        Returns:
+            The batch, whose progress() and documents update as pages complete
+        """
+        self._start_workers()
+        documents = [BatchDocument(os.path.basename(path), path) for path in paths]
+        batch = Batch(documents, options, llm_provider, markdown)
+        self.batches[batch.batch_id] = batch
+        while len(self.batches) > BATCHES_KEPT:
+            self.batches.popitem(last=False)
+        for doc in documents:
+            asyncio.ensure_future(self._prepare(batch, doc))
+        print(f"[BATCH] {batch.batch_id}: {len(documents)} documents queued")
+        return batch
+
+    async def _prepare(self, batch: Batch, doc: BatchDocument) -> None:
+        """Count the pages of a document and queue them for analysis."""
+        try:
+            if doc.path.lower().endswith(".pdf"):
+                plan = await asyncio.to_thread(plan_rasterization, doc.path, RASTER_DPI)
+                page_count = plan.pages
+            else:
+                plan, page_count = None, 1
+        except Exception as e:
+            doc.fail(e)
+            self._check_batch(batch)
+            return
+        doc.page_count = page_count
+        doc.started = time.time()
+        doc.status = "analyzing"
+        if batch.options is None or batch.options.page_filter:
+            doc.page_filter = PageFilter()
+        if page_count == 0:
+            await self._finish_layout(batch, doc)
+        for page in range(1, page_count + 1):
+            self._inference.put(doc.key, (batch, doc, plan, page))
+
+    async def _inference_worker(self) -> None:
+        while True:
+            batch, doc, plan, page = await self._inference.get()
+            if not doc.active:
+                continue
+            try:
+                with span("batch.analyze", doc_id=doc.doc_id, page=page):
+                    doc.pages[page] = await self._analyze(batch, doc, plan, page)
+                if doc.active and len(doc.pages) == doc.page_count:
+                    await self._finish_layout(batch, doc)
+            except Exception as e:
+                doc.fail(e)
+                self._inference.discard(doc.key)
+                self._check_batch(batch)
+
+    async def _analyze(self, batch: Batch, doc: BatchDocument, plan: Any, page: int) -> LayoutPage:
+        if plan is None:
+            image_path = doc.path
+        else:
+            image_path = (await asyncio.to_thread(convert_pdf_to_images, doc.path, plan=plan,
+                                                  first_page=page, last_page=page))[0]
+        layout_page = await analyze_layout_page(image_path, page, languages.keep_detected(batch.options, doc.lang),
+                                                doc.page_filter)
+        doc.lang = doc.lang or layout_page.lang
+        return layout_page
+
+    async def _finish_layout(self, batch: Batch, doc: BatchDocument) -> None:
+        """Document-level passes once every page is analyzed, then queue the pages for the LLM."""
+        document = LayoutDocument([doc.pages[page] for page in sorted(doc.pages)])
+        self.postprocessor.process_regions(document.pages)
+        mark_boilerplate(document)
+        doc.document = document
+        await asyncio.to_thread(search_index.index_document, doc.path, search_index.layout_entries(document.pages),
+                                search_index.LAYOUT)
+
+        structured_pages = self.markdown_processor.structured_pages(document) if batch.markdown else []
+        if not structured_pages:
+            self._finish(batch, doc)
+            return
+
+        doc.status = "converting"
+        doc.to_convert = len(structured_pages)
+        for structured_page in structured_pages:
+            self._llm.put(doc.key, (batch, doc, structured_page["page"], structured_page))
+
+    async def _llm_worker(self) -> None:
+        while True:
+            batch, doc, page, structured_page = await self._llm.get()
+            if not doc.active:
+                continue
+            try:
+                with span("batch.markdown", doc_id=doc.doc_id, page=page):
+                    doc.markdown[page] = await self.markdown_processor.convert_page(
+                        structured_page, llm_provider=batch.llm_provider)
+            except LLMConfigError as e:
+                # Configuration errors (no API key, unknown provider) fail every page alike
+                doc.fail(e)
+                self._llm.discard(doc.key)
+                self._check_batch(batch)
+                continue
+            except Exception as e:
+                doc.markdown[page] = ""
+                doc.page_errors[page] = str(e)
+            if doc.active and len(doc.markdown) == doc.to_convert:
+                self._finish(batch, doc)
+
+    def _finish(self, batch: Batch, doc: BatchDocument) -> None:
+        # Duplicate pages repeat the Markdown of the page they copy; blank pages have none
+        for page in doc.document.pages:
+            if page.skipped:
+                doc.markdown[page.page] = doc.markdown.get(page.duplicate_of, "")
+        doc.status = "done"
+        doc.finished = time.time()
+        print(f"[BATCH] {doc.doc_id}: {doc.page_count} pages in {doc.finished - doc.started:.1f}s")
+        self._check_batch(batch)
+
+    def _check_batch(self, batch: Batch) -> None:
+        if batch.finished is None and not any(doc.active for doc in batch.documents):
+            batch.finished = time.time()
+            print(f"[BATCH] {batch.batch_id} done in {batch.finished - batch.created:.1f}s")
+
+    def results(self, batch: Batch, doc: BatchDocument) -> Dict[str, Any]:
+        """The results of one document so far; `markdown` is complete once the document is done."""
+        pages = doc.document.pages if doc.document is not None else [doc.pages[p] for p in sorted(doc.pages)]
+        return {
+            **doc.progress(),
+            "markdown": "\n\n".join(doc.markdown[p.page] for p in pages if not p.skipped and p.page in doc.markdown)
+            if doc.status == "done" and batch.markdown else None,
+            "raw_text": doc.document.raw_text() if doc.document is not None else None,
+            "page_results": [
+                {"page": p.page, "markdown": doc.markdown.get(p.page), "skipped": p.skipped,
+                 "error": doc.page_errors.get(p.page)}
+                for p in pages
+            ],
+            "layout_data": doc.document.to_dict() if doc.document is not None and not batch.markdown else None,
+        }
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from models.document import LayoutDocument, LayoutRegion
+from services.tracing import span
+
+'''
+Cross-page boilerplate detection.
+
+Running headers, footers, page numbers and legal notices repeat on every page
+of long documents. After region reclassification, each text region is keyed by
+a hash of its normalized text and the centre of its normalized box. In the top
+and bottom margins digits are folded, so "Page 3 of 90" and "Page 4 of 90"
+match; elsewhere the text must repeat exactly, so body lines that differ only
+in their figures are kept. Regions with the same text whose centres lie within
+BAND of each other are copies of one region, however their positions jitter
+from page to page. Regions repeated on enough pages are boilerplate: they stay
+in the layout result, but the Markdown payloads skip them and carry each one
+once, from `document.metadata["boilerplate"]`.
+
+Centres are bucketed on a BAND grid and only the neighbouring cells are
+compared, so the cost stays close to linear in the number of regions.
+'''
+
+ENABLED = os.getenv("LEVIOSA_BOILERPLATE", "1").lower() not in ("0", "false", "no")
+MIN_PAGES = 3  # documents shorter than this have no boilerplate
+MIN_REPEATS = 2  # pages a region must at least be on, however short the document
+MIN_SHARE = float(os.getenv("LEVIOSA_BOILERPLATE_MIN_SHARE", "0.5"))  # of the pages a key must appear on
+BAND = 0.05  # how far the centres of copies may drift, as a fraction of the page
+MAX_TEXT = 300  # longer regions are body text, not boilerplate
+MARGIN = 0.12  # top and bottom share of the page where page numbers are folded
+
+
+def normalize_text(text: str, fold_digits: bool = False) -> str:
+    """Lower-case with whitespace collapsed; digit runs become '#' when fold_digits is set."""
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return re.sub(r'\d+', '#', text) if fold_digits else text
+
+
+def region_key(region: LayoutRegion) -> Tuple[str, float, float]:
+    """Normalized text hash and centre of the box of a region."""
+    x1, y1, x2, y2 = region.bbox_norm if len(region.bbox_norm) == 4 else (0, 0, 0, 0)
+    in_margin = y2 <= MARGIN or y1 >= 1 - MARGIN
+    digest = hashlib.blake2b(normalize_text(region.text, in_margin).encode("utf-8"), digest_size=8).hexdigest()
+    return digest, (x1 + x2) / 2, (y1 + y2) / 2
+
+
+def _copies(regions: List[LayoutRegion], centres: List[Tuple[float, float]]) -> List[List[LayoutRegion]]:
+    """
+    Group regions with the same text into copies of one region: centres within
+    BAND of each other, directly or through other copies.
+    """
+    parent = list(range(len(regions)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+    for i, (x, y) in enumerate(centres):
+        cx, cy = int(x / BAND), int(y / BAND)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    if abs(centres[j][0] - x) <= BAND and abs(centres[j][1] - y) <= BAND:
+                        parent[find(i)] = find(j)
+        cells[(cx, cy)].append(i)
+
+    groups: Dict[int, List[LayoutRegion]] = defaultdict(list)
+    for i, region in enumerate(regions):
+        groups[find(i)].append(region)
+    return list(groups.values())
+
+
+def mark_boilerplate(document: LayoutDocument) -> List[Dict[str, Any]]:
+    """
+    Find regions repeated across pages and record them in the document metadata.
+
+    Sets `metadata["boilerplate"]` to one entry per repeated region (text, type,
+    box and the pages it is on) and `metadata["boilerplate_ids"]` to the ids of
+    every repeated copy.
+
+    Args:
+        document: The layout document, after region reclassification
+
+    Returns:
+        The boilerplate entries
+    """
+    # Blank pages and copies of repeated pages do not count
+    counted = [page for page in document.pages if not page.skipped]
+    pages = len(counted)
+    if not ENABLED or pages < MIN_PAGES:
+        return []
+
+    with span("boilerplate", pages=pages) as s:
+        by_text: Dict[str, Tuple[List[LayoutRegion], List[Tuple[float, float]]]] = defaultdict(lambda: ([], []))
+        for page in counted:
+            for region in page.results:
+                text = region.text
+                if text.strip() and len(text) <= MAX_TEXT:
+                    digest, x, y = region_key(region)
+                    same_text, centres = by_text[digest]
+                    same_text.append(region)
+                    centres.append((x, y))
+
+        needed = max(MIN_REPEATS, int(pages * MIN_SHARE + 0.5))
+        entries, ids = [], set()
+        for same_text, centres in by_text.values():
+            if len(same_text) < needed:
+                continue
+            for regions in _copies(same_text, centres):
+                on_pages = sorted({region.page for region in regions})
+                if len(on_pages) < needed:
+                    continue
+                first = regions[0]
+                entries.append({
+                    "text": first.text,
+                    "region_type": first.region_type,
+                    "bbox_norm": first.bbox_norm.tolist(),
+                    "pages": on_pages,
+                })
+                ids.update(region.region_id for region in regions)
+
+        document.metadata["boilerplate"] = entries
+        document.metadata["boilerplate_ids"] = ids
+        s.set(entries=len(entries), regions=len(ids))
+    if entries:
+        print(f"[BOILERPLATE] {len(ids)} regions repeated across pages, {len(entries)} kept once")
+    return entries
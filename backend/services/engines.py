@@ -0,0 +1,366 @@
+import copy
+import gc
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.schema import PipelineOptions
+from services import languages
+from services.tracing import span
+
+'''
+Shared model engines.
+
+The full PP-Structure engine and the PaddleOCR engine are built once at
+import. Cheaper per-request variants (no table recognition, layout boxes only)
+are pre-built as shallow copies of the full engine with the skipped
+sub-systems switched off, so they share the already-loaded predictors instead
+of loading another copy of the models.
+
+LEVIOSA_INFERENCE_PROFILE selects how the Paddle predictors run on CPU:
+- default: Paddle's defaults (fp32, no oneDNN)
+- mkldnn: oneDNN kernels with per-engine thread counts
+- int8: oneDNN with the int8-quantized det/rec/layout models from
+  LEVIOSA_INT8_MODEL_DIR (see tools/quantize_models.py)
+
+Threads per engine default to the CPU count divided by the number of worker
+processes (WEB_CONCURRENCY); LEVIOSA_CPU_THREADS overrides it.
+
+LEVIOSA_ENGINE_BACKEND=onnx swaps both engines for ONNX Runtime versions of
+the same models (services/onnx_engines.py, exported with tools/export_onnx.py
+into LEVIOSA_ONNX_MODEL_DIR), so paddle does not need to be installed.
+
+Engines are kept per language (services/languages.py). The default
+language's engines are built at import and stay in memory; another language
+is loaded the first time a request asks for it, and at most
+LEVIOSA_MAX_RESIDENT_LANGS languages (the default one included) are kept,
+the least recently used one being dropped to make room. A language only adds
+its detection and recognition models: its structure engine is a view of the
+default one that reads text with the language's OCR engine, sharing the
+layout and table models. Requests still running on a dropped language keep
+their engines until they finish.
+
+Paddle predictors must not run in two threads at once, and the engines share
+predictors (variants, language views), so every call into an engine goes
+through exclusive(): with the paddle backend, inference runs one call at a time
+per process while rasterization, filtering and post-processing of other pages
+go on. ONNX Runtime sessions run concurrently.
+
+Under the pre-fork server (gunicorn.conf.py) the engines are built once in
+the master and inherited by the workers; see after_fork().
+'''
+
+LAYOUT_MODEL_DIR = 'models/layout_ppv3_infer'
+LAYOUT_DICT_PATH = 'models/layout_dict.txt'
+DET_MODEL_DIR = 'models/{lang}_PP-OCRv3_det_infer'
+REC_MODEL_DIR = 'models/{lang}_PP-OCRv3_rec_infer'
+
+INFERENCE_PROFILES = ["default", "mkldnn", "int8"]
+INFERENCE_PROFILE = os.getenv("LEVIOSA_INFERENCE_PROFILE", "default")
+INT8_MODEL_ROOT = os.getenv("LEVIOSA_INT8_MODEL_DIR", "models/int8")
+
+ENGINE_BACKENDS = ["paddle", "onnx"]
+ENGINE_BACKEND = os.getenv("LEVIOSA_ENGINE_BACKEND", "paddle")
+ONNX_MODEL_DIR = os.getenv("LEVIOSA_ONNX_MODEL_DIR", "models/onnx")
+
+MAX_RESIDENT_LANGS = max(1, int(os.getenv("LEVIOSA_MAX_RESIDENT_LANGS", "2")))
+
+DEFAULT_OPTIONS = PipelineOptions()
+
+# The default language's engines
+structure_engine = None
+ocr_engine = None
+
+_inference_lock = threading.Lock() if ENGINE_BACKEND == "paddle" else None
+
+
+def cpu_threads() -> int:
+    """Threads per engine: an explicit LEVIOSA_CPU_THREADS, else the CPUs shared between workers."""
+    if os.getenv("LEVIOSA_CPU_THREADS"):
+        return max(1, int(os.environ["LEVIOSA_CPU_THREADS"]))
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def exclusive(run: Callable[..., Any]) -> Callable[..., Any]:
+    """`run` holding the inference lock while it runs; wrap every call into an engine with it."""
+    if _inference_lock is None:
+        return run
+
+    def locked(*args, **kwargs):
+        with _inference_lock:
+            return run(*args, **kwargs)
+    return locked
+
+
+def model_dir(fp32_dir: str, profile: str) -> str:
+    """The model directory for a profile; int8 falls back to fp32 when no quantized model exists."""
+    if profile != "int8":
+        return fp32_dir
+    quantized = os.path.join(INT8_MODEL_ROOT, os.path.basename(fp32_dir))
+    if os.path.exists(os.path.join(quantized, "inference.pdmodel")):
+        return quantized
+    print(f"[ENGINES] No int8 model at {quantized}, using {fp32_dir}")
+    return fp32_dir
+
+
+def profile_args(profile: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Predictor settings shared by both engines for an inference profile.
+
+    Args:
+        profile: One of INFERENCE_PROFILES; LEVIOSA_INFERENCE_PROFILE when omitted
+
+    Returns:
+        Keyword arguments for PaddleOCR / PPStructure
+    """
+    profile = profile or INFERENCE_PROFILE
+    if profile not in INFERENCE_PROFILES:
+        raise ValueError(f"Unknown inference profile '{profile}'. Available: {', '.join(INFERENCE_PROFILES)}")
+    if profile == "default":
+        return {}
+    args = {"enable_mkldnn": True, "cpu_threads": cpu_threads()}
+    if profile == "int8":
+        args["precision"] = "int8"
+    return args
+
+
+def build_structure_engine(profile: Optional[str] = None):
+    """Initialize PP-Structure layout analysis with tables and text recognition (default language)"""
+    from paddleocr import PPStructure
+
+    profile = profile or INFERENCE_PROFILE
+    args = profile_args(profile)
+    print(f"[ENGINES] Building PP-Structure with profile '{profile}' {args}")
+    return PPStructure(
+        table=True,
+        ocr=True,
+        layout=True,
+        show_log=True,
+        recovery=False,
+        use_pdf2docx_api=False,
+        lang=languages.DEFAULT_LANG,
+        layout_model_dir=model_dir(LAYOUT_MODEL_DIR, profile),
+        layout_dict_path=LAYOUT_DICT_PATH,
+        **args,
+    )
+
+
+def build_ocr_engine(profile: Optional[str] = None, lang: Optional[str] = None):
+    """Initialize PaddleOCR (lightweight version, CPU) for a language; PaddleOCR fetches missing models"""
+    from paddleocr import PaddleOCR
+
+    profile = profile or INFERENCE_PROFILE
+    lang = lang or languages.DEFAULT_LANG
+    args = profile_args(profile)
+    print(f"[ENGINES] Building PaddleOCR '{lang}' with profile '{profile}' {args}")
+    return PaddleOCR(
+        use_angle_cls=True,
+        lang=lang,
+        det_model_dir=model_dir(DET_MODEL_DIR.format(lang=lang), profile),
+        rec_model_dir=model_dir(REC_MODEL_DIR.format(lang=lang), profile),
+        use_gpu=False,
+        **args,
+    )
+
+
+def build_onnx_engines(model_dir: str = ONNX_MODEL_DIR) -> Tuple[Any, Any]:
+    """Build the ONNX Runtime structure and OCR engines; the structure engine reuses the OCR models."""
+    from services.onnx_engines import OnnxOCR, OnnxStructure
+
+    threads = cpu_threads()
+    print(f"[ENGINES] Building ONNX Runtime engines from {model_dir} ({threads} threads)")
+    ocr = OnnxOCR(model_dir, threads)
+    return OnnxStructure(model_dir, LAYOUT_DICT_PATH, ocr, threads), ocr
+
+
+def build_onnx_ocr(lang: str) -> Any:
+    """The ONNX Runtime OCR engine of another language, exported into LEVIOSA_ONNX_MODEL_DIR/<lang>."""
+    from services.onnx_engines import OnnxOCR
+
+    path = os.path.join(ONNX_MODEL_DIR, lang)
+    print(f"[ENGINES] Building ONNX Runtime OCR '{lang}' from {path} ({cpu_threads()} threads)")
+    return OnnxOCR(path, cpu_threads())
+
+
+def build_engines() -> Tuple[Any, Any]:
+    """The structure and OCR engines for the configured backend."""
+    if ENGINE_BACKEND not in ENGINE_BACKENDS:
+        raise ValueError(f"Unknown engine backend '{ENGINE_BACKEND}'. Available: {', '.join(ENGINE_BACKENDS)}")
+    if ENGINE_BACKEND == "onnx":
+        return build_onnx_engines()
+    return build_structure_engine(), build_ocr_engine()
+
+
+def _make_variant(engine, tables: bool, text: bool):
+    """A view of the full engine with table and/or text recognition turned off."""
+    variant = copy.copy(engine)
+    if not tables:
+        variant.table_system = None
+    if not text:
+        variant.text_system = None
+        variant.table_system = None
+    return variant
+
+
+def _reading_with(structure, ocr):
+    """A view of the default structure engine that reads text with another language's OCR engine."""
+    view = copy.copy(structure)
+    if getattr(view, "text_system", None) is not None:
+        text_system = copy.copy(ocr)
+        if hasattr(text_system, "use_angle_cls"):
+            text_system.use_angle_cls = False  # like the structure engine's own text system
+        view.text_system = text_system
+    table_system = getattr(view, "table_system", None)
+    if table_system is not None and hasattr(table_system, "text_recognizer"):
+        # Table cells are read with the language's models too
+        table_system = copy.copy(table_system)
+        table_system.text_detector = getattr(ocr, "text_detector", table_system.text_detector)
+        table_system.text_recognizer = getattr(ocr, "text_recognizer", table_system.text_recognizer)
+        view.table_system = table_system
+    return view
+
+
+class _Language:
+    """The engines of one language: OCR, structure, and the structure variants for skipped stages."""
+
+    __slots__ = ("structure", "ocr", "variants")
+
+    def __init__(self, structure, ocr):
+        self.structure = structure
+        self.ocr = ocr
+        self.variants = {
+            (tables, text): _make_variant(structure, tables, text) if structure is not None else None
+            for tables, text in [(False, True), (False, False)]
+        }
+
+
+_resident: "OrderedDict[str, _Language]" = OrderedDict()  # least recently used first
+_registry_lock = threading.Lock()
+_loading: Dict[str, threading.Lock] = {}
+
+
+def install(structure=None, ocr=None) -> None:
+    """
+    Set the default language's engines used by the services and pre-build the
+    structure variants; other languages are dropped, as they are built on them.
+    Called at import with freshly built engines; benchmarks pass stand-ins.
+    """
+    global structure_engine, ocr_engine
+    if structure is not None:
+        structure_engine = structure
+    if ocr is not None:
+        ocr_engine = ocr
+    with _registry_lock:
+        _resident.clear()
+        _resident[languages.DEFAULT_LANG] = _Language(structure_engine, ocr_engine)
+
+
+def _build_language(lang: str, default: _Language) -> _Language:
+    ocr = build_onnx_ocr(lang) if ENGINE_BACKEND == "onnx" else build_ocr_engine(lang=lang)
+    return _Language(_reading_with(default.structure, ocr), ocr)
+
+
+def _evict() -> List[str]:
+    """Drop the least recently used languages over MAX_RESIDENT_LANGS; the default one stays."""
+    evicted = []
+    while len(_resident) > MAX_RESIDENT_LANGS:
+        lang = next((lang for lang in _resident if lang != languages.DEFAULT_LANG), None)
+        if lang is None:
+            break
+        del _resident[lang]
+        evicted.append(lang)
+    return evicted
+
+
+def _language(lang: Optional[str]) -> _Language:
+    """The engines of a language, loading them on first use; blocks while they load."""
+    lang = lang or languages.DEFAULT_LANG
+    with _registry_lock:
+        entry = _resident.get(lang)
+        if entry is not None:
+            _resident.move_to_end(lang)
+            return entry
+        if lang not in languages.LANGUAGES:
+            raise languages.UnsupportedLanguage(
+                f"Unsupported language '{lang}'. Available: {', '.join(languages.LANGUAGES)}")
+        loading = _loading.setdefault(lang, threading.Lock())
+
+    # One load per language at a time; other languages stay available meanwhile
+    with loading:
+        with _registry_lock:
+            entry = _resident.get(lang)
+            if entry is not None:
+                _resident.move_to_end(lang)
+                return entry
+            default = _resident[languages.DEFAULT_LANG]
+        with span("engines.load", lang=lang):
+            entry = _build_language(lang, default)
+        with _registry_lock:
+            _resident[lang] = entry
+            evicted = _evict()
+            resident = list(_resident)
+    if evicted:
+        print(f"[ENGINES] Dropped {', '.join(evicted)} (LEVIOSA_MAX_RESIDENT_LANGS={MAX_RESIDENT_LANGS})")
+        gc.collect()
+    print(f"[ENGINES] Languages in memory: {', '.join(resident)}")
+    return entry
+
+
+def resident_languages() -> List[str]:
+    with _registry_lock:
+        return list(_resident)
+
+
+def get_structure_engine(options: Optional[PipelineOptions] = None, lang: Optional[str] = None):
+    """
+    Pick the structure engine variant for the requested stages and language.
+
+    Args:
+        options: Stage selection; the full pipeline when omitted
+        lang: A language of LEVIOSA_LANGS; the default language when omitted.
+            Loads the language's models if they are not in memory.
+
+    Returns:
+        A PP-Structure engine (or shared-model variant of it)
+    """
+    options = options or DEFAULT_OPTIONS
+    engines = _language(lang)
+    if options.tables and options.text:
+        return engines.structure
+    return engines.variants[(options.tables and options.text, options.text)]
+
+
+def get_ocr_engine(lang: Optional[str] = None):
+    """The OCR engine of a language (the default one when omitted), loaded on first use."""
+    return _language(lang).ocr
+
+
+def detect_language(image_np: np.ndarray) -> str:
+    """The language of an upright page for lang="auto"; the default language when no lines can be read."""
+    detected = languages.detect_language(image_np, lambda lang: exclusive(get_ocr_engine(lang).text_recognizer),
+                                         resident_languages())
+    return detected or languages.DEFAULT_LANG
+
+
+def after_fork() -> None:
+    """
+    Prepare the inherited engines in a freshly forked worker.
+
+    Threads do not survive fork. Paddle predictors start their OpenMP /
+    oneDNN threads on first use, which happens in the worker, so they are
+    shared as they are. ONNX Runtime sessions start their intra-op threads
+    when they are built: with one thread per worker they are shared as well,
+    with more the worker builds its own sessions (and its own copy of the
+    models) so it does not run single-threaded. Other languages are loaded
+    in the workers, when requests need them.
+    """
+    if ENGINE_BACKEND == "onnx" and cpu_threads() > 1:
+        print(f"[ENGINES] Rebuilding the ONNX Runtime sessions in worker {os.getpid()} for {cpu_threads()} threads")
+        install(*build_onnx_engines())
+
+
+install(*build_engines())
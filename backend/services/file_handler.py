@@ -1,4 +1,5 @@
 from fastapi import UploadFile # type: ignore
+import asyncio
 import os
 import shutil
 from typing import Union, BinaryIO
@@ -19,6 +20,10 @@ def get_file_path(filename: str) -> str:
     """
     return os.path.join("uploads", filename)
 
+def _write_file(path: str, content: bytes) -> None:
+    with open(path, "wb") as buffer:
+        buffer.write(content)
+
 async def save_file(file: UploadFile) -> str:
     """
     Save an uploaded file to the uploads directory with a unique UUID filename.
@@ -33,10 +38,9 @@ async def save_file(file: UploadFile) -> str:
     unique_filename = f"{uuid.uuid4()}.{file_extension}"
     file_path = os.path.join("uploads", unique_filename)
 
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+    # Save file (the write goes to a thread so large uploads do not block the event loop)
+    content = await file.read()
+    await asyncio.to_thread(_write_file, file_path, content)
     await file.seek(0)
     return unique_filename
 
@@ -0,0 +1,162 @@
+import io
+import os
+import re
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from services.tracing import span
+
+'''
+Input budgets, checked before anything is decoded.
+
+- LEVIOSA_MAX_PAGES: PDFs with more pages are rejected
+- LEVIOSA_MAX_PAGE_PIXELS: pixels of one decoded page or image. PDFs are
+  rasterized at a lower DPI so their largest page fits; images are decoded at
+  a reduced scale (JPEG draft mode) or resized right after decoding
+- LEVIOSA_MAX_DECODE_PIXELS: pixels an oversized image may be decoded at
+  before it is resized, 4x the page budget by default. Only JPEG decodes at a
+  reduced scale (down to 1/8 per side); PNG, TIFF and other formats decode at
+  full size, so above this they are rejected
+- LEVIOSA_OVERSIZE=reject rejects oversized pages and images instead
+
+Page sizes come from `pdfinfo` and image sizes from the image header, so an
+oversized input never reaches the models at full size. Rejections raise
+InputTooLarge, which the API answers with 413.
+'''
+
+MAX_PAGES = int(os.getenv("LEVIOSA_MAX_PAGES", "500"))
+MAX_PAGE_PIXELS = int(os.getenv("LEVIOSA_MAX_PAGE_PIXELS", "40000000"))
+MAX_DECODE_PIXELS = int(os.getenv("LEVIOSA_MAX_DECODE_PIXELS", str(4 * MAX_PAGE_PIXELS)))
+DRAFT_SCALE = {"JPEG": 8}  # formats PIL can decode at a reduced scale, and the largest reduction per side
+OVERSIZE_ACTIONS = ["downscale", "reject"]
+OVERSIZE = os.getenv("LEVIOSA_OVERSIZE", "downscale")
+MIN_DPI = 72
+
+
+class InputTooLarge(ValueError):
+    """An input over the page or pixel budget."""
+
+
+class RasterPlan(NamedTuple):
+    pages: int  # pages to rasterize
+    dpi: int
+    max_dpi: int  # highest DPI within the pixel budget, for re-rendering pages
+
+
+def _check_action() -> None:
+    if OVERSIZE not in OVERSIZE_ACTIONS:
+        raise ValueError(f"Unknown LEVIOSA_OVERSIZE '{OVERSIZE}'. Available: {', '.join(OVERSIZE_ACTIONS)}")
+
+
+def _page_sizes(info: Dict[str, str]) -> Dict[int, Tuple[float, float]]:
+    """Page sizes in points from pdfinfo output ("Page    3 size: 612 x 792 pts", or "Page size" for page 1)."""
+    sizes = {}
+    for key, value in info.items():
+        match = re.match(r'Page\s*(\d*)\s+size', key)
+        size = re.match(r'\s*([\d.]+) x ([\d.]+)', str(value))
+        if match and size:
+            sizes[int(match.group(1) or 1)] = (float(size.group(1)), float(size.group(2)))
+    return sizes
+
+
+def plan_rasterization(pdf_path: str, dpi: int, max_pages: Optional[int] = None) -> RasterPlan:
+    """
+    Check a PDF against the budgets and choose how to rasterize it.
+
+    Args:
+        pdf_path: The PDF
+        dpi: Requested resolution
+        max_pages: Only the first pages are needed
+
+    Returns:
+        How many pages to rasterize and the DPI that keeps the largest of them
+        within LEVIOSA_MAX_PAGE_PIXELS
+
+    Raises:
+        InputTooLarge: Too many pages, or an oversized page with LEVIOSA_OVERSIZE=reject
+    """
+    from pdf2image import pdfinfo_from_path
+
+    _check_action()
+    total = int(pdfinfo_from_path(pdf_path)["Pages"])
+    if total > MAX_PAGES:
+        raise InputTooLarge(f"PDF has {total} pages; the limit is {MAX_PAGES} (LEVIOSA_MAX_PAGES)")
+    pages = min(total, max_pages) if max_pages is not None else total
+    if pages == 0:
+        return RasterPlan(0, dpi, dpi)
+
+    sizes = _page_sizes(pdfinfo_from_path(pdf_path, first_page=1, last_page=pages))
+    if not sizes:
+        return RasterPlan(pages, dpi, dpi)
+    largest = max(width * height for width, height in sizes.values()) / (72 * 72)  # square inches
+    fitted = int((MAX_PAGE_PIXELS / largest) ** 0.5)
+    pixels = largest * dpi * dpi
+    if pixels <= MAX_PAGE_PIXELS:
+        return RasterPlan(pages, dpi, fitted)
+    if OVERSIZE == "reject":
+        raise InputTooLarge(f"A page is {pixels / 1e6:.0f} MP at {dpi} DPI; the limit is "
+                            f"{MAX_PAGE_PIXELS / 1e6:.0f} MP (LEVIOSA_MAX_PAGE_PIXELS)")
+    if fitted < MIN_DPI:
+        raise InputTooLarge(f"Pages are too large to rasterize within {MAX_PAGE_PIXELS / 1e6:.0f} MP at {MIN_DPI} DPI")
+    print(f"[LIMITS] Rasterizing {pdf_path} at {fitted} DPI instead of {dpi} to stay within the pixel budget")
+    return RasterPlan(pages, fitted, fitted)
+
+
+def open_image(source: Union[str, bytes]) -> Image.Image:
+    """
+    Decode an image path or bytes to RGB within LEVIOSA_MAX_PAGE_PIXELS.
+
+    The size is read from the header first; oversized JPEGs are decoded at a
+    reduced scale and anything still over the budget is resized.
+
+    Raises:
+        InputTooLarge: Oversized with LEVIOSA_OVERSIZE=reject, too large to decode
+            within LEVIOSA_MAX_DECODE_PIXELS, or too large for PIL to open safely
+    """
+    _check_action()
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    except Image.DecompressionBombError as e:
+        raise InputTooLarge(str(e))
+
+    width, height = image.size
+    if width * height <= MAX_PAGE_PIXELS:
+        with span("image.decode", width=width, height=height):
+            return image.convert("RGB")
+    if OVERSIZE == "reject":
+        raise InputTooLarge(f"Image is {width}x{height} ({width * height / 1e6:.0f} MP); the limit is "
+                            f"{MAX_PAGE_PIXELS / 1e6:.0f} MP (LEVIOSA_MAX_PAGE_PIXELS)")
+
+    reduction = DRAFT_SCALE.get(image.format, 1)
+    decoded = max(MAX_PAGE_PIXELS, width * height // (reduction * reduction))
+    if decoded > MAX_DECODE_PIXELS:
+        raise InputTooLarge(f"{image.format or 'Image'} {width}x{height} would be decoded at {decoded / 1e6:.0f} MP; "
+                            f"the limit is {MAX_DECODE_PIXELS / 1e6:.0f} MP (LEVIOSA_MAX_DECODE_PIXELS)")
+
+    scale = (MAX_PAGE_PIXELS / (width * height)) ** 0.5
+    target = (max(1, int(width * scale)), max(1, int(height * scale)))
+    with span("image.decode", width=width, height=height, downscaled_to=f"{target[0]}x{target[1]}"):
+        image.draft("RGB", target)  # JPEG: decode at 1/2, 1/4 or 1/8 scale, still at least `target`
+        image = image.convert("RGB")
+        if image.size[0] * image.size[1] > MAX_PAGE_PIXELS:
+            image = image.resize(target, Image.LANCZOS)
+    print(f"[LIMITS] Image {width}x{height} downscaled to {image.size[0]}x{image.size[1]}")
+    return image
+
+
+def to_array(image: Image.Image, strip_rows: int = 512) -> np.ndarray:
+    """
+    An RGB image as an H x W x 3 array. np.array(image) goes through a full
+    tobytes() copy first; converting in strips keeps the peak near one page.
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = image.size
+    with span("image.to_array", width=width, height=height):
+        array = np.empty((height, width, 3), dtype=np.uint8)
+        for top in range(0, height, strip_rows):
+            bottom = min(height, top + strip_rows)
+            array[top:bottom] = np.asarray(image.crop((0, top, width, bottom)))
+    return array
@@ -0,0 +1,143 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services import orientation
+
+'''
+The languages documents are read in, and script detection for lang="auto".
+
+LEVIOSA_LANGS lists the PaddleOCR languages the server accepts ("en",
+"german", "fr", "ru", "ch", "japan", "korean", "arabic", ...), in addition to
+LEVIOSA_DEFAULT_LANG. Requests choose one with the `lang` pipeline option;
+services/engines.py loads the models of a language when a request first needs
+it.
+
+With lang="auto" the script is detected on the first page read: a handful of
+line crops are recognized with the recognizer of each candidate script, and
+the script whose recognizer reads them with the highest confidence, counting
+only characters that belong to the script, wins. Languages already in memory
+are tried first and the search stops at the first confident result, so
+documents in the common languages do not load other models. Languages that
+share a script (en, german, fr) cannot be told apart this way; the first one
+in LEVIOSA_LANGS stands for the script, and the hint selects the others. The
+rest of the document is read in the detected language.
+'''
+
+DEFAULT_LANG = os.getenv("LEVIOSA_DEFAULT_LANG", "en")
+LANGUAGES = list(dict.fromkeys(
+    [DEFAULT_LANG] + [lang.strip() for lang in os.getenv("LEVIOSA_LANGS", "").split(",") if lang.strip()]))
+AUTO = "auto"
+DETECT_CROPS = 8
+DETECT_CONFIDENCE = float(os.getenv("LEVIOSA_LANG_DETECT_CONFIDENCE", "0.85"))
+
+# The script of each PaddleOCR language's recognizer; languages not listed are Latin
+SCRIPTS: Dict[str, str] = {
+    "ch": "han", "chinese_cht": "han", "japan": "japanese", "korean": "hangul",
+    "ru": "cyrillic", "uk": "cyrillic", "be": "cyrillic", "bg": "cyrillic", "sr": "cyrillic", "mn": "cyrillic",
+    "cyrillic": "cyrillic",
+    "ar": "arabic", "fa": "arabic", "ur": "arabic", "ug": "arabic", "arabic": "arabic",
+    "hi": "devanagari", "mr": "devanagari", "ne": "devanagari", "devanagari": "devanagari",
+    "ta": "tamil", "te": "telugu", "ka": "kannada",
+}
+_RANGES: Dict[str, List[Tuple[int, int]]] = {
+    "latin": [(0x41, 0x5A), (0x61, 0x7A), (0xC0, 0x24F), (0x1E00, 0x1EFF)],
+    "cyrillic": [(0x400, 0x52F)],
+    "arabic": [(0x600, 0x6FF), (0x750, 0x77F), (0xFB50, 0xFDFF), (0xFE70, 0xFEFF)],
+    "devanagari": [(0x900, 0x97F)],
+    "han": [(0x3400, 0x4DBF), (0x4E00, 0x9FFF), (0xF900, 0xFAFF)],
+    "japanese": [(0x3040, 0x30FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF)],
+    "hangul": [(0x1100, 0x11FF), (0x3130, 0x318F), (0xAC00, 0xD7AF)],
+    "tamil": [(0xB80, 0xBFF)],
+    "telugu": [(0xC00, 0xC7F)],
+    "kannada": [(0xC80, 0xCFF)],
+}
+
+
+class UnsupportedLanguage(ValueError):
+    """A language hint the server is not configured for."""
+
+
+def check(lang: Optional[str]) -> str:
+    """
+    The language to read a request in.
+
+    Args:
+        lang: The request's hint; a language from LANGUAGES, AUTO, or None for the default
+
+    Raises:
+        UnsupportedLanguage: The language is not in LEVIOSA_LANGS
+    """
+    if lang is None:
+        return DEFAULT_LANG
+    if lang != AUTO and lang not in LANGUAGES:
+        raise UnsupportedLanguage(f"Unsupported language '{lang}'. Available: {', '.join(LANGUAGES)} or '{AUTO}'")
+    return lang
+
+
+def keep_detected(options: Any, lang: Optional[str]) -> Any:
+    """The options for the rest of a document once a page was read in `lang`: "auto" is settled by the first page."""
+    if options is None or options.lang != AUTO or not lang:
+        return options
+    return options.copy(update={"lang": lang})
+
+
+def script_of(lang: str) -> str:
+    return SCRIPTS.get(lang, "latin")
+
+
+def _in_script(text: str, script: str) -> Tuple[int, int]:
+    """Letters of `text` belonging to `script`, and all letters."""
+    ranges = _RANGES[script]
+    letters = [ord(ch) for ch in text if ch.isalpha()]
+    return sum(1 for code in letters if any(lo <= code <= hi for lo, hi in ranges)), len(letters)
+
+
+def _score(recognized: Sequence[Tuple[str, float]], script: str) -> float:
+    """Mean confidence of the crops, weighted by the share of their letters that belong to the script."""
+    if not recognized:
+        return 0.0
+    matching = total = 0
+    for text, _ in recognized:
+        inside, letters = _in_script(text, script)
+        matching += inside
+        total += letters
+    confidence = sum(score for _, score in recognized) / len(recognized)
+    return confidence * (matching / total if total else 0.0)
+
+
+def detect_language(image_np: np.ndarray, recognizer_for: Callable[[str], Any],
+                    resident: Sequence[str] = ()) -> Optional[str]:
+    """
+    Detect the script of an upright page.
+
+    Args:
+        image_np: The page, upright
+        recognizer_for: The text recognizer of a language, called with a list
+            of line crops and returning ([(text, confidence), ...], elapsed)
+        resident: Languages whose models are in memory, tried first
+
+    Returns:
+        The first language in LANGUAGES with the detected script, or None when
+        the page has no readable lines
+    """
+    crops = orientation.line_crops(image_np, DETECT_CROPS)
+    if not crops:
+        return None
+
+    # One language per script, those already in memory first
+    by_script: Dict[str, str] = {}
+    for lang in LANGUAGES:
+        by_script.setdefault(script_of(lang), lang)
+    candidates = sorted(by_script.values(), key=lambda lang: lang not in resident)
+
+    best: Optional[Tuple[float, str]] = None
+    for lang in candidates:
+        recognized, _ = recognizer_for(lang)(crops)
+        score = _score(recognized, script_of(lang))
+        if best is None or score > best[0]:
+            best = (score, lang)
+        if score >= DETECT_CONFIDENCE:
+            break
+    return best[1] if best is not None and best[0] > 0 else None
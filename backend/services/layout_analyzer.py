@@ -4,56 +4,121 @@ import os
 import uuid
 import numpy as np
 from PIL import Image
-from paddleocr import PPStructure, save_structure_res
-from typing import Union, BinaryIO, Dict, List, Any
+from typing import Awaitable, Union, BinaryIO, Dict, List, Any, Optional
 from fastapi import UploadFile
 import asyncio
-import io
 from uuid import uuid4
 
-from models.schema import LayoutAnalysisResponse, LayoutResult, LayoutPageResult
-
-# Initialize PP-Structure layout analysis
-structure_engine = PPStructure(
-    table=True,
-    ocr=True,
-    layout=True, 
-    show_log=True,
-    recovery=False,
-    use_pdf2docx_api=False,
-    lang="en",
-    layout_model_dir='models/layout_ppv3_infer',
-    layout_dict_path='models/layout_dict.txt',
-)
+from models.schema import LayoutAnalysisResponse, PipelineOptions
+from models.document import LayoutDocument, LayoutPage, LayoutRegion
+from services import languages, orientation, search_index, tiling
+from services.input_limits import open_image, to_array
+from services.page_filter import PageFilter, PageVerdict
+from services.singleflight import SingleFlight, content_key
+from services.engines import detect_language, exclusive, get_structure_engine, get_ocr_engine
+from services.tracing import span
+
+_flights = SingleFlight("layout analysis")
 
 async def analyze_layout(
-    input_file: Union[str, UploadFile, BinaryIO]
+    input_file: Union[str, UploadFile, BinaryIO],
+    options: Optional[PipelineOptions] = None
 ) -> LayoutAnalysisResponse:
     """
     Analyzes document layout to identify text regions, tables, and figures
     before performing OCR
     """
+    document = await analyze_layout_document(input_file, options)
+    return document.to_response()
+
+async def analyze_layout_document(
+    input_file: Union[str, UploadFile, BinaryIO],
+    options: Optional[PipelineOptions] = None
+) -> LayoutDocument:
+    """
+    Same as analyze_layout, but returns the internal LayoutDocument so later
+    stages can work on it without converting through Pydantic models.
+    `options` selects which stages run (text, tables); everything by default.
+    Blank and repeated PDF pages are skipped unless `options.page_filter` is off.
+    Concurrent requests for the same content and options share one analysis.
+    Regions of files on disk are added to the search index.
+    """
+    key = await content_key(input_file, "layout", options, search_index.doc_id_of(input_file))
+    return await _flights.run(key, lambda: _indexed(input_file, _analyze_layout_document(input_file, options)))
+
+async def _indexed(source: Union[str, UploadFile, BinaryIO], run: Awaitable[LayoutDocument]) -> LayoutDocument:
+    """Run a layout flight and index its regions, once per flight rather than once per waiter."""
+    document = await run
+    await asyncio.to_thread(search_index.index_document, source, search_index.layout_entries(document.pages),
+                            search_index.LAYOUT)
+    return document
+
+async def _analyze_layout_document(
+    input_file: Union[str, UploadFile, BinaryIO],
+    options: Optional[PipelineOptions] = None
+) -> LayoutDocument:
     if isinstance(input_file, str) and input_file.lower().endswith(".pdf"):
         from services.pdf_to_image import convert_pdf_to_images
-        image_paths = convert_pdf_to_images(input_file)[:3]  # Limit to 3 pages
-        pages = [await _process_layout_from_path(p, i + 1) for i, p in enumerate(image_paths)]
-        return LayoutAnalysisResponse(pages=pages)
+        image_paths = await asyncio.to_thread(convert_pdf_to_images, input_file, max_pages=3)  # Limit to 3 pages
+        page_filter = PageFilter() if options is None or options.page_filter else None
+        pages = []
+        for i, image_path in enumerate(image_paths):
+            pages.append(await _process_layout_from_path(image_path, i + 1, options, page_filter))
+            options = languages.keep_detected(options, pages[-1].lang)
+        return LayoutDocument(pages)
 
     if isinstance(input_file, str) and input_file.lower().endswith((".png", ".jpg", ".jpeg")):
-        return LayoutAnalysisResponse(pages=[await _process_layout_from_path(input_file, page=1)])
+        return LayoutDocument([await _process_layout_from_path(input_file, page=1, options=options)])
+
+    return LayoutDocument([await _process_layout_from_input(input_file, page=1, options=options)])
 
-    return LayoutAnalysisResponse(pages=[await _process_layout_from_input(input_file, page=1)])
+def _run_structure(image_np: np.ndarray, options: Optional[PipelineOptions], lang: str) -> List[Dict[str, Any]]:
+    """
+    Run the structure engine variant for the requested stages and language.
+    With table recognition off, table regions are read as plain text lines instead.
+    """
+    result = exclusive(get_structure_engine(options, lang))(image_np)
+    if options is not None and options.text and not options.tables:
+        for region in result:
+            if region.get("type") == "table" and not region.get("res") and region.get("img") is not None:
+                lines = exclusive(get_ocr_engine(lang).ocr)(region["img"], cls=False)[0] or []
+                region["res"] = [
+                    {"text": text, "confidence": confidence, "text_region": box}
+                    for box, (text, confidence) in lines
+                ]
+    return result
 
-async def _process_layout_from_input(input_file: Union[UploadFile, BinaryIO], page: int) -> LayoutPageResult:
+async def analyze_layout_page(image_path: str, page: int, options: Optional[PipelineOptions] = None,
+                              page_filter: Optional[PageFilter] = None) -> LayoutPage:
+    """Layout analysis of one rasterized page, for callers that schedule pages themselves."""
+    return await _process_layout_from_path(image_path, page, options, page_filter)
+
+async def _process_layout_from_input(input_file: Union[UploadFile, BinaryIO], page: int,
+                                     options: Optional[PipelineOptions] = None) -> LayoutPage:
     content = await input_file.read() if hasattr(input_file, "read") else input_file.read()
-    image = Image.open(io.BytesIO(content)).convert("RGB")
     if hasattr(input_file, "seek"):
         await input_file.seek(0)
-    return await _process_layout_from_image(image, page)
+    return await _process_layout_from_image(await asyncio.to_thread(open_image, content), page, options)
+
+async def _process_layout_from_path(path: str, page: int, options: Optional[PipelineOptions] = None,
+                                    page_filter: Optional[PageFilter] = None) -> LayoutPage:
+    try:
+        return await _process_layout_from_image(await asyncio.to_thread(open_image, path), page, options, page_filter)
+    except BaseException:
+        if page_filter is not None:
+            page_filter.forget(page)  # duplicates of this page must not wait for it
+        raise
 
-async def _process_layout_from_path(path: str, page: int) -> LayoutPageResult:
-    image = Image.open(path).convert("RGB")
-    return await _process_layout_from_image(image, page)
+async def _skipped_layout_page(page: int, verdict: PageVerdict, page_filter: PageFilter) -> LayoutPage:
+    """A blank page without regions, or a duplicate with copies of the regions of the page it repeats."""
+    original = await page_filter.result_of(verdict.duplicate_of) if verdict.duplicate_of else None
+    if original is None:
+        return LayoutPage(page=page, skipped=verdict.skipped, duplicate_of=verdict.duplicate_of)
+    results = [
+        LayoutRegion(f"region_{uuid.uuid4().hex}", r.region_type, r.bbox_raw, r.bbox_norm, dict(r.content), page)
+        for r in original.results
+    ]
+    return LayoutPage(page, results, original.rotation, verdict.skipped, verdict.duplicate_of, original.lang)
 
 # async def _process_layout_from_image(image: Image.Image, page: int) -> LayoutPageResult:
 #     width, height = image.size
@@ -92,18 +157,53 @@ async def _process_layout_from_path(path: str, page: int) -> LayoutPageResult:
     
 #     return LayoutPageResult(page=page, results=layout_results)
 
-async def _process_layout_from_image(image: Image.Image, page: int) -> LayoutPageResult:
+async def _process_layout_from_image(image: Image.Image, page: int,
+                                     options: Optional[PipelineOptions] = None,
+                                     page_filter: Optional[PageFilter] = None) -> LayoutPage:
+    lang = languages.check(options.lang if options is not None else None)
     width, height = image.size
-    image_np = np.array(image)
+    image_np = await asyncio.to_thread(to_array, image)
+    del image  # the array is the only full-size copy of the page from here on
+
+    # Blank pages and re-scans of an earlier page skip the models
+    if page_filter is not None:
+        verdict = await asyncio.to_thread(page_filter.check, page, image_np)
+        if verdict.skipped:
+            return await _skipped_layout_page(page, verdict, page_filter)
+
+    # Turn the page upright first; boxes are mapped back to the original page below
+    rotation = 0
+    if (options is None or options.angle_cls) and orientation.ENABLED:
+        with span("page_orientation", page=page) as s:
+            image_np, page_orientation = await asyncio.to_thread(exclusive(orientation.make_upright), image_np, get_ocr_engine())
+            s.set(angle=page_orientation.angle, ambiguous=page_orientation.ambiguous)
+        rotation = page_orientation.angle
+
+    if lang == languages.AUTO:
+        with span("language_detect", page=page) as s:
+            lang = await asyncio.to_thread(detect_language, image_np)
+            s.set(lang=lang)
     
     # Run layout analysis
-    result = await asyncio.to_thread(structure_engine, image_np)
+    upright_height, upright_width = image_np.shape[:2]
+    if tiling.should_tile(upright_width, upright_height):
+        # Very large pages: overlapping tiles at full resolution, regions cut by the seams merged
+        tiles = tiling.plan_tiles(upright_width, upright_height)
+        with span("structure_engine", page=page, width=width, height=height, lang=lang, tiles=len(tiles)) as s:
+            tile_results = await tiling.map_tiles(image_np, tiles,
+                                                  lambda tile_np: _run_structure(tile_np, options, lang))
+            result = tiling.merge_structure(tiles, tile_results)
+            s.set(regions=len(result))
+    else:
+        with span("structure_engine", page=page, width=width, height=height, lang=lang) as s:
+            result = await asyncio.to_thread(_run_structure, image_np, options, lang)
+            s.set(regions=len(result))
     
     layout_results = []
     
     for i, region in enumerate(result):
         region_type = region.get("type", "unknown")
-        bbox = region.get("bbox", [0, 0, 0, 0])
+        bbox = orientation.map_bbox_back(region.get("bbox", [0, 0, 0, 0]), rotation, width, height)
         
         # Normalize coordinates
         x1, y1, x2, y2 = bbox
@@ -118,7 +218,10 @@ async def _process_layout_from_image(image: Image.Image, page: int) -> LayoutPag
         ocr_results = region.get("res", [])
         
         # Parse OCR results correctly based on their format
-        if region_type == "table":
+        if options is not None and not options.text:
+            # Layout-only request: region boxes without content
+            content = {}
+        elif region_type == "table" and isinstance(ocr_results, dict):
             # For tables, extract the HTML and cell data
             content = {
                 "html": ocr_results.get("html", "") if isinstance(ocr_results, dict) else "",
@@ -164,7 +267,7 @@ async def _process_layout_from_image(image: Image.Image, page: int) -> LayoutPag
             content = {"raw_data": str(ocr_results)}
             
         # Create the layout result
-        layout_result = LayoutResult(
+        layout_result = LayoutRegion(
             region_id=f"region_{uuid.uuid4().hex}",
             region_type=region_type,
             bbox_raw=bbox,
@@ -176,7 +279,7 @@ async def _process_layout_from_image(image: Image.Image, page: int) -> LayoutPag
     
     # Handle case where no regions were found
     if not layout_results:
-        layout_results.append(LayoutResult(
+        layout_results.append(LayoutRegion(
             region_id=f"region_{uuid.uuid4().hex}",
             region_type="unknown",
             bbox_raw=[0, 0, width, height],
@@ -185,4 +288,7 @@ async def _process_layout_from_image(image: Image.Image, page: int) -> LayoutPag
             page=page
         ))
     
-    return LayoutPageResult(page=page, results=layout_results)
\ No newline at end of file
+    layout_page = LayoutPage(page=page, results=layout_results, rotation=rotation, lang=lang)
+    if page_filter is not None:
+        page_filter.remember(page, layout_page)
+    return layout_page
\ No newline at end of file
@@ -1,5 +1,7 @@
 import re
 from typing import List, Dict, Any, Optional
+from services.tracing import span
+from models.document import LayoutPage, LayoutRegion
 
 class LayoutPostprocessor:
     """
@@ -15,105 +17,67 @@ class LayoutPostprocessor:
         self.equation_patterns = re.compile(r'equation|=|\+|\-|\*|\/|\\sum|\\int|\\prod|\\div|\\approx', re.IGNORECASE)
         self.title_patterns = re.compile(r'^[A-Z0-9][\w\s\.\:]{0,100}$', re.MULTILINE)
         
-    def process_regions(self, pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def process_regions(self, pages: List[Any]) -> List[LayoutPage]:
         """
         Processes all regions in all pages to enhance their classifications.
         
+        Region records are reclassified in place; page dictionaries or
+        Pydantic pages are converted to records first.
+        
         Args:
-            pages: A list of page dictionaries with layout analysis results
+            pages: A list of pages (LayoutPage records, dicts or LayoutPageResult models)
             
         Returns:
-            A new list of page dictionaries with updated region types
+            The list of LayoutPage records with updated region types
         """
-        enhanced_pages = []
-        
-        for page in pages:
-            enhanced_results = []
-            
-            # Check if the page has a results attribute
-            if hasattr(page, "results"):
-                regions = page.results
-                page_num = page.page
-            else:
-                regions = page.get("results", [])
-                page_num = page.get("page", 1)
-            
-            for region in regions:
-                # Apply enhancements to each region
-                enhanced_region = self._enhance_region(region)
-                enhanced_results.append(enhanced_region)
-            
-            # Create a new page dict with enhanced results
-            enhanced_page = {
-                "page": page_num,
-                "results": enhanced_results
-            }
-            enhanced_pages.append(enhanced_page)
-            
-        return enhanced_pages
+        with span("LayoutPostprocessor.process_regions", pages=len(pages)):
+            enhanced_pages = [LayoutPage.from_any(page) for page in pages]
+            for page in enhanced_pages:
+                for region in page.results:
+                    # Apply enhancements to each region
+                    self._enhance_region(region)
+            return enhanced_pages
     
-    def _enhance_region(self, region: Dict[str, Any]) -> Dict[str, Any]:
+    def _enhance_region(self, region: LayoutRegion) -> LayoutRegion:
         """
         Enhances a single region's classification based on its content and properties.
         
         Args:
-            region: A region dictionary from the layout analysis
+            region: A region record from the layout analysis
             
         Returns:
-            An enhanced copy of the region dictionary
+            The same region, with region_type updated when a better class was found
         """
-        # Convert region to dict if it's a Pydantic model
-        if hasattr(region, "dict"):
-            enhanced_region = region.dict()
-        else:
-            enhanced_region = region.copy()
-            
-        # Get the text content if available
-        if hasattr(region, "content") and hasattr(region.content, "get"):
-            text = region.content.get("text", "")
-        elif hasattr(region, "content") and hasattr(region.content, "text"):
-            text = region.content.text
-        else:
-            text = enhanced_region.get("content", {}).get("text", "")
-        
-        if hasattr(region, "region_type"):
-            region_type = region.region_type
-        else:
-            region_type = enhanced_region.get("region_type", "")
+        text = region.content.get("text", "") if region.content else ""
             
         # Skip empty regions or already specific classifications
-        if not text or region_type not in ["text", "unknown"]:
-            return enhanced_region
+        if not text or region.region_type not in ["text", "unknown"]:
+            return region
         
         # Check for potential figures
         if self._is_figure(text, region):
-            enhanced_region["region_type"] = "figure"
-            return enhanced_region
+            region.region_type = "figure"
         
         # Check for potential tables
-        if self._is_table(text, region):
-            enhanced_region["region_type"] = "table"
-            return enhanced_region
+        elif self._is_table(text, region):
+            region.region_type = "table"
         
         # Check for potential lists
-        if self._is_list(text):
-            enhanced_region["region_type"] = "list"
-            return enhanced_region
+        elif self._is_list(text):
+            region.region_type = "list"
         
         # Check for potential equations
-        if self._is_equation(text):
-            enhanced_region["region_type"] = "equation"
-            return enhanced_region
+        elif self._is_equation(text):
+            region.region_type = "equation"
         
         # Check for potential titles (short, capitalized text)
-        if self._is_title(text, region):
-            enhanced_region["region_type"] = "title"
-            return enhanced_region
+        elif self._is_title(text, region):
+            region.region_type = "title"
         
-        # If we reach here, keep the original classification
-        return enhanced_region
+        # Otherwise keep the original classification
+        return region
     
-    def _is_figure(self, text: str, region: Dict[str, Any]) -> bool:
+    def _is_figure(self, text: str, region: LayoutRegion) -> bool:
         """Determines if a region is likely a figure caption."""
         # Check for common figure indicators in text
         if self.figure_patterns.search(text):
@@ -125,11 +89,7 @@ class LayoutPostprocessor:
             return True
         
         # Check if the region is likely a figure based on shape
-        # Handle both dict and Pydantic model
-        if hasattr(region, "bbox_raw"):
-            bbox = region.bbox_raw
-        else:
-            bbox = region.get("bbox_raw", [])
+        bbox = region.bbox_raw
         
         if len(bbox) == 4:
             width = bbox[2] - bbox[0]
@@ -142,7 +102,7 @@ class LayoutPostprocessor:
         
         return False
     
-    def _is_table(self, text: str, region: Dict[str, Any]) -> bool:
+    def _is_table(self, text: str, region: LayoutRegion) -> bool:
         """Determines if a region is likely a table."""
         # Check for common table indicators
         if self.table_patterns.search(text):
@@ -184,7 +144,7 @@ class LayoutPostprocessor:
         
         return False
     
-    def _is_title(self, text: str, region: Dict[str, Any]) -> bool:
+    def _is_title(self, text: str, region: LayoutRegion) -> bool:
         """Determines if a region is likely a title or heading."""
         # Skip long text - titles are usually short
         if len(text) > 100:
@@ -193,7 +153,7 @@ class LayoutPostprocessor:
         # Check if the text matches title patterns
         if self.title_patterns.search(text):
             # Check if the region is near the top of the page
-            bbox_norm = region.get("bbox_norm", [])
+            bbox_norm = region.bbox_norm
             if len(bbox_norm) == 4 and bbox_norm[1] < 0.3:  # Top 30% of page
                 return True
             
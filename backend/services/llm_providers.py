@@ -0,0 +1,415 @@
+import abc
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from services.llm_scheduler import RateLimiter, estimate_call, limiter_for
+from services.singleflight import SingleFlight
+from services.tracing import span
+
+'''
+LLM providers used for Markdown conversion and refinement.
+
+Every provider takes OpenAI-style chat messages and returns the completion
+text. "openai" talks to any OpenAI-compatible HTTP endpoint (the OpenAI API,
+the load-test stub, or a local llama.cpp / vLLM / Ollama server via
+"local-server"); "local" runs a quantized GGUF model in-process on CPU with
+llama-cpp-python. The provider is chosen per request, falling back to
+LLM_PROVIDER. Identical concurrent calls to the same provider share one
+completion (services/singleflight.py).
+
+Every call has a deadline (LEVIOSA_LLM_DEADLINE_S) and each attempt a
+timeout (LEVIOSA_LLM_ATTEMPT_TIMEOUT_S). Rate limits (429), server errors
+(5xx), connection errors and attempt timeouts are retried up to
+LEVIOSA_LLM_RETRIES times with exponential backoff and full jitter, or after
+the server's Retry-After, as long as the deadline allows. With
+LEVIOSA_LLM_HEDGE_PERCENTILE set (e.g. 95), an HTTP attempt still running
+after that percentile of the provider's recent latencies is hedged: a
+duplicate request is sent and whichever answers first is used, so a
+straggling completion does not hold up its page. Failures are raised as
+LLMError, carrying the HTTP status and the number of attempts. Before
+dispatch, HTTP calls wait for room in their endpoint's requests- and
+tokens-per-minute quota (services/llm_scheduler.py).
+'''
+
+DEFAULT_LLM_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_PROVIDER = os.environ.get("LLM_PROVIDER", "openai")
+DEADLINE_S = float(os.getenv("LEVIOSA_LLM_DEADLINE_S", "180"))
+ATTEMPT_TIMEOUT_S = float(os.getenv("LEVIOSA_LLM_ATTEMPT_TIMEOUT_S", "90"))
+RETRIES = int(os.getenv("LEVIOSA_LLM_RETRIES", "3"))
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 20.0
+HEDGE_PERCENTILE = float(os.getenv("LEVIOSA_LLM_HEDGE_PERCENTILE", "0"))  # 0: no hedging
+HEDGE_MIN_SAMPLES = 20  # latencies needed before hedging starts
+LATENCY_WINDOW = 200  # recent latencies kept per provider
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when a provider cannot produce a completion."""
+
+    def __init__(self, message: str, payload: Optional[Dict[str, Any]] = None, status: Optional[int] = None,
+                 retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.payload = payload
+        self.status = status  # HTTP status, when the server answered
+        self.retryable = retryable
+        self.retry_after = retry_after  # seconds, from the Retry-After header
+        self.attempts = 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The error as reported to clients."""
+        error = str(self)
+        if self.payload is not None:
+            error += f": {json.dumps(self.payload)[:500]}"
+        return {"error": error, "status": self.status, "attempts": self.attempts, "retryable": self.retryable}
+
+
+class LLMConfigError(LLMError):
+    """The provider is unknown or not configured (no API key): every call would fail alike."""
+
+
+class LatencyWindow:
+    """Recent successful completion latencies of one provider."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """The p-th percentile, or None until HEDGE_MIN_SAMPLES latencies are known."""
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None  # an HTTP date; fall back to our own backoff
+
+
+_http_providers: "weakref.WeakSet[OpenAICompatibleProvider]" = weakref.WeakSet()
+_flights = SingleFlight("LLM completion")
+
+
+class LLMProvider(abc.ABC):
+    """Interface shared by all providers."""
+
+    name = "base"
+    hedged = False  # duplicate requests are only worth it against a remote server
+    latency: Optional[LatencyWindow] = None
+    limiter: Optional[RateLimiter] = None  # RPM/TPM quota of the endpoint
+
+    async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2,
+                   deadline: Optional[float] = None) -> str:
+        """
+        Run one chat completion, or join the identical one already running.
+
+        Args:
+            messages: OpenAI-style messages (role/content)
+            temperature: Sampling temperature
+            deadline: Seconds the call may take, retries included; DEADLINE_S when omitted
+
+        Returns:
+            The assistant message content
+
+        Raises:
+            LLMError: The completion failed, after any retries, or the deadline passed
+        """
+        digest = hashlib.blake2b(json.dumps(messages, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+        return await _flights.run((id(self), digest, temperature),
+                                  lambda: self._call(messages, temperature, deadline or DEADLINE_S))
+
+    async def _call(self, messages: List[Dict[str, str]], temperature: float, budget: float) -> str:
+        """Attempts until one succeeds, a failure is not retryable, or the deadline passes."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        attempt = 0
+        with span("llm.call", provider=self.name) as s:
+            while True:
+                attempt += 1
+                remaining = deadline - loop.time()
+                try:
+                    result = await asyncio.wait_for(self._attempt(messages, temperature), remaining)
+                    s.set(attempts=attempt)
+                    return result
+                except asyncio.TimeoutError:
+                    error = LLMError(f"LLM call exceeded its deadline of {budget:.0f}s")
+                except LLMError as e:
+                    error = e
+                except aiohttp.ClientError as e:
+                    error = LLMError(f"Could not reach the LLM server: {e}", retryable=True)
+
+                error.attempts = attempt
+                s.set(attempts=attempt, status=error.status)
+                if not error.retryable or attempt > RETRIES:
+                    raise error
+                # Exponential backoff with full jitter, unless the server said how long to wait
+                delay = error.retry_after
+                if delay is None:
+                    delay = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** (attempt - 1)))
+                if loop.time() + delay >= deadline:
+                    raise error
+                print(f"[LLM] {self.name}: {error} (attempt {attempt}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        """
+        One attempt, once the rate limiter admits it; hedged with a duplicate
+        request once it runs slower than usual.
+        """
+        hedge_after = self.latency.percentile(HEDGE_PERCENTILE) if self.hedged and HEDGE_PERCENTILE > 0 else None
+
+        async def timed() -> str:
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(self.complete(messages, temperature), ATTEMPT_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                raise LLMError(f"LLM attempt timed out after {ATTEMPT_TIMEOUT_S:.0f}s", retryable=True)
+            if self.latency is not None:
+                self.latency.record(time.monotonic() - start)
+            return result
+
+        async def hedge() -> str:
+            await self._admit(messages)
+            return await timed()
+
+        await self._admit(messages)
+        tasks = [asyncio.ensure_future(timed())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                print(f"[LLM] {self.name}: no answer after {hedge_after:.2f}s (p{HEDGE_PERCENTILE:g}), hedging")
+                with span("llm.hedge", provider=self.name, after_s=round(hedge_after, 2)):
+                    tasks.append(asyncio.ensure_future(hedge()))
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # The first success wins; a failure only counts once no other request is left
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    return (succeeded or list(done))[0].result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _admit(self, messages: List[Dict[str, str]]) -> None:
+        if self.limiter is not None:
+            await self.limiter.acquire(estimate_call(messages))
+
+    @abc.abstractmethod
+    async def complete(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        """Run one chat completion; implemented by each provider."""
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Chat completions over HTTP against an OpenAI-compatible endpoint."""
+
+    name = "openai"
+    hedged = True
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 model: Optional[str] = None, require_api_key: bool = True):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.base_url = (base_url or os.environ.get("OPENAI_BASE_URL", DEFAULT_LLM_BASE_URL)).rstrip("/")
+        self.model = model or os.environ.get("LLM_MODEL", "gpt-4o")
+        self.require_api_key = require_api_key
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.latency = LatencyWindow()
+        self.limiter = limiter_for(self.base_url, self.api_key)
+        _http_providers.add(self)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # One pooled session per event loop so connections are reused across calls
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession()
+            self._session_loop = loop
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def build_payload(self, messages: List[Dict[str, str]], temperature: float) -> Dict[str, Any]:
+        return {"model": self.model, "messages": messages, "temperature": temperature}
+
+    async def complete(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        if self.require_api_key and not self.api_key:
+            raise LLMConfigError("No API key provided for LLM markdown conversion.")
+
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        with span("llm.chat_completion", provider=self.name, model=self.model):
+            async with self._get_session().post(
+                f"{self.base_url}/chat/completions",
+                headers=headers,
+                json=self.build_payload(messages, temperature),
+            ) as response:
+                self.limiter.observe(response.headers)
+                try:
+                    response_data = await response.json(content_type=None)
+                except ValueError:
+                    response_data = {"body": (await response.text())[:500]}
+                if response.status >= 400:
+                    retry_after = _retry_after(response.headers.get("Retry-After"))
+                    if response.status == 429:
+                        self.limiter.pause(retry_after, response.headers)
+                    raise LLMError(f"LLM request failed with HTTP {response.status}", payload=response_data,
+                                   status=response.status, retryable=response.status in RETRYABLE_STATUS,
+                                   retry_after=retry_after)
+
+        self.limiter.settle(estimate_call(messages), (response_data.get("usage") or {}).get("total_tokens"))
+        if "choices" in response_data and len(response_data["choices"]) > 0:
+            return response_data["choices"][0]["message"]["content"]
+        raise LLMError("Error in LLM response", payload=response_data)
+
+
+class LocalLlamaProvider(LLMProvider):
+    """
+    In-process CPU inference with a quantized GGUF model (llama-cpp-python).
+
+    Requests are collected into micro-batches (up to LOCAL_LLM_BATCH_SIZE, or
+    whatever arrives within LOCAL_LLM_BATCH_WAIT_MS) and run back-to-back on a
+    single inference thread, grouped by system prompt. Consecutive calls that
+    share the long conversion prompt reuse llama.cpp's cached prefix, so only
+    the page content is evaluated per request.
+    """
+
+    name = "local"
+
+    def __init__(self, model_path: Optional[str] = None, n_threads: Optional[int] = None,
+                 n_ctx: Optional[int] = None, batch_size: Optional[int] = None,
+                 batch_wait_ms: Optional[float] = None, max_tokens: Optional[int] = None):
+        self.model_path = model_path or os.environ.get("LOCAL_LLM_MODEL_PATH")
+        self.n_threads = n_threads or int(os.environ.get("LOCAL_LLM_THREADS", os.cpu_count() or 4))
+        self.n_ctx = n_ctx or int(os.environ.get("LOCAL_LLM_CONTEXT", "8192"))
+        self.batch_size = batch_size or int(os.environ.get("LOCAL_LLM_BATCH_SIZE", "8"))
+        self.batch_wait = (batch_wait_ms if batch_wait_ms is not None else float(os.environ.get("LOCAL_LLM_BATCH_WAIT_MS", "20"))) / 1000
+        self.max_tokens = max_tokens or int(os.environ.get("LOCAL_LLM_MAX_TOKENS", "2048"))
+        self._llama = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-llm")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _load(self):
+        if self._llama is None:
+            if not self.model_path:
+                raise LLMConfigError("LOCAL_LLM_MODEL_PATH is not set for the local LLM provider")
+            try:
+                from llama_cpp import Llama # type: ignore
+            except ImportError as e:
+                raise LLMConfigError("The local LLM provider requires llama-cpp-python") from e
+            print(f"[LLM] Loading local model {self.model_path} ({self.n_threads} threads)")
+            self._llama = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads, verbose=False)
+        return self._llama
+
+    async def complete(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((messages, temperature, future))
+        with span("llm.chat_completion", provider=self.name, model=os.path.basename(self.model_path or "")):
+            return await future
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            batch.sort(key=lambda item: item[0][0].get("content", "") if item[0] else "")
+            results = await loop.run_in_executor(self._executor, self._run_batch, batch)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _run_batch(self, batch: List[Tuple[List[Dict[str, str]], float, asyncio.Future]]) -> List[Any]:
+        results: List[Any] = []
+        for messages, temperature, future in batch:
+            if future.done():  # the caller gave up (cancelled or timed out) while the request was queued
+                results.append(None)
+                continue
+            try:
+                llama = self._load()
+                output = llama.create_chat_completion(messages=messages, temperature=temperature, max_tokens=self.max_tokens)
+                results.append(output["choices"][0]["message"]["content"])
+            except Exception as e:
+                results.append(e if isinstance(e, LLMError) else LLMError(str(e)))
+        return results
+
+
+_providers: Dict[str, LLMProvider] = {}
+
+
+def _create_provider(name: str) -> LLMProvider:
+    if name == "openai":
+        return OpenAICompatibleProvider()
+    if name == "local-server":
+        provider = OpenAICompatibleProvider(
+            api_key=os.environ.get("LOCAL_LLM_API_KEY", ""),
+            base_url=os.environ.get("LOCAL_LLM_BASE_URL", "http://127.0.0.1:8080/v1"),
+            model=os.environ.get("LOCAL_LLM_MODEL", "local"),
+            require_api_key=False,
+        )
+        provider.name = "local-server"
+        return provider
+    if name == "local":
+        return LocalLlamaProvider()
+    raise LLMConfigError(f"Unknown LLM provider: {name}. Available: {', '.join(available_providers())}")
+
+
+def available_providers() -> List[str]:
+    return ["openai", "local-server", "local"]
+
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """
+    Return the shared provider instance for a name (LLM_PROVIDER when omitted).
+
+    Args:
+        name: "openai", "local-server" or "local"
+
+    Returns:
+        The provider, created on first use
+    """
+    name = name or DEFAULT_PROVIDER
+    if name not in _providers:
+        _providers[name] = _create_provider(name)
+    return _providers[name]
+
+
+async def close_providers() -> None:
+    """Close the pooled HTTP sessions; called on application shutdown."""
+    for provider in list(_http_providers):
+        await provider.close()
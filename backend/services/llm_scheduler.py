@@ -0,0 +1,182 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from services.tracing import span
+
+'''
+Client-side rate limiting of LLM calls against requests-per-minute and
+tokens-per-minute quotas.
+
+Every HTTP completion first reserves one request and its estimated tokens
+(prompt plus expected completion) from two token buckets shared by all calls
+to the same endpoint and API key in the process; a call that does not fit
+waits, in arrival order, until the buckets have refilled. Once the answer
+arrives the reservation is settled against the `usage` the server reports.
+
+The buckets start from LEVIOSA_LLM_RPM / LEVIOSA_LLM_TPM (0: no limit until
+the server announces one) and follow the server's x-ratelimit-* headers: the
+announced limits, less RATE_HEADROOM, replace the configured ones when lower,
+and the remaining counts cap what the buckets hold. A 429 pauses every
+caller of the endpoint until its Retry-After or reset time, instead of
+letting the other calls run into the same limit.
+
+Quotas belong to the whole server: each of the WEB_CONCURRENCY worker
+processes keeps buckets for its share of them.
+'''
+
+RPM = float(os.getenv("LEVIOSA_LLM_RPM", "0"))
+TPM = float(os.getenv("LEVIOSA_LLM_TPM", "0"))
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+RATE_HEADROOM = 0.05  # share of an announced limit left unused, for other clients of the same key
+CHARS_PER_TOKEN = 4
+COMPLETION_RATIO = 0.5  # expected completion tokens per token of the last user message
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_call(messages: List[Dict[str, str]]) -> int:
+    """Estimated prompt plus completion tokens of a chat completion."""
+    prompt = sum(estimate_tokens(str(m.get("content", ""))) + 4 for m in messages)
+    last = estimate_tokens(str(messages[-1].get("content", ""))) if messages else 0
+    return prompt + int(last * COMPLETION_RATIO)
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds of a reset header: "20ms", "1.5s", "6m0s" or a plain number of seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parts = _DURATION.findall(value)
+        return sum(float(number) * _UNITS[unit] for number, unit in parts) if parts else None
+
+
+class TokenBucket:
+    """A per-minute quota refilled continuously; the level may go negative when usage exceeds a reservation."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available; a call larger than the whole quota waits for a full bucket."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def set_limit(self, per_minute: float) -> None:
+        self._refill()
+        self.level = min(self.level, per_minute)
+        self.capacity = per_minute
+
+    def cap(self, remaining: float) -> None:
+        """What the server says is left; what we hold can only be less."""
+        self._refill()
+        self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """The RPM and TPM buckets of one endpoint and key."""
+
+    def __init__(self, rpm: float = RPM / WORKERS, tpm: float = TPM / WORKERS):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._configured = (rpm, tpm)
+        self._paused_until = 0.0
+        self._turn: Optional[asyncio.Lock] = None
+        self._turn_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._turn is None or self._turn_loop is not loop:
+            self._turn, self._turn_loop = asyncio.Lock(), loop
+        return self._turn
+
+    async def acquire(self, tokens: int) -> None:
+        """Reserve one request and `tokens` tokens, waiting for them in arrival order."""
+        async with self._lock():
+            waited = 0.0
+            while True:
+                wait = max(self._paused_until - time.monotonic(),
+                           self.requests.wait_time(1) if self.requests else 0.0,
+                           self.tokens.wait_time(tokens) if self.tokens else 0.0)
+                if wait <= 0:
+                    break
+                with span("llm.rate_wait", seconds=round(wait, 3), tokens=tokens):
+                    await asyncio.sleep(wait)
+                waited += wait
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+        if waited >= 1:
+            print(f"[LLM RATE] Waited {waited:.1f}s for quota ({tokens} tokens)")
+
+    def settle(self, reserved: int, used: Optional[int]) -> None:
+        """Correct a reservation by the tokens the server reports having used."""
+        if self.tokens and used is not None:
+            self.tokens.take(used - reserved)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Follow the server's x-ratelimit-* headers."""
+        self.requests = self._follow(self.requests, self._configured[0], headers, "requests")
+        self.tokens = self._follow(self.tokens, self._configured[1], headers, "tokens")
+
+    def _follow(self, bucket: Optional[TokenBucket], configured: float, headers: Mapping[str, str],
+                kind: str) -> Optional[TokenBucket]:
+        try:
+            limit = float(headers[f"x-ratelimit-limit-{kind}"]) * (1 - RATE_HEADROOM) / WORKERS
+            remaining = float(headers[f"x-ratelimit-remaining-{kind}"]) / WORKERS
+        except (KeyError, ValueError):
+            return bucket
+        if configured > 0:
+            limit = min(limit, configured)
+        if bucket is None:
+            bucket = TokenBucket(limit)
+        elif bucket.capacity != limit:
+            bucket.set_limit(limit)
+        bucket.cap(remaining)
+        return bucket
+
+    def pause(self, seconds: Optional[float], headers: Mapping[str, str]) -> None:
+        """Hold back every call after a 429, until Retry-After or the later of the announced resets."""
+        if seconds is None:
+            resets = [parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) for kind in ("requests", "tokens")]
+            seconds = max((reset for reset in resets if reset is not None), default=1.0)
+        now = time.monotonic()
+        if now >= self._paused_until:
+            print(f"[LLM RATE] Rate limited; pausing calls for {seconds:.1f}s")
+        self._paused_until = max(self._paused_until, now + seconds)
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(base_url: str, api_key: Optional[str]) -> RateLimiter:
+    """The process-wide limiter of an endpoint and key; quotas are per key."""
+    key = (base_url, api_key or "")
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter()
+        return _limiters[key]
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+'''
+Event-loop lag monitor.
+
+A heartbeat task sleeps LEVIOSA_LOOP_INTERVAL_MS at a time and measures how
+late it wakes up: that delay is how long every other connection of the
+worker waited too. A watchdog thread checks the heartbeat, and when the loop
+has been stuck for longer than LEVIOSA_LOOP_LAG_MS it takes the loop
+thread's stack, which names the blocking call (an image decode or rasterize
+that should have gone to a thread, a large JSON encode, ...).
+
+Stalls over the threshold are printed with that stack, appended to
+LEVIOSA_LOOP_LAG_LOG as JSON lines when set, and counted; `GET
+/api/health/loop` returns the counters, a lag histogram and the recent
+stalls. The log file is written by the watchdog thread, so the monitor does
+not block the loop it measures. LEVIOSA_LOOP_LAG_MS=0 turns the monitor off.
+'''
+
+THRESHOLD_MS = float(os.getenv("LEVIOSA_LOOP_LAG_MS", "100"))
+INTERVAL_MS = float(os.getenv("LEVIOSA_LOOP_INTERVAL_MS", "50"))
+LAG_LOG = os.getenv("LEVIOSA_LOOP_LAG_LOG")
+ENABLED = THRESHOLD_MS > 0
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+RECENT_STALLS = 20
+STACK_LIMIT = 15  # frames of the blocking stack kept
+
+
+class LoopMonitor:
+    """Measures the lag of one event loop; start() from inside the loop."""
+
+    def __init__(self, threshold_ms: float = THRESHOLD_MS, interval_ms: float = INTERVAL_MS):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.samples = 0
+        self.stalls = 0
+        self.max_lag_ms = 0.0
+        self.histogram = [0] * (len(BUCKETS_MS) + 1)  # last bucket: over the largest bound
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_STALLS)
+        self._unlogged: Deque[Dict[str, Any]] = deque()  # stalls for the watchdog thread to append to LAG_LOG
+        self._heartbeat = time.monotonic()
+        self._stall_stack: Optional[List[str]] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+        print(f"[LOOP] Monitoring event-loop lag (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _beat(self) -> None:
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                self._heartbeat = now
+                stack, self._stall_stack = self._stall_stack, None
+            self._record(max(0.0, now - before - self.interval), stack)
+
+    def _watch(self) -> None:
+        """Watchdog thread: take the loop thread's stack while it is stalled, and write the lag log."""
+        while not self._stop.wait(self.threshold / 2):
+            self._write_log()
+            with self._lock:
+                stalled = time.monotonic() - self._heartbeat > self.interval + self.threshold
+                if not stalled or self._stall_stack is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                self._stall_stack = traceback.format_stack(frame, limit=STACK_LIMIT) if frame else []
+        self._write_log()
+
+    def _write_log(self) -> None:
+        if not self._unlogged:
+            return
+        lines = []
+        while self._unlogged:
+            lines.append(json.dumps(self._unlogged.popleft()) + "\n")
+        try:
+            with open(LAG_LOG, "a") as f:
+                f.writelines(lines)
+        except OSError as e:
+            print(f"[LOOP] Could not write {LAG_LOG}: {e}")
+
+    def _record(self, lag: float, stack: Optional[List[str]]) -> None:
+        lag_ms = lag * 1000
+        self.samples += 1
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        self.histogram[next((i for i, bound in enumerate(BUCKETS_MS) if lag_ms <= bound), len(BUCKETS_MS))] += 1
+        if lag < self.threshold:
+            return
+
+        self.stalls += 1
+        stall = {"time": time.time(), "lag_ms": round(lag_ms, 1), "stack": [line.rstrip() for line in stack or []]}
+        self.recent.append(stall)
+        print(f"[LOOP] Event loop blocked for {lag_ms:.0f} ms"
+              + (":\n" + "".join(stack) if stack else ""))
+        if LAG_LOG:
+            self._unlogged.append(stall)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "stalls": self.stalls,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "histogram_ms": {
+                **{f"<={bound}": count for bound, count in zip(BUCKETS_MS, self.histogram)},
+                f">{BUCKETS_MS[-1]}": self.histogram[-1],
+            },
+            "recent_stalls": list(self.recent),
+        }
+
+
+monitor: Optional[LoopMonitor] = None
+
+
+def start() -> Optional[LoopMonitor]:
+    """Start the process-wide monitor on the running loop; called on application startup."""
+    global monitor
+    if not ENABLED:
+        return None
+    monitor = LoopMonitor()
+    monitor.start()
+    return monitor
+
+
+async def stop() -> None:
+    if monitor is not None:
+        await monitor.stop()
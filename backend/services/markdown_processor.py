@@ -1,70 +1,152 @@
 import os
-from typing import List, Optional, Dict, Any, AsyncGenerator
-import requests
-import json
+import re
 import asyncio
-import aiohttp
+from typing import List, Optional, Dict, Any, AsyncGenerator, Set, Tuple, Union
+import json
+from services.llm_providers import LLMConfigError, LLMError, LLMProvider, OpenAICompatibleProvider, DEFAULT_PROVIDER, get_provider
+from services.llm_scheduler import estimate_tokens
 from models.schema import OCRResponse, OCRPageResult, OCRResult, LayoutAnalysisResponse, LayoutPageResult, LayoutResult
+from models.document import LayoutDocument, LayoutPage
+from services.orientation import upright_top
+from services.tracing import span
+
+DEFAULT_CONVERSION_PROMPT = (
+    "You are an expert document formatter.\n"
+    "Convert layout-aware OCR regions into structured Markdown.\n"
+    "Use the region type to choose the right formatting: headings, paragraphs, lists, tables, etc."
+)
+
+PACK_INSTRUCTION = (
+    "Convert each of the following page layouts into clean Markdown. "
+    "Start the Markdown of every page with a line <!-- page N -->, where N is its page number, "
+    "and keep the pages in order.\n\n"
+)
+
+# Consecutive small pages are converted in one LLM call, up to this many
+# estimated tokens of page layout together (0: one call per page)
+PACK_TOKENS = int(os.getenv("LEVIOSA_LLM_PACK_TOKENS", "3000"))
+PACK_MAX_PAGES = 4
+PAGE_MARKER = re.compile(r'^[ \t]*<!--\s*page\s+(\d+)\s*-->[ \t]*\n?', re.MULTILINE)
+
+def load_prompt(filename: str, default: str) -> str:
+    """Read a system prompt from prompts/, falling back to a built-in default."""
+    prompt_path = os.path.join("prompts", filename)
+    try:
+        with open(prompt_path, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return default
 
 class MarkdownProcessor:
     """
-    Converts layout-annotated OCR results into Markdown using OpenAI LLM.
+    Converts layout-annotated OCR results into Markdown using an LLM provider.
     Includes streaming support for long PDFs and token-efficient batching.
     """
-    def __init__(self, llm_api_key: Optional[str] = None):
-        """Initialize with optional API key for LLM service"""
+    def __init__(self, llm_api_key: Optional[str] = None, llm_base_url: Optional[str] = None):
+        """Initialize with optional API key and base URL (e.g. a local stub server) for the OpenAI provider"""
         self.api_key = llm_api_key or os.environ.get("OPENAI_API_KEY")
-    
-    async def convert_layout_json_to_markdown(self, layout_result: LayoutAnalysisResponse, prompt: Optional[str] = None) -> str:
-        """
-        Converts layout-aware OCR JSON directly into Markdown using LLM.
-        Processes all pages, not just the first one.
+        self.openai_provider = OpenAICompatibleProvider(api_key=self.api_key, base_url=llm_base_url)
+        self.base_url = self.openai_provider.base_url
+
+    def provider(self, name: Optional[str] = None) -> LLMProvider:
+        """Resolve the provider for a request; this instance's OpenAI settings win for "openai"."""
+        name = name or DEFAULT_PROVIDER
+        if name == "openai":
+            return self.openai_provider
+        return get_provider(name)
+
+    def build_structured_page(self, page_data: Union[LayoutPage, LayoutPageResult],
+                              skip_ids: Optional[Set[str]] = None) -> Dict[str, Any]:
         """
-        if not self.api_key:
-            raise ValueError("No API key provided for LLM markdown conversion.")
+        Build the LLM payload for one page: regions in reading order (top to bottom).
 
-        # Load prompt
-        prompt_path = os.path.join("prompts", "markdown_conversion.txt")
-        try:
-            with open(prompt_path, "r") as f:
-                system_prompt = f.read()
-        except FileNotFoundError:
-            system_prompt = (
-                "You are an expert document formatter.\n"
-                "Convert layout-aware OCR regions into structured Markdown.\n"
-                "Use the region type to choose the right formatting: headings, paragraphs, lists, tables, etc."
-            )
+        Args:
+            page_data: A single page of layout analysis results
+            skip_ids: Region ids left out, e.g. boilerplate repeated on every page
 
-        # Process all pages, not just the first one
-        structured_document = {
-            "pages": [
+        Returns:
+            A dictionary with the page number and its regions
+        """
+        rotation = getattr(page_data, "rotation", 0)
+        skip_ids = skip_ids or set()
+        return {
+            "page": page_data.page,
+            "regions": [
                 {
-                    "page": page_data.page,
-                    "regions": [
-                        {
-                            "type": r.region_type,
-                            "bbox": r.bbox_norm,
-                            "content": r.content
-                        }
-                        for r in sorted(page_data.results, key=lambda r: r.bbox_norm[1])  # top to bottom
-                    ]
+                    "type": r.region_type,
+                    "bbox": list(r.bbox_norm),
+                    "content": r.content
                 }
-                for page_data in layout_result.pages
+                for r in sorted(page_data.results, key=lambda r: upright_top(r.bbox_norm, rotation))  # top to bottom
+                if r.region_id not in skip_ids
             ]
         }
 
+    def build_structured_document(self, layout_result: Union[LayoutDocument, LayoutAnalysisResponse]) -> Dict[str, Any]:
+        """
+        Build the LLM payload for a whole document.
+
+        Args:
+            layout_result: The complete layout analysis result
+
+        Returns:
+            A dictionary with a structured entry per page, plus the document's
+            boilerplate once when any was found; blank and duplicate pages are left out
+        """
+        skip_ids, boilerplate = self._boilerplate(layout_result)
+        document = {"pages": [
+            self.build_structured_page(page_data, skip_ids)
+            for page_data in layout_result.pages
+            if not getattr(page_data, "skipped", None)
+        ]}
+        if boilerplate:
+            document["boilerplate"] = boilerplate
+        return document
+
+    def structured_pages(self, layout_result: Union[LayoutDocument, LayoutAnalysisResponse]) -> List[Dict[str, Any]]:
+        """
+        The per-page LLM payloads of a document, as process_layout_incrementally
+        sends them: blank and duplicate pages left out, boilerplate once with the first page.
+        """
+        skip_ids, boilerplate = self._boilerplate(layout_result)
+        pages = [
+            self.build_structured_page(page_data, skip_ids)
+            for page_data in layout_result.pages
+            if not getattr(page_data, "skipped", None)
+        ]
+        if boilerplate and pages:
+            pages[0]["boilerplate"] = boilerplate
+        return pages
+
+    def _boilerplate(self, layout_result: Union[LayoutDocument, LayoutAnalysisResponse]) -> Tuple[Set[str], List[Dict[str, Any]]]:
+        """Ids of repeated regions to skip and their payload entries, from services.boilerplate."""
+        metadata = getattr(layout_result, "metadata", None) or {}
+        entries = [
+            {"type": entry["region_type"], "bbox": entry["bbox_norm"], "text": entry["text"], "pages": entry["pages"]}
+            for entry in metadata.get("boilerplate", [])
+        ]
+        return metadata.get("boilerplate_ids", set()), entries
+
+    async def convert_layout_json_to_markdown(self, layout_result: Union[LayoutDocument, LayoutAnalysisResponse], prompt: Optional[str] = None,
+                                              llm_provider: Optional[str] = None) -> str:
+        """
+        Converts layout-aware OCR JSON directly into Markdown using LLM.
+        Processes all pages, not just the first one.
+
+        Raises:
+            LLMError: The LLM call failed, after any retries
+        """
+        system_prompt = load_prompt("markdown_conversion.txt", DEFAULT_CONVERSION_PROMPT)
+
+        # Process all pages, not just the first one
+        structured_document = self.build_structured_document(layout_result)
+
         try:
-            print("Sending multi-page layout JSON to OpenAI...")
-
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o",
-                    "messages": [
+            print("Sending multi-page layout JSON to LLM...")
+
+            with span("markdown.convert", caller="convert_layout_json_to_markdown", pages=len(structured_document.get("pages", []))):
+                return await self.provider(llm_provider).chat(
+                    [
                         {
                             "role": "system",
                             "content": system_prompt
@@ -78,176 +160,220 @@ class MarkdownProcessor:
                             )
                         }
                     ],
-                    "temperature": 0.2
-                }
-            )
+                    temperature=0.2
+                )
 
-            response_data = response.json()
-            if "choices" in response_data and len(response_data["choices"]) > 0:
-                return response_data["choices"][0]["message"]["content"]
-            else:
-                return f"Error in LLM response: {json.dumps(response_data)}"
+        except LLMError as e:
+            print(f"[LLM] Markdown conversion failed: {e}")
+            raise
 
-        except Exception as e:
-            return f"Failed to call LLM: {str(e)}"
-            
-    async def direct_layout_to_markdown(self, layout_json: Dict[str, Any]) -> str:
+    async def direct_layout_to_markdown(self, layout_json: Dict[str, Any], prompt: Optional[str] = None,
+                                        llm_provider: Optional[str] = None) -> str:
         """
         Sends the full layout JSON directly to LLM without any pre-processing.
         This method allows sending the complete structured document to the LLM.
-        
+
         Args:
             layout_json: The complete layout analysis result as a dictionary
-            
+            prompt: Optional user instructions placed before the layout
+            llm_provider: Provider name; LLM_PROVIDER when omitted
+
         Returns:
             The markdown formatted document as returned by the LLM
+
+        Raises:
+            LLMError: The LLM call failed, after any retries
         """
-        if not self.api_key:
-            raise ValueError("No API key provided for LLM markdown conversion.")
+        system_prompt = load_prompt("markdown_conversion.txt", DEFAULT_CONVERSION_PROMPT)
 
-        # Load prompt
-        prompt_path = os.path.join("prompts", "markdown_conversion.txt")
         try:
-            with open(prompt_path, "r") as f:
-                system_prompt = f.read()
-        except FileNotFoundError:
-            system_prompt = (
-                "You are an expert document formatter.\n"
-                "Convert layout-aware OCR regions into structured Markdown.\n"
-                "Use the region type to choose the right formatting: headings, paragraphs, lists, tables, etc."
-            )
+            print("Sending full layout JSON to LLM...")
 
-        try:
-            print("Sending full layout JSON to OpenAI...")
-
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o",
-                    "messages": [
+            with span("markdown.convert", caller="direct_layout_to_markdown", pages=len(layout_json.get("pages", []))):
+                return await self.provider(llm_provider).chat(
+                    [
                         {
                             "role": "system",
                             "content": system_prompt
                         },
                         {
                             "role": "user",
-                            "content": f"Convert the following complete document layout into clean Markdown:\n\n{json.dumps(layout_json, indent=2)}"
+                            "content": (
+                                (f"{prompt.strip()}\n\n" if prompt else "") +
+                                f"Convert the following complete document layout into clean Markdown:\n\n{json.dumps(layout_json, indent=2)}"
+                            )
                         }
                     ],
-                    "temperature": 0.2
-                }
-            )
+                    temperature=0.2
+                )
 
-            response_data = response.json()
-            if "choices" in response_data and len(response_data["choices"]) > 0:
-                return response_data["choices"][0]["message"]["content"]
-            else:
-                return f"Error in LLM response: {json.dumps(response_data)}"
+        except LLMError as e:
+            print(f"[LLM] Markdown conversion failed: {e}")
+            raise
 
-        except Exception as e:
-            return f"Failed to call LLM: {str(e)}"
-            
-    async def process_layout_incrementally(self, layout_result: LayoutAnalysisResponse) -> AsyncGenerator[Dict[str, Any], None]:
+    async def process_layout_incrementally(self, layout_result: Union[LayoutDocument, LayoutAnalysisResponse],
+                                           llm_provider: Optional[str] = None,
+                                           pack_pages: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
         """
         Process layout pages incrementally and yield results as they're ready.
         This is used for streaming responses.
-        
+
         Args:
             layout_result: The complete layout analysis result
-            
+            llm_provider: Provider name; LLM_PROVIDER when omitted
+            pack_pages: Convert consecutive small pages in one LLM call (see
+                PACK_TOKENS). Their results then come together, once the last
+                of them is converted, so streaming callers leave it off
+
         Yields:
-            A dictionary with page number and markdown content for each page
+            A dictionary with page number and markdown content for each page;
+            blank pages have no markdown and duplicate pages repeat the markdown
+            of their original, without an LLM call, and carry "skipped". A page
+            whose conversion failed has empty markdown and an "error"
+            (see LLMError.to_dict)
         """
+        skip_ids, boilerplate = self._boilerplate(layout_result)
+        converted: Dict[int, str] = {}
+        pack: List[Dict[str, Any]] = []
+        pack_tokens = 0
+        first = True
         for page_data in layout_result.pages:
-            structured_page = {
-                "page": page_data.page,
-                "regions": [
-                    {
-                        "type": r.region_type,
-                        "bbox": r.bbox_norm,
-                        "content": r.content
-                    }
-                    for r in sorted(page_data.results, key=lambda r: r.bbox_norm[1])  # top to bottom
-                ]
-            }
-            
-            markdown = await self._process_single_page(structured_page)
-            
+            skipped = getattr(page_data, "skipped", None)
+            if skipped:
+                async for page_result in self._convert_pack(pack, converted, llm_provider):
+                    yield page_result
+                pack, pack_tokens = [], 0
+                yield {
+                    "page": page_data.page,
+                    "markdown": converted.get(page_data.duplicate_of, ""),
+                    "skipped": skipped
+                }
+                continue
+
+            structured_page = self.build_structured_page(page_data, skip_ids)
+            if boilerplate and first:
+                # Repeated headers and footers are sent once, with the first page
+                structured_page["boilerplate"] = boilerplate
+            first = False
+
+            # Small pages wait to be sent together with the next ones
+            tokens = estimate_tokens(json.dumps(structured_page, indent=2)) if pack_pages else PACK_TOKENS + 1
+            if pack and (len(pack) >= PACK_MAX_PAGES or pack_tokens + tokens > PACK_TOKENS):
+                async for page_result in self._convert_pack(pack, converted, llm_provider):
+                    yield page_result
+                pack, pack_tokens = [], 0
+            pack.append(structured_page)
+            pack_tokens += tokens
+
+        async for page_result in self._convert_pack(pack, converted, llm_provider):
+            yield page_result
+
+    async def _convert_pack(self, pages: List[Dict[str, Any]], converted: Dict[int, str],
+                            llm_provider: Optional[str]) -> AsyncGenerator[Dict[str, Any], None]:
+        """Convert structured pages together and yield their results; failures become page errors."""
+        if not pages:
+            return
+        try:
+            results = await self.convert_pages(pages, llm_provider=llm_provider)
+        except LLMConfigError:
+            raise
+        except Exception as e:
+            error = e if isinstance(e, LLMError) else LLMError(f"Failed to process page: {e}")
+            print(f"[LLM] Pages {', '.join(str(p['page']) for p in pages)} failed: {error}")
+            for page in pages:
+                converted[page["page"]] = ""
+                yield {
+                    "page": page["page"],
+                    "markdown": "",
+                    "error": error.to_dict()
+                }
+            return
+
+        for page, markdown in zip(pages, results):
+            converted[page["page"]] = markdown
             yield {
-                "page": page_data.page,
+                "page": page["page"],
                 "markdown": markdown
             }
-            
-    async def _process_single_page(self, page_data: Dict[str, Any]) -> str:
+
+    async def convert_pages(self, pages: List[Dict[str, Any]], llm_provider: Optional[str] = None) -> List[str]:
         """
-        Process a single page of layout data.
-        
-        Args:
-            page_data: Structured page data with region information
-            
+        Convert several structured pages in one LLM call, saving round trips
+        and requests-per-minute quota on small pages. The answer is split at
+        page markers; if the model did not mark every page, the pages are
+        converted one by one instead. LLM failures are raised.
+
         Returns:
-            Markdown representation of the page
+            The Markdown of each page, in order
         """
-        prompt_path = os.path.join("prompts", "markdown_conversion.txt")
-        try:
-            with open(prompt_path, "r") as f:
-                system_prompt = f.read()
-        except FileNotFoundError:
-            system_prompt = (
-                "You are an expert document formatter.\n"
-                "Convert layout-aware OCR regions into structured Markdown.\n"
-                "Use the region type to choose the right formatting: headings, paragraphs, lists, tables, etc."
+        if len(pages) == 1:
+            return [await self.convert_page(pages[0], llm_provider=llm_provider)]
+
+        system_prompt = load_prompt("markdown_conversion.txt", DEFAULT_CONVERSION_PROMPT)
+        with span("markdown.convert", caller="convert_pages", pages=len(pages)):
+            response = await self.provider(llm_provider).chat(
+                [
+                    {
+                        "role": "system",
+                        "content": system_prompt
+                    },
+                    {
+                        "role": "user",
+                        "content": PACK_INSTRUCTION + json.dumps(pages, indent=2)
+                    }
+                ],
+                temperature=0.2
             )
-            
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
+
+        parts = PAGE_MARKER.split(response)
+        markdown = {int(number): text.strip() for number, text in zip(parts[1::2], parts[2::2])}
+        if list(markdown) != [page["page"] for page in pages]:
+            print(f"[LLM] Packed answer for {len(pages)} pages was not marked per page; converting them separately")
+            return list(await asyncio.gather(*(self.convert_page(page, llm_provider=llm_provider) for page in pages)))
+        return [markdown[page["page"]] for page in pages]
+
+    async def convert_page(self, page_data: Dict[str, Any], llm_provider: Optional[str] = None) -> str:
+        """
+        Convert one structured page (see build_structured_page) to Markdown.
+        LLM failures are raised.
+        """
+        system_prompt = load_prompt("markdown_conversion.txt", DEFAULT_CONVERSION_PROMPT)
+        with span("markdown.convert", caller="convert_page", page=page_data.get("page")):
+            return await self.provider(llm_provider).chat(
+                [
+                    {
+                        "role": "system",
+                        "content": system_prompt
                     },
-                    json={
-                        "model": "gpt-4o",
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": system_prompt
-                            },
-                            {
-                                "role": "user",
-                                "content": f"Convert the following page layout into clean Markdown:\n\n{json.dumps(page_data, indent=2)}"
-                            }
-                        ],
-                        "temperature": 0.2
+                    {
+                        "role": "user",
+                        "content": f"Convert the following page layout into clean Markdown:\n\n{json.dumps(page_data, indent=2)}"
                     }
-                ) as response:
-                    response_data = await response.json()
-                    
-                    if "choices" in response_data and len(response_data["choices"]) > 0:
-                        return response_data["choices"][0]["message"]["content"]
-                    else:
-                        return f"Error in LLM response: {json.dumps(response_data)}"
-        except Exception as e:
-            return f"Failed to process page: {str(e)}"
-            
-    async def layout_to_markdown(self, layout_result: LayoutAnalysisResponse) -> str:
+                ],
+                temperature=0.2
+            )
+
+    async def layout_to_markdown(self, layout_result: Union[LayoutDocument, LayoutAnalysisResponse],
+                                 llm_provider: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
         """
         Process all pages and combine into a single markdown document.
-        
+
         Args:
             layout_result: The complete layout analysis result
-            
+            llm_provider: Provider name; LLM_PROVIDER when omitted
+
         Returns:
-            Complete markdown document
+            Complete markdown document, without blank, duplicate or failed
+            pages, and the errors of the failed pages
         """
         markdown_parts = []
-        
-        async for page_result in self.process_layout_incrementally(layout_result):
-            markdown_parts.append(page_result["markdown"])
-            
-        return "\n\n".join(markdown_parts)
\ No newline at end of file
+        errors = []
+
+        async for page_result in self.process_layout_incrementally(layout_result, llm_provider=llm_provider,
+                                                                   pack_pages=True):
+            if "error" in page_result:
+                errors.append({"page": page_result["page"], **page_result["error"]})
+            elif not page_result.get("skipped"):
+                markdown_parts.append(page_result["markdown"])
+
+        return "\n\n".join(markdown_parts), errors
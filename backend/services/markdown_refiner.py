@@ -1,73 +1,232 @@
 import os
-from typing import Optional
-import requests
-import json
+import re
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from services.llm_providers import LLMConfigError, LLMError, LLMProvider, OpenAICompatibleProvider, DEFAULT_PROVIDER, get_provider
+from services.markdown_processor import load_prompt
+from services.tracing import span
+
+DEFAULT_REFINEMENT_PROMPT = (
+    "You are an expert Markdown formatter.\n"
+    "Refine the given markdown to be clean, consistent, and free of OCR errors.\n"
+    "Fix formatting, clean up tables, and ensure proper document structure."
+)
+
+SECTION_INSTRUCTION = (
+    "The following is one section of a longer document. "
+    "Return only the refined section, without any preamble.\n\n"
+)
+
+# Sections are refined concurrently, at most this many LLM calls at a time
+REFINE_CONCURRENCY = int(os.getenv("LEVIOSA_REFINE_CONCURRENCY", "8"))
+# Sections longer than this are split at paragraph breaks; neighbouring sections
+# that both need refinement are sent together up to this size
+SECTION_MAX_CHARS = int(os.getenv("LEVIOSA_REFINE_SECTION_CHARS", "6000"))
+
+HEADING = re.compile(r'^#{1,6}\s')
+FENCE = re.compile(r'^\s*(```|~~~)')
+OCR_NOISE = [
+    (re.compile(r'\ufffd'), "replacement character"),
+    (re.compile(r'(?<![`*_|\-=#~<>])[^\w\s`*_|\-=#~<>()\[\]{}$.,;:!?\'"/\\%&+]{3,}'), "symbol run"),
+    (re.compile(r'\b[a-zA-Z]+\d+[a-zA-Z]+\b|\b[a-zA-Z]*[Il1|][0O][a-zA-Z]+\b'), "mixed letters and digits"),
+    (re.compile(r'\b\w+-\n\w+'), "hyphenated line break"),
+    (re.compile(r'(?:\b\w\b ){4,}'), "spaced-out letters"),
+    # Pipe-table rows are padded to align their columns
+    (re.compile(r'^(?![ \t]*\|).*?\S {3,}\S', re.MULTILINE), "run of spaces"),
+    (re.compile(r'\b(\w{2,})( \1\b){2,}', re.IGNORECASE), "repeated word"),
+]
+
+
+def split_sections(markdown: str, max_chars: int = SECTION_MAX_CHARS) -> List[str]:
+    """
+    Split markdown at headings, then split oversized sections at blank lines.
+    Never splits inside a fenced code block or an HTML table.
+
+    Returns:
+        Sections whose concatenation is the original markdown
+    """
+    blocks: List[str] = []
+    current: List[str] = []
+    in_fence = False
+    table_depth = 0
+    for line in markdown.splitlines(keepends=True):
+        if FENCE.match(line):
+            in_fence = not in_fence
+        table_depth += len(re.findall(r'<table\b', line, re.IGNORECASE)) - len(re.findall(r'</table>', line, re.IGNORECASE))
+        table_depth = max(table_depth, 0)
+        if current and HEADING.match(line) and not in_fence and table_depth == 0:
+            blocks.append("".join(current))
+            current = []
+        current.append(line)
+        # Paragraph break inside an oversized section
+        if (not line.strip() and not in_fence and table_depth == 0
+                and sum(len(l) for l in current) >= max_chars):
+            blocks.append("".join(current))
+            current = []
+    if current:
+        blocks.append("".join(current))
+    return blocks
+
+
+def _table_issues(section: str) -> List[str]:
+    issues = []
+    if len(re.findall(r'<table\b', section, re.IGNORECASE)) != len(re.findall(r'</table>', section, re.IGNORECASE)):
+        issues.append("unbalanced HTML table")
+    for table in re.findall(r'<table\b.*?</table>', section, re.IGNORECASE | re.DOTALL):
+        rows = re.findall(r'<tr\b.*?</tr>', table, re.IGNORECASE | re.DOTALL)
+        widths = {len(re.findall(r'<t[dh]\b', row, re.IGNORECASE)) for row in rows if 'colspan' not in row.lower()}
+        if len(widths) > 1:
+            issues.append("ragged HTML table")
+    # Markdown pipe tables: every row of a block has the same number of cells, and a separator row
+    for block in re.findall(r'(?:^\s*\|.*\|\s*$\n?)+', section, re.MULTILINE):
+        rows = [r.strip() for r in block.strip().splitlines()]
+        if len({r.count("|") for r in rows}) > 1:
+            issues.append("ragged pipe table")
+        if len(rows) > 1 and not re.match(r'^\|[\s:|-]+\|$', rows[1]):
+            issues.append("pipe table without separator row")
+    return issues
+
+
+def lint_section(section: str) -> List[str]:
+    """
+    Local checks for sections that need no LLM pass: balanced tables, closed
+    code fences and no common OCR noise patterns.
+
+    Returns:
+        The issues found; an empty list means the section is clean
+    """
+    issues = _table_issues(section)
+    if sum(1 for line in section.splitlines() if FENCE.match(line)) % 2:
+        issues.append("unclosed code fence")
+    # Code is left as it is
+    prose = re.sub(r'```.*?```|`[^`\n]*`', '', section, flags=re.DOTALL)
+    prose = re.sub(r'<[^>]+>', ' ', prose)
+    for pattern, issue in OCR_NOISE:
+        if pattern.search(prose):
+            issues.append(issue)
+    return issues
+
+
+def _group_sections(sections: List[str], max_chars: int) -> List[Tuple[str, bool]]:
+    """
+    Pair each section with whether it needs refinement, joining neighbouring
+    sections that both need it while they stay under max_chars.
+    """
+    groups: List[Tuple[str, bool]] = []
+    for section in sections:
+        dirty = bool(section.strip()) and bool(lint_section(section))
+        if groups and dirty and groups[-1][1] and len(groups[-1][0]) + len(section) <= max_chars:
+            groups[-1] = (groups[-1][0] + section, True)
+        else:
+            groups.append((section, dirty))
+    return groups
+
+
+def _stitch(original: str, refined: str) -> str:
+    """Keep the original section's trailing blank lines so sections stay separated."""
+    trailing = original[len(original.rstrip("\n")):]
+    return refined.strip("\n") + (trailing or "\n")
 
 class MarkdownRefiner:
     """
     Refines raw markdown from OCR/layout processing to create clean, display-ready markdown.
     Uses LLM to improve formatting, fix OCR errors, and standardize document structure.
     """
-    
-    def __init__(self, llm_api_key: Optional[str] = None):
+
+    def __init__(self, llm_api_key: Optional[str] = None, llm_base_url: Optional[str] = None):
         self.api_key = llm_api_key or os.environ.get("OPENAI_API_KEY")
-        
-    def refine_markdown(self, raw_markdown: str) -> str:
+        self.openai_provider = OpenAICompatibleProvider(api_key=self.api_key, base_url=llm_base_url)
+        self.base_url = self.openai_provider.base_url
+
+    def provider(self, name: Optional[str] = None) -> LLMProvider:
+        """Resolve the provider for a request; this instance's OpenAI settings win for "openai"."""
+        name = name or DEFAULT_PROVIDER
+        if name == "openai":
+            return self.openai_provider
+        return get_provider(name)
+
+    async def refine_markdown(self, raw_markdown: str,
+                              llm_provider: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]]]:
         """
         Refines raw markdown using LLM to create clean, structured output
         that's ready for display and rendering.
-        
+
+        The markdown is split at headings and the sections are refined
+        concurrently; sections the local lint pass finds clean are kept as
+        they are. A section whose refinement fails keeps its original text.
+
         Args:
             raw_markdown: The raw markdown string from initial processing
-            
+            llm_provider: Provider name; LLM_PROVIDER when omitted
+
         Returns:
-            Refined, cleaned markdown with consistent structure
+            Refined, cleaned markdown with consistent structure, and the
+            errors of the sections kept unrefined
+
+        Raises:
+            LLMError: Every section that needed refinement failed
         """
-        if not self.api_key:
-            raise ValueError("No API key provided for LLM markdown refinement.")
-            
         # Load the refinement prompt
-        prompt_path = os.path.join("prompts", "markdown_refinement.txt")
-        try:
-            with open(prompt_path, "r") as f:
-                system_prompt = f.read()
-        except FileNotFoundError:
-            system_prompt = (
-                "You are an expert Markdown formatter.\n"
-                "Refine the given markdown to be clean, consistent, and free of OCR errors.\n"
-                "Fix formatting, clean up tables, and ensure proper document structure."
-            )
-            
+        system_prompt = load_prompt("markdown_refinement.txt", DEFAULT_REFINEMENT_PROMPT)
+        provider = self.provider(llm_provider)
+        groups = _group_sections(split_sections(raw_markdown), SECTION_MAX_CHARS)
+        dirty = [section for section, needs_refinement in groups if needs_refinement]
+        semaphore = asyncio.Semaphore(REFINE_CONCURRENCY)
+
+        async def refine(section: str) -> Tuple[str, Optional[LLMError]]:
+            async with semaphore:
+                return await self._refine_section(provider, system_prompt, section, whole=len(groups) == 1)
+
+        with span("markdown.refine", sections=len(groups), refined=len(dirty)):
+            print(f"Refining {len(dirty)} of {len(groups)} markdown sections...")
+            results = iter(await asyncio.gather(*(refine(section) for section in dirty)))
+
+        parts, errors = [], []
+        first_error: Optional[LLMError] = None
+        for index, (section, needs_refinement) in enumerate(groups):
+            if not needs_refinement:
+                parts.append(section)
+                continue
+            refined, error = next(results)
+            if error is not None:
+                first_error = first_error or error
+                print(f"[REFINE] Section {index} kept unrefined: {error}")
+                errors.append({"section": index, **error.to_dict()})
+                parts.append(section)
+            else:
+                parts.append(_stitch(section, refined))
+
+        if dirty and len(errors) == len(dirty):
+            raise first_error
+        return "".join(parts), errors
+
+    async def _refine_section(self, provider: LLMProvider, system_prompt: str, section: str,
+                              whole: bool = False) -> Tuple[str, Optional[LLMError]]:
+        """
+        Refine one section.
+
+        Returns:
+            The refined text and None, or the original text and the error
+        """
         try:
-            print("Sending markdown for refinement...")
-            
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4o",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": raw_markdown
-                        }
-                    ],
-                    "temperature": 0.1  # Low temperature for consistent formatting
-                }
+            refined = await provider.chat(
+                [
+                    {
+                        "role": "system",
+                        "content": system_prompt
+                    },
+                    {
+                        "role": "user",
+                        "content": section if whole else SECTION_INSTRUCTION + section
+                    }
+                ],
+                temperature=0.1  # Low temperature for consistent formatting
             )
-            
-            response_data = response.json()
-            if "choices" in response_data and len(response_data["choices"]) > 0:
-                return response_data["choices"][0]["message"]["content"]
-            else:
-                return f"Error in LLM response: {json.dumps(response_data)}"
-                
+            return refined, None
+
+        except LLMConfigError:
+            raise
+        except LLMError as e:
+            return section, e
         except Exception as e:
-            return f"Failed to refine markdown: {str(e)}" 
\ No newline at end of file
+            return section, LLMError(f"Failed to refine markdown: {str(e)}")
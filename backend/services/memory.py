@@ -0,0 +1,180 @@
+import contextvars
+import json
+import os
+import random
+import resource
+import threading
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+'''
+Per-request memory accounting.
+
+A sampled request (a share LEVIOSA_MEMORY_SAMPLE_RATE of all requests, or any
+request with the `X-Leviosa-Memory` header) runs with tracemalloc on and
+records its peak Python allocation in total and per stage. Stages are the
+tracing spans (`pdf.rasterize`, `structure_engine`, `ocr_engine`, ...), so
+instrumented code needs nothing else; when the request is also traced the
+stage peaks are attached to the spans.
+
+tracemalloc sees allocations made through Python's allocators and NumPy
+(page arrays, crops, results), not PIL's image buffers or the Paddle
+predictors' own memory, so the report also carries the worker's RSS. Peaks
+are process-wide: with concurrent requests in one worker they are upper
+bounds for each request.
+
+Reports are printed, returned in the `X-Memory-Peak-MB` response header and,
+with LEVIOSA_MEMORY_LOG set, appended to that file as JSON lines.
+'''
+
+SAMPLE_RATE = float(os.getenv("LEVIOSA_MEMORY_SAMPLE_RATE", "0"))
+MEMORY_LOG = os.getenv("LEVIOSA_MEMORY_LOG")
+MEMORY_HEADER = "X-Leviosa-Memory"
+PEAK_HEADER = "X-Memory-Peak-MB"
+
+_current_report: contextvars.ContextVar[Optional["MemoryReport"]] = contextvars.ContextVar("leviosa_memory", default=None)
+
+# Open measurement windows. tracemalloc keeps a single peak for the process, so
+# it is folded into every open window and reset whenever a window opens or closes.
+_lock = threading.Lock()
+_windows: List["_Window"] = []
+_started_tracemalloc = False
+
+
+class _Window:
+    __slots__ = ("base", "peak")
+
+    def __init__(self):
+        self.base = 0
+        self.peak = 0
+
+
+def _fold_peak() -> int:
+    """Fold the process peak into the open windows; returns current traced memory. Hold _lock."""
+    current, peak = tracemalloc.get_traced_memory()
+    for window in _windows:
+        window.peak = max(window.peak, peak)
+    tracemalloc.reset_peak()
+    return current
+
+
+def _open_window() -> _Window:
+    global _started_tracemalloc
+    window = _Window()
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracemalloc = True
+        window.base = window.peak = _fold_peak()
+        _windows.append(window)
+    return window
+
+
+def _close_window(window: _Window) -> int:
+    """Close a window; returns its peak allocation above where it started, in bytes."""
+    global _started_tracemalloc
+    with _lock:
+        _fold_peak()
+        _windows.remove(window)
+        if not _windows and _started_tracemalloc:
+            tracemalloc.stop()
+            _started_tracemalloc = False
+    return max(0, window.peak - window.base)
+
+
+def _rss_mb() -> Dict[str, float]:
+    """Current RSS from /proc where available, and the worker's RSS high-water mark."""
+    usage = {"rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    try:
+        with open("/proc/self/statm") as f:
+            usage["rss_mb"] = round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return usage
+
+
+def should_sample(headers) -> bool:
+    """Whether a request is measured: the X-Leviosa-Memory header, else LEVIOSA_MEMORY_SAMPLE_RATE."""
+    value = headers.get(MEMORY_HEADER)
+    if value is not None:
+        return value.lower() not in ("0", "false", "off")
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def current_report() -> Optional["MemoryReport"]:
+    return _current_report.get()
+
+
+class MemoryStage:
+    """Peak allocation of one stage; also stands in for a span when the request is not traced."""
+
+    def __init__(self, report: "MemoryReport", name: str):
+        self.report = report
+        self.name = name
+        self.peak = 0
+        self._window: Optional[_Window] = None
+
+    def __enter__(self):
+        self._window = _open_window()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.peak = _close_window(self._window)
+        self.report.record_stage(self.name, self.peak)
+        return False
+
+    def set(self, **args: Any) -> None:
+        pass
+
+
+class MemoryReport:
+    """The memory measurements of one request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, int] = {}  # largest peak per stage name, in bytes
+        self.peak = 0
+        self._window: Optional[_Window] = None
+        self._stage_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Activate the report in the current context and start measuring."""
+        _current_report.set(self)
+        self._window = _open_window()
+
+    def stage(self, name: str) -> MemoryStage:
+        return MemoryStage(self, name)
+
+    def record_stage(self, name: str, peak: int) -> None:
+        with self._stage_lock:
+            self.stages[name] = max(self.stages.get(name, 0), peak)
+
+    def peak_so_far(self) -> int:
+        """The request's peak until now, without closing it."""
+        with _lock:
+            _fold_peak()
+            return max(0, self._window.peak - self._window.base) if self._window else self.peak
+
+    def finish(self) -> Dict[str, Any]:
+        """Stop measuring, then print and log the report."""
+        if self._window is not None:
+            self.peak = _close_window(self._window)
+            self._window = None
+        report = self.to_dict()
+        stages = ", ".join(f"{name} {mb:.1f}" for name, mb in report["stages_mb"].items())
+        print(f"[MEMORY] {self.name}: peak {report['peak_mb']:.1f} MB, RSS {report.get('rss_mb', '?')} MB"
+              + (f" ({stages})" if stages else ""))
+        if MEMORY_LOG:
+            with open(MEMORY_LOG, "a") as f:
+                f.write(json.dumps(report) + "\n")
+        return report
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._stage_lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "request": self.name,
+            "peak_mb": round(self.peak / 2**20, 2),
+            "stages_mb": {name: round(peak / 2**20, 2) for name, peak in stages},
+            **_rss_mb(),
+        }
@@ -1,60 +1,156 @@
-import numpy as np
 from PIL import Image
-import io
 import uuid
 import re
-from typing import Union, BinaryIO
+from typing import Awaitable, Union, BinaryIO, Optional
 from fastapi import UploadFile
 import asyncio
 
-from models.schema import OCRResponse, OCRResult, OCRPageResult
-from services.pdf_to_image import convert_pdf_to_images
-from paddleocr import PaddleOCR
+from models.schema import OCRResponse, OCRResult, OCRPageResult, PipelineOptions
+from services import languages, orientation, reocr, search_index, tiling
+from services.engines import detect_language, exclusive, get_ocr_engine
+from services.page_filter import PageFilter, PageVerdict
+from services.singleflight import SingleFlight, content_key
+from services.input_limits import open_image, to_array, plan_rasterization
+from services.pdf_to_image import convert_pdf_to_images, render_pdf_page
+from services.tracing import span
 
 '''
 In this file, we use PaddleOCR to extract text and bounding boxes from images.
+The engine itself is shared and lives in services/engines.py.
 '''
-# Initialize PaddleOCR (lightweight EN version, CPU)
-ocr_engine = PaddleOCR(
-    use_angle_cls=True,
-    lang='en',
-    det_model_dir='models/en_PP-OCRv3_det_infer',
-    rec_model_dir='models/en_PP-OCRv3_rec_infer',
-    use_gpu=False
-)
+
+_flights = SingleFlight("OCR")
 
 async def extract_text_and_boxes(
-    input_file: Union[str, UploadFile, BinaryIO]
+    input_file: Union[str, UploadFile, BinaryIO],
+    options: Optional[PipelineOptions] = None
 ) -> OCRResponse:
     if isinstance(input_file, str) and input_file.lower().endswith(".pdf"):
-        image_paths = convert_pdf_to_images(input_file)[:3]  # Limit to 3 pages
-        pages = [await _process_image_path(p, i + 1) for i, p in enumerate(image_paths)]
-        return OCRResponse(pages=pages)
+        return await extract_pdf_pages(input_file, options, max_pages=3)  # Limit to 3 pages
+
+    # Concurrent requests for the same image, options and indexed document share one OCR run
+    key = await content_key(input_file, "ocr", options, search_index.doc_id_of(input_file))
+    return await _flights.run(key, lambda: _indexed(input_file, _extract_image(input_file, options)))
+
+async def _indexed(source: Union[str, UploadFile, BinaryIO], run: Awaitable[OCRResponse]) -> OCRResponse:
+    """Run an OCR flight and index its lines, once per flight rather than once per waiter."""
+    response = await run
+    await asyncio.to_thread(search_index.index_document, source, search_index.ocr_entries(response.pages),
+                            search_index.OCR)
+    return response
 
+async def _extract_image(input_file: Union[str, UploadFile, BinaryIO], options: Optional[PipelineOptions]) -> OCRResponse:
     if isinstance(input_file, str) and input_file.lower().endswith((".png", ".jpg", ".jpeg")):
-        return OCRResponse(pages=[await _process_image_path(input_file, page=1)])
+        return OCRResponse(pages=[await _process_image_path(input_file, page=1, options=options)])
+    return OCRResponse(pages=[await _process_image_input(input_file, page=1, options=options)])
+
+async def extract_pdf_pages(
+    pdf_path: str,
+    options: Optional[PipelineOptions] = None,
+    max_pages: Optional[int] = None
+) -> OCRResponse:
+    """
+    OCR the pages of a PDF rasterized at LEVIOSA_REOCR_BASE_DPI (LEVIOSA_RASTER_DPI without re-OCR).
+    Low-confidence lines are re-read from a LEVIOSA_REOCR_DPI render of their page.
+    Blank and repeated pages are skipped unless `options.page_filter` is off.
+    Both resolutions are lowered when a page would exceed the pixel budget.
+    Concurrent requests for the same PDF and options share one run.
+    The lines are added to the search index.
+    """
+    key = await content_key(pdf_path, "ocr", options, max_pages, search_index.doc_id_of(pdf_path))
+    return await _flights.run(key, lambda: _indexed(pdf_path, _extract_pdf_pages(pdf_path, options, max_pages)))
+
+async def _extract_pdf_pages(pdf_path: str, options: Optional[PipelineOptions], max_pages: Optional[int]) -> OCRResponse:
+    plan = await asyncio.to_thread(plan_rasterization, pdf_path, reocr.base_dpi(options), max_pages)
+    image_paths = await asyncio.to_thread(convert_pdf_to_images, pdf_path, plan=plan)
+    reocr_dpi = min(reocr.REOCR_DPI, plan.max_dpi)
 
-    return OCRResponse(pages=[await _process_image_input(input_file, page=1)])
+    page_filter = PageFilter() if options is None or options.page_filter else None
+    pages = []
+    for i, image_path in enumerate(image_paths):
+        high_res = None
+        if reocr_dpi > plan.dpi:
+            high_res = reocr.HighResPage(lambda page=i + 1: render_pdf_page(pdf_path, page, reocr_dpi),
+                                         reocr_dpi / plan.dpi)
+        pages.append(await _process_image_path(image_path, i + 1, options, high_res, page_filter))
+        options = languages.keep_detected(options, pages[-1].lang)
+    return OCRResponse(pages=pages)
 
-async def _process_image_input(input_file: Union[UploadFile, BinaryIO], page: int) -> OCRPageResult:
+async def _process_image_input(input_file: Union[UploadFile, BinaryIO], page: int,
+                               options: Optional[PipelineOptions] = None) -> OCRPageResult:
     content = await input_file.read() if hasattr(input_file, "read") else input_file.read()
-    image = Image.open(io.BytesIO(content)).convert("RGB")
     if hasattr(input_file, "seek"):
         await input_file.seek(0)
-    return await _process_pil_image(image, page)
+    return await _process_pil_image(await asyncio.to_thread(open_image, content), page, options)
 
-async def _process_image_path(path: str, page: int) -> OCRPageResult:
-    image = Image.open(path).convert("RGB")
-    return await _process_pil_image(image, page)
+async def _process_image_path(path: str, page: int, options: Optional[PipelineOptions] = None,
+                              high_res: Optional[reocr.HighResPage] = None,
+                              page_filter: Optional[PageFilter] = None) -> OCRPageResult:
+    try:
+        return await _process_pil_image(await asyncio.to_thread(open_image, path), page, options, high_res, page_filter)
+    except BaseException:
+        if page_filter is not None:
+            page_filter.forget(page)  # duplicates of this page must not wait for it
+        raise
 
-async def _process_pil_image(image: Image.Image, page: int) -> OCRPageResult:
+async def _skipped_ocr_page(page: int, verdict: PageVerdict, page_filter: PageFilter) -> OCRPageResult:
+    """A blank page without lines, or a duplicate with copies of the lines of the page it repeats."""
+    original = await page_filter.result_of(verdict.duplicate_of) if verdict.duplicate_of else None
+    if original is None:
+        return OCRPageResult(page=page, results=[], skipped=verdict.skipped, duplicate_of=verdict.duplicate_of)
+    results = [line.copy(update={"line_id": str(uuid.uuid4()), "page": page}) for line in original.results]
+    return OCRPageResult(page=page, results=results, rotation=original.rotation,
+                         skipped=verdict.skipped, duplicate_of=verdict.duplicate_of, lang=original.lang)
+
+async def _process_pil_image(image: Image.Image, page: int, options: Optional[PipelineOptions] = None,
+                             high_res: Optional[reocr.HighResPage] = None,
+                             page_filter: Optional[PageFilter] = None) -> OCRPageResult:
+    lang = languages.check(options.lang if options is not None else None)
     width, height = image.size
-    image_np = np.array(image)
-    results = await asyncio.to_thread(ocr_engine.ocr, image_np, cls=True)
+    image_np = await asyncio.to_thread(to_array, image)
+    del image  # the array is the only full-size copy of the page from here on
+
+    # Blank pages and re-scans of an earlier page skip the models
+    if page_filter is not None:
+        verdict = await asyncio.to_thread(page_filter.check, page, image_np)
+        if verdict.skipped:
+            return await _skipped_ocr_page(page, verdict, page_filter)
+    use_cls = options.angle_cls if options is not None else True
+    rotation = 0
+    if use_cls and orientation.ENABLED:
+        # One orientation decision per page; per-line classification only when it is unclear
+        with span("page_orientation", page=page) as s:
+            image_np, page_orientation = await asyncio.to_thread(exclusive(orientation.make_upright), image_np, get_ocr_engine())
+            s.set(angle=page_orientation.angle, ambiguous=page_orientation.ambiguous)
+        rotation = page_orientation.angle
+        use_cls = page_orientation.ambiguous
+
+    if lang == languages.AUTO:
+        with span("language_detect", page=page) as s:
+            lang = await asyncio.to_thread(detect_language, image_np)
+            s.set(lang=lang)
+    ocr_engine = await asyncio.to_thread(get_ocr_engine, lang)
+
+    upright_height, upright_width = image_np.shape[:2]
+    if tiling.should_tile(upright_width, upright_height):
+        # Very large pages: overlapping tiles at full resolution instead of one scaled-down pass
+        tiles = tiling.plan_tiles(upright_width, upright_height)
+        with span("ocr_engine", page=page, width=width, height=height, cls=use_cls, lang=lang,
+                  tiles=len(tiles)) as s:
+            tile_results = await tiling.map_tiles(
+                image_np, tiles, lambda tile_np: exclusive(ocr_engine.ocr)(tile_np, cls=use_cls))
+            results = [tiling.merge_ocr(tiles, tile_results)]
+            s.set(lines=len(results[0]))
+    else:
+        with span("ocr_engine", page=page, width=width, height=height, cls=use_cls, lang=lang) as s:
+            results = await asyncio.to_thread(exclusive(ocr_engine.ocr), image_np, cls=use_cls)
+            s.set(lines=len(results[0] or []))
 
     blocks = []
-    for line in results[0]:
+    for line in results[0] or []:
         bbox, (text, confidence) = line
+        upright_y = bbox[0][1]  # reading order follows the upright page
+        bbox = orientation.map_quad_back(bbox, rotation, width, height)
         x1, y1 = bbox[0]
         x2, y2 = bbox[2]
         norm_bbox = [
@@ -71,11 +167,20 @@ async def _process_pil_image(image: Image.Image, page: int) -> OCRPageResult:
             confidence=round(confidence, 4),
             bbox_raw=bbox,
             bbox_norm=norm_bbox,
-            low_confidence=confidence < 0.7,
+            low_confidence=confidence < reocr.LOW_CONFIDENCE,
             line_class=None,
             page=page
         )
-        blocks.append((y1, block))
+        blocks.append((upright_y, block))
 
     blocks.sort(key=lambda b: b[0])
-    return OCRPageResult(page=page, results=[b[1] for b in blocks])
\ No newline at end of file
+    results = [b[1] for b in blocks]
+
+    # Hard lines only: re-read them from the high-resolution page
+    if high_res is not None and reocr.ENABLED and (options is None or options.reocr):
+        await asyncio.to_thread(reocr.refine_low_confidence, results, high_res, ocr_engine, rotation)
+
+    page_result = OCRPageResult(page=page, results=results, rotation=rotation, lang=lang)
+    if page_filter is not None:
+        page_filter.remember(page, page_result)
+    return page_result
\ No newline at end of file
@@ -0,0 +1,348 @@
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2 # type: ignore
+import numpy as np
+import onnxruntime as ort # type: ignore
+
+'''
+ONNX Runtime engines for the det, rec, cls and layout models.
+
+Drop-in replacements for PaddleOCR and PPStructure on CPU, used when
+LEVIOSA_ENGINE_BACKEND=onnx. They return the same shapes the Paddle engines
+do, so ocr_paddleocr and layout_analyzer parse them unchanged:
+
+- OnnxOCR.ocr(img) -> [[[quad, (text, confidence)], ...]] (or [None])
+- OnnxOCR.text_classifier(crops) -> (crops, [(label, score), ...], elapsed)
+- OnnxOCR.text_recognizer(crops) -> ([(text, confidence), ...], elapsed)
+- OnnxStructure(img) -> [{"type", "bbox", "img", "res", "img_idx"}, ...]
+
+Pre- and post-processing follow PaddleOCR's defaults (DB detection with
+box_thresh 0.6 / unclip 1.5, CTC decoding, PicoDet layout decoding with
+per-class NMS). Models are exported with tools/export_onnx.py into one
+directory holding det.onnx, rec.onnx, cls.onnx (optional), layout.onnx and
+the recognizer's character dictionary (rec_dict.txt).
+
+There is no ONNX table-structure model: table regions come back as text
+lines, as with table recognition switched off on the Paddle backend.
+'''
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def _session(path: str, threads: int) -> ort.InferenceSession:
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class TextDetector:
+    """DB text detection: probability map to 4-point boxes."""
+
+    def __init__(self, path: str, threads: int, limit_side_len: int = 960, thresh: float = 0.3,
+                 box_thresh: float = 0.6, unclip_ratio: float = 1.5, max_candidates: int = 1000):
+        self.session = _session(path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+        self.limit_side_len = limit_side_len
+        self.thresh = thresh
+        self.box_thresh = box_thresh
+        self.unclip_ratio = unclip_ratio
+        self.max_candidates = max_candidates
+
+    def _preprocess(self, img: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        height, width = img.shape[:2]
+        ratio = min(1.0, self.limit_side_len / max(height, width))
+        resize_h = max(32, int(round(height * ratio / 32)) * 32)
+        resize_w = max(32, int(round(width * ratio / 32)) * 32)
+        resized = cv2.resize(img, (resize_w, resize_h))
+        tensor = ((resized.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD).transpose(2, 0, 1)
+        return tensor[None], resize_h / height, resize_w / width
+
+    @staticmethod
+    def _mini_box(contour: np.ndarray) -> Tuple[np.ndarray, float]:
+        """Minimum-area rectangle as [top-left, top-right, bottom-right, bottom-left]."""
+        rect = cv2.minAreaRect(contour)
+        points = sorted(cv2.boxPoints(rect).tolist(), key=lambda p: p[0])
+        left = sorted(points[:2], key=lambda p: p[1])
+        right = sorted(points[2:], key=lambda p: p[1])
+        return np.array([left[0], right[0], right[1], left[1]], dtype=np.float32), min(rect[1])
+
+    @staticmethod
+    def _box_score(prob: np.ndarray, box: np.ndarray) -> float:
+        """Mean probability inside the box."""
+        h, w = prob.shape
+        xmin = int(np.clip(np.floor(box[:, 0].min()), 0, w - 1))
+        xmax = int(np.clip(np.ceil(box[:, 0].max()), 0, w - 1))
+        ymin = int(np.clip(np.floor(box[:, 1].min()), 0, h - 1))
+        ymax = int(np.clip(np.ceil(box[:, 1].max()), 0, h - 1))
+        mask = np.zeros((ymax - ymin + 1, xmax - xmin + 1), dtype=np.uint8)
+        shifted = box.copy()
+        shifted[:, 0] -= xmin
+        shifted[:, 1] -= ymin
+        cv2.fillPoly(mask, shifted.reshape(1, -1, 2).astype(np.int32), 1)
+        return cv2.mean(prob[ymin:ymax + 1, xmin:xmax + 1], mask)[0]
+
+    def _unclip(self, box: np.ndarray) -> np.ndarray:
+        """
+        Grow a rectangle by area * ratio / perimeter on every side, the offset
+        DB uses (pyclipper's round-joined offset of a rectangle has the same
+        minimum-area rectangle).
+        """
+        (cx, cy), (w, h), angle = cv2.minAreaRect(box)
+        if w * h == 0:
+            return box
+        distance = w * h * self.unclip_ratio / (2 * (w + h))
+        return cv2.boxPoints(((cx, cy), (w + 2 * distance, h + 2 * distance), angle))
+
+    def __call__(self, img: np.ndarray) -> List[np.ndarray]:
+        tensor, ratio_h, ratio_w = self._preprocess(img)
+        prob = self.session.run(None, {self.input_name: tensor})[0][0, 0]
+        mask = (prob > self.thresh).astype(np.uint8) * 255
+        contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+
+        height, width = img.shape[:2]
+        boxes = []
+        for contour in contours[:self.max_candidates]:
+            box, short_side = self._mini_box(contour)
+            if short_side < 3 or self._box_score(prob, box) < self.box_thresh:
+                continue
+            box, short_side = self._mini_box(self._unclip(box).reshape(-1, 1, 2))
+            if short_side < 5:
+                continue
+            box[:, 0] = np.clip(np.round(box[:, 0] / ratio_w), 0, width)
+            box[:, 1] = np.clip(np.round(box[:, 1] / ratio_h), 0, height)
+            if box[:, 0].max() - box[:, 0].min() <= 3 or box[:, 1].max() - box[:, 1].min() <= 3:
+                continue
+            boxes.append(box)
+        return _sorted_boxes(boxes)
+
+
+def _sorted_boxes(boxes: List[np.ndarray]) -> List[np.ndarray]:
+    """Top to bottom, then left to right within a line (PaddleOCR's ordering)."""
+    boxes = sorted(boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def _crop_line(img: np.ndarray, box: np.ndarray) -> np.ndarray:
+    """Perspective-crop a detected box; tall crops are turned to read horizontally."""
+    width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3])))
+    height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    matrix = cv2.getPerspectiveTransform(box.astype(np.float32), target)
+    crop = cv2.warpPerspective(img, matrix, (max(1, width), max(1, height)),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if crop.shape[0] >= crop.shape[1] * 1.5:
+        crop = np.ascontiguousarray(np.rot90(crop))
+    return crop
+
+
+def _normalize_line(crop: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Resize to the model height keeping the aspect ratio, scale to [-1, 1] and right-pad."""
+    resized_w = min(width, int(math.ceil(height * crop.shape[1] / max(1, crop.shape[0]))))
+    resized = cv2.resize(crop, (max(1, resized_w), height)).astype(np.float32)
+    padded = np.zeros((3, height, width), dtype=np.float32)
+    padded[:, :, :resized_w] = ((resized / 255.0 - 0.5) / 0.5).transpose(2, 0, 1)
+    return padded
+
+
+class TextClassifier:
+    """0/180 degree text-line classifier."""
+
+    def __init__(self, path: str, threads: int, batch_size: int = 6, thresh: float = 0.9):
+        self.session = _session(path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+        self.batch_size = batch_size
+        self.thresh = thresh
+
+    def __call__(self, crops: List[np.ndarray]) -> Tuple[List[np.ndarray], List[Tuple[str, float]], float]:
+        start = time.perf_counter()
+        labels: List[Tuple[str, float]] = []
+        for i in range(0, len(crops), self.batch_size):
+            batch = np.stack([_normalize_line(c, 48, 192) for c in crops[i:i + self.batch_size]])
+            for probs in self.session.run(None, {self.input_name: batch})[0]:
+                index = int(probs.argmax())
+                labels.append(("0" if index == 0 else "180", float(probs[index])))
+        for i, (label, score) in enumerate(labels):
+            if label == "180" and score > self.thresh:
+                crops[i] = np.ascontiguousarray(np.rot90(crops[i], 2))
+        return crops, labels, time.perf_counter() - start
+
+
+class TextRecognizer:
+    """CTC text recognition, batched by similar aspect ratio."""
+
+    def __init__(self, path: str, dict_path: str, threads: int, batch_size: int = 6):
+        self.session = _session(path, threads)
+        self.input_name = self.session.get_inputs()[0].name
+        self.batch_size = batch_size
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if "character" in metadata:
+            characters = metadata["character"].splitlines()
+        else:
+            with open(dict_path, encoding="utf-8") as f:
+                characters = [line.rstrip("\r\n") for line in f]
+        # index 0 is the CTC blank; the space character comes last
+        self.characters = ["blank"] + characters + [" "]
+
+    def _decode(self, probs: np.ndarray) -> Tuple[str, float]:
+        indices = probs.argmax(axis=1)
+        scores = probs.max(axis=1)
+        keep = indices != 0
+        keep[1:] &= indices[1:] != indices[:-1]
+        text = "".join(self.characters[i] for i in indices[keep] if i < len(self.characters))
+        return text, float(scores[keep].mean()) if keep.any() else 0.0
+
+    def __call__(self, crops: List[np.ndarray]) -> Tuple[List[Tuple[str, float]], float]:
+        start = time.perf_counter()
+        results: List[Tuple[str, float]] = [("", 0.0)] * len(crops)
+        order = np.argsort([c.shape[1] / max(1, c.shape[0]) for c in crops])
+        for i in range(0, len(crops), self.batch_size):
+            indices = order[i:i + self.batch_size]
+            max_ratio = max(320 / 48, max(crops[j].shape[1] / max(1, crops[j].shape[0]) for j in indices))
+            width = int(48 * max_ratio)
+            batch = np.stack([_normalize_line(crops[j], 48, width) for j in indices])
+            for j, probs in zip(indices, self.session.run(None, {self.input_name: batch})[0]):
+                results[j] = self._decode(probs)
+        return results, time.perf_counter() - start
+
+
+class OnnxOCR:
+    """PaddleOCR-compatible detection + (optional) angle classification + recognition."""
+
+    def __init__(self, model_dir: str, threads: int, drop_score: float = 0.5):
+        self.detector = TextDetector(os.path.join(model_dir, "det.onnx"), threads)
+        self.text_recognizer = TextRecognizer(os.path.join(model_dir, "rec.onnx"), os.path.join(model_dir, "rec_dict.txt"), threads)
+        cls_path = os.path.join(model_dir, "cls.onnx")
+        self.text_classifier = TextClassifier(cls_path, threads) if os.path.exists(cls_path) else None
+        self.drop_score = drop_score
+
+    def ocr(self, img: np.ndarray, det: bool = True, rec: bool = True, cls: bool = True) -> List[Optional[List[Any]]]:
+        boxes = self.detector(img)
+        if not boxes:
+            return [None]
+        crops = [_crop_line(img, box) for box in boxes]
+        if cls and self.text_classifier is not None:
+            crops, _, _ = self.text_classifier(crops)
+        lines = []
+        recognized, _ = self.text_recognizer(crops)
+        for box, (text, score) in zip(boxes, recognized):
+            if score >= self.drop_score:
+                lines.append([box.tolist(), (text, score)])
+        return [lines]
+
+
+class LayoutDetector:
+    """PicoDet layout detection with the distribution-focal box decoding and per-class NMS."""
+
+    def __init__(self, path: str, dict_path: str, threads: int, score_threshold: float = 0.4,
+                 nms_threshold: float = 0.5, nms_top_k: int = 1000, keep_top_k: int = 100):
+        self.session = _session(path, threads)
+        self.inputs = {i.name: i.shape for i in self.session.get_inputs()}
+        with open(dict_path, encoding="utf-8") as f:
+            self.labels = [line.strip() for line in f if line.strip()]
+        self.input_size = (800, 608)  # height, width
+        self.strides = [8, 16, 32, 64]
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.nms_top_k = nms_top_k
+        self.keep_top_k = keep_top_k
+
+    @staticmethod
+    def _nms(boxes: np.ndarray, scores: np.ndarray, threshold: float, top_k: int) -> List[int]:
+        order = scores.argsort()[::-1][:200]
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        keep: List[int] = []
+        while order.size and len(keep) < top_k:
+            best = order[0]
+            keep.append(int(best))
+            rest = order[1:]
+            x1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+            y1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+            x2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+            y2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+            inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+            iou = inter / (areas[best] + areas[rest] - inter + 1e-9)
+            order = rest[iou <= threshold]
+        return keep
+
+    def __call__(self, img: np.ndarray) -> List[Dict[str, Any]]:
+        height, width = img.shape[:2]
+        input_h, input_w = self.input_size
+        resized = cv2.resize(img, (input_w, input_h))
+        feeds = {"image": ((resized.astype(np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD).transpose(2, 0, 1)[None]}
+        if "scale_factor" in self.inputs:
+            feeds["scale_factor"] = np.array([[input_h / height, input_w / width]], dtype=np.float32)
+        outputs = self.session.run(None, feeds)
+
+        # Score maps have one column per label, box maps 4 * (reg_max + 1); one of each per stride
+        scores = sorted((o[0] for o in outputs if o.shape[-1] == len(self.labels)), key=len, reverse=True)
+        distributions = sorted((o[0] for o in outputs if o.shape[-1] != len(self.labels)), key=len, reverse=True)
+
+        all_boxes, all_scores = [], []
+        for stride, score, distribution in zip(self.strides, scores, distributions):
+            rows, cols = math.ceil(input_h / stride), math.ceil(input_w / stride)
+            xs, ys = np.meshgrid(np.arange(cols), np.arange(rows))
+            cx, cy = (xs.flatten() + 0.5) * stride, (ys.flatten() + 0.5) * stride
+            reg_max = distribution.shape[-1] // 4 - 1
+            bins = distribution.reshape(-1, reg_max + 1)
+            bins = np.exp(bins - bins.max(axis=1, keepdims=True))
+            bins /= bins.sum(axis=1, keepdims=True)
+            distance = (bins @ np.arange(reg_max + 1)).reshape(-1, 4) * stride
+            top = np.argsort(score.max(axis=1))[::-1][:self.nms_top_k]
+            centers = np.stack([cx, cy, cx, cy], axis=1)[top]
+            all_boxes.append(centers + np.array([-1, -1, 1, 1]) * distance[top])
+            all_scores.append(score[top])
+        boxes = np.concatenate(all_boxes)
+        class_scores = np.concatenate(all_scores)
+
+        scale = np.array([input_w / width, input_h / height] * 2)
+        regions = []
+        for label_index, label in enumerate(self.labels):
+            probs = class_scores[:, label_index]
+            mask = probs > self.score_threshold
+            if not mask.any():
+                continue
+            candidates = np.clip(boxes[mask], 0, [input_w, input_h, input_w, input_h]) / scale
+            for i in self._nms(candidates, probs[mask], self.nms_threshold, self.keep_top_k):
+                regions.append({"type": label, "bbox": [int(v) for v in candidates[i]], "score": float(probs[mask][i])})
+        regions.sort(key=lambda r: (r["bbox"][1], r["bbox"][0]))
+        return regions
+
+
+class OnnxStructure:
+    """PPStructure-compatible layout analysis with region OCR."""
+
+    def __init__(self, model_dir: str, layout_dict_path: str, text_system: OnnxOCR, threads: int):
+        self.layout_predictor = LayoutDetector(os.path.join(model_dir, "layout.onnx"), layout_dict_path, threads)
+        self.text_system = text_system
+        self.table_system = None  # no ONNX table-structure model
+
+    def __call__(self, img: np.ndarray, return_ocr_result_in_table: bool = False, img_idx: int = 0) -> List[Dict[str, Any]]:
+        results = []
+        for region in self.layout_predictor(img):
+            x1, y1, x2, y2 = region["bbox"]
+            crop = img[y1:y2, x1:x2]
+            res: Any = ""
+            if self.text_system is not None and crop.size:
+                lines = self.text_system.ocr(crop, cls=False)[0] or []
+                res = [
+                    {
+                        "text": text,
+                        "confidence": confidence,
+                        "text_region": [[x + x1, y + y1] for x, y in box],
+                    }
+                    for box, (text, confidence) in lines
+                ]
+            results.append({"type": region["type"], "bbox": [x1, y1, x2, y2], "img": crop, "res": res, "img_idx": img_idx})
+        return results
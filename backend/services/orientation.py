@@ -0,0 +1,206 @@
+import os
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+'''
+Page-level orientation detection.
+
+Runs once per page, before text detection, instead of classifying the angle
+of every detected line:
+
+1. 0 vs 90 degrees from projection profiles. Horizontal text lines give a
+   row-sum profile that alternates between ink and gaps; on a page turned on
+   its side the column profile does.
+2. 0 vs 180 degrees by classifying a handful of line crops with the OCR
+   engine's text angle classifier and taking a vote.
+
+The page is rotated upright before detection and the resulting boxes are
+mapped back into the coordinates of the original image. When the vote is not
+clear the page is reported as ambiguous and callers fall back to per-line
+classification.
+
+Angles are counter-clockwise rotations that make the page upright.
+'''
+
+ENABLED = os.getenv("LEVIOSA_PAGE_ORIENTATION", "1").lower() not in ("0", "false", "no")
+
+PROFILE_MAX_SIDE = 800  # pages are downscaled to this for the profile analysis
+PROFILE_MARGIN = 1.25  # how much stronger one profile must be to call 0 vs 90
+MAX_VOTE_CROPS = 5
+MIN_VOTE_AGREEMENT = 0.8
+MIN_VOTE_SCORE = 0.9
+
+
+class PageOrientation(NamedTuple):
+    angle: int  # 0, 90, 180 or 270
+    ambiguous: bool  # True when per-line classification should still run
+
+
+def _ink_mask(image_np: np.ndarray) -> np.ndarray:
+    """Dark pixels of a downscaled grayscale copy of the page."""
+    step = max(1, int(np.ceil(max(image_np.shape[:2]) / PROFILE_MAX_SIDE)))
+    small = image_np[::step, ::step]
+    gray = small.mean(axis=2, dtype=np.float32) if small.ndim == 3 else small.astype(np.float32)
+    return gray < min(128.0, gray.mean() * 0.8)
+
+
+def _profile_strength(profile: np.ndarray) -> float:
+    """Normalized variance: high for alternating line/gap profiles, low for flat ones."""
+    mean = profile.mean()
+    return float(profile.var() / (mean * mean)) if mean > 0 else 0.0
+
+
+def line_crops(image_np: np.ndarray, limit: int) -> List[np.ndarray]:
+    """
+    Cut up to `limit` text-line crops from an upright (or upside-down) page,
+    using the row profile to find lines and gaps within a line to split columns.
+    """
+    step = max(1, int(np.ceil(max(image_np.shape[:2]) / PROFILE_MAX_SIDE)))
+    ink = _ink_mask(image_np)
+    rows = ink.sum(axis=1) > 0
+
+    candidates = []
+    y = 0
+    while y < len(rows):
+        if not rows[y]:
+            y += 1
+            continue
+        top = y
+        while y < len(rows) and rows[y]:
+            y += 1
+        height = y - top
+        if height < 3:
+            continue
+        cols = ink[top:y].sum(axis=0) > 0
+        x = 0
+        while x < len(cols):
+            if not cols[x]:
+                x += 1
+                continue
+            left, gap = x, 0
+            while x < len(cols) and gap <= height * 1.5:
+                gap = 0 if cols[x] else gap + 1
+                x += 1
+            right = x - gap
+            if right - left >= height * 3:
+                weight = int(ink[top:y, left:right].sum())
+                candidates.append((weight, top, y, left, right))
+
+    candidates.sort(reverse=True)
+    crops = []
+    for _, top, bottom, left, right in candidates[:limit]:
+        pad = max(1, (bottom - top) // 4)
+        crops.append(np.ascontiguousarray(image_np[
+            max(0, (top - pad) * step):(bottom + pad) * step,
+            max(0, (left - pad) * step):(right + pad) * step,
+        ]))
+    return crops
+
+
+def detect_orientation(image_np: np.ndarray, classifier: Optional[Callable[[List[np.ndarray]], Any]] = None) -> PageOrientation:
+    """
+    Detect how far a page is rotated.
+
+    Args:
+        image_np: The page as an array (H x W x C)
+        classifier: The OCR engine's text angle classifier, called with a list
+            of line crops and returning (crops, [(label, score), ...], elapsed)
+
+    Returns:
+        The counter-clockwise angle that makes the page upright and whether
+        the result is ambiguous
+    """
+    ink = _ink_mask(image_np)
+    if not ink.any():
+        return PageOrientation(0, False)
+
+    row_strength = _profile_strength(ink.sum(axis=1).astype(np.float64))
+    col_strength = _profile_strength(ink.sum(axis=0).astype(np.float64))
+    sideways = col_strength > row_strength * PROFILE_MARGIN
+    ambiguous = not sideways and row_strength < col_strength * PROFILE_MARGIN
+
+    angle = 90 if sideways else 0
+    if classifier is None:
+        return PageOrientation(angle, True)
+
+    # A rotated view, so only the crops are copied
+    crops = line_crops(np.rot90(image_np, angle // 90), MAX_VOTE_CROPS)
+    if not crops:
+        return PageOrientation(angle, True)
+
+    _, labels, _ = classifier(crops)
+    flipped = [score for label, score in labels if label == "180"]
+    upright = [score for label, score in labels if label != "180"]
+    votes = flipped if len(flipped) > len(upright) else upright
+    if len(flipped) > len(upright):
+        angle = (angle + 180) % 360
+
+    agreement = len(votes) / len(labels)
+    score = sum(votes) / len(votes)
+    ambiguous = ambiguous or agreement < MIN_VOTE_AGREEMENT or score < MIN_VOTE_SCORE
+    return PageOrientation(angle, ambiguous)
+
+
+def make_upright(image_np: np.ndarray, ocr_engine: Any) -> Tuple[np.ndarray, PageOrientation]:
+    """Detect a page's orientation with the engine's angle classifier and rotate it upright."""
+    page_orientation = detect_orientation(image_np, getattr(ocr_engine, "text_classifier", None))
+    return rotate(image_np, page_orientation.angle), page_orientation
+
+
+def rotate(image_np: np.ndarray, angle: int) -> np.ndarray:
+    """Rotate a page counter-clockwise by a multiple of 90 degrees."""
+    k = (angle // 90) % 4
+    return np.ascontiguousarray(np.rot90(image_np, k)) if k else image_np
+
+
+def map_point_back(x: float, y: float, angle: int, width: int, height: int) -> List[float]:
+    """
+    Map a point of the rotated page back onto the original page.
+
+    Args:
+        x, y: Point in the rotated (upright) page
+        angle: The rotation that was applied
+        width, height: Size of the original page
+    """
+    angle %= 360
+    if angle == 90:
+        return [width - y, x]
+    if angle == 180:
+        return [width - x, height - y]
+    if angle == 270:
+        return [y, height - x]
+    return [x, y]
+
+
+def map_quad_back(quad: List[List[float]], angle: int, width: int, height: int) -> List[List[float]]:
+    """
+    Map a 4-point box back onto the original page, starting again from the
+    top-left corner so point 0 and point 2 still span the box.
+    """
+    if angle % 360 == 0:
+        return quad
+    points = [map_point_back(x, y, angle, width, height) for x, y in quad]
+    start = min(range(len(points)), key=lambda i: points[i][0] + points[i][1])
+    return points[start:] + points[:start]
+
+
+def map_bbox_back(bbox: List[float], angle: int, width: int, height: int) -> List[float]:
+    """Map an [x1, y1, x2, y2] box back onto the original page."""
+    if angle % 360 == 0:
+        return bbox
+    x1, y1 = map_point_back(bbox[0], bbox[1], angle, width, height)
+    x2, y2 = map_point_back(bbox[2], bbox[3], angle, width, height)
+    return [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+
+
+def upright_top(bbox_norm: List[float], angle: int) -> float:
+    """Top edge of a normalized box as seen on the upright page, for reading order."""
+    angle %= 360
+    if angle == 90:
+        return 1 - bbox_norm[2]
+    if angle == 180:
+        return 1 - bbox_norm[3]
+    if angle == 270:
+        return bbox_norm[0]
+    return bbox_norm[1]
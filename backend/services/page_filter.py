@@ -0,0 +1,227 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from services.tracing import span
+
+'''
+Blank and near-duplicate page detection, before any model runs.
+
+Each rasterized page is reduced to a grayscale map of about MAP_ROWS rows,
+whatever the render DPI (block minimum, so one-pixel rules and strokes
+survive), and checked in two steps:
+
+- blank: almost no pixel variance or almost no ink (separator sheets, empty
+  backs of duplex scans)
+- near-duplicate: a 64-bit difference hash (dHash) of the page and its ink
+  share pick candidate pages among the last DUPLICATE_WINDOW distinct pages of
+  the document. A candidate is confirmed by aligning the two pages (phase
+  correlation, then per tile) and measuring how much ink of either page has no
+  ink of the other nearby. Re-scans, shifted, slightly skewed, blurred or
+  noisy, stay below DUPLICATE_UNCOVERED; pages of the same template whose
+  figures differ throughout (statements, tables) stay above it. A page that
+  differs from an earlier one in only a few figures is still taken for a
+  repeat: disable the filter for documents made of such pages.
+
+Blank pages come back with no results, near-duplicates with a copy of the
+results of the page they repeat; both are marked (`skipped`, `duplicate_of`).
+'''
+
+ENABLED = os.getenv("LEVIOSA_PAGE_FILTER", "1").lower() not in ("0", "false", "no")
+
+MAP_ROWS = 1000  # the map is about 100 dpi for a letter or A4 page; glyph-sized changes must survive it
+BLANK_STD = 3.0  # gray levels
+BLANK_INK = 0.0005  # share of ink pixels
+INK = 128  # darker is ink
+LOOSE_INK = 224  # lighter ink, still enough to cover a blurred stroke
+HASH_BITS_MAX = 24  # of 64, for a page to be a duplicate candidate
+INK_RATIO_MAX = 2.0  # candidates have about the same amount of ink
+DUPLICATE_UNCOVERED = float(os.getenv("LEVIOSA_DUPLICATE_UNCOVERED", "0.01"))  # share of ink without a counterpart in the other page
+DUPLICATE_WINDOW = int(os.getenv("LEVIOSA_DUPLICATE_WINDOW", "16"))  # distinct pages kept for comparison
+TILES = 4  # per side, each aligned on its own to absorb skew
+TILE_SHIFT = 5  # pixels of the map, around the page alignment
+
+
+class PageVerdict(NamedTuple):
+    skipped: Optional[str]  # None, "blank" or "duplicate"
+    duplicate_of: Optional[int] = None
+
+
+class PageFingerprint(NamedTuple):
+    gray: np.ndarray  # uint8 block-minimum map
+    ink: float  # share of lighter ink, which blur barely changes
+    dhash: int
+
+
+def _block_min(gray: np.ndarray, step: int) -> np.ndarray:
+    """Darkest pixel of each step x step block; strided minimums, much faster than a reshaped min."""
+    h, w = gray.shape[0] // step * step, gray.shape[1] // step * step
+    out = gray[0:h:step, 0:w:step].copy()
+    for dy in range(step):
+        for dx in range(step):
+            if dy or dx:
+                np.minimum(out, gray[dy:h:step, dx:w:step], out=out)
+    return out
+
+
+def _gray_map(image_np: np.ndarray) -> np.ndarray:
+    if image_np.ndim == 3:
+        # Darkest channel: colored ink counts as ink
+        gray = np.minimum(np.minimum(image_np[..., 0], image_np[..., 1]), image_np[..., 2])
+    else:
+        gray = image_np
+    return _block_min(gray, max(1, gray.shape[0] // MAP_ROWS))
+
+
+def _dhash(gray: np.ndarray) -> int:
+    ys = np.linspace(0, gray.shape[0], 9).astype(int)
+    xs = np.linspace(0, gray.shape[1], 10).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(gray.astype(np.float32), ys[:-1], axis=0), xs[:-1], axis=1)
+    cells = sums / np.outer(np.diff(ys), np.diff(xs))
+    return int.from_bytes(np.packbits((cells[:, 1:] > cells[:, :-1]).ravel()).tobytes(), "big")
+
+
+def fingerprint(image_np: np.ndarray) -> Tuple[bool, PageFingerprint]:
+    """Whether a page (H x W x C or H x W) is blank, and its fingerprint."""
+    gray = _gray_map(image_np)
+    blank = float(gray[::4, ::4].std()) < BLANK_STD or float((gray < INK).mean()) < BLANK_INK
+    return blank, PageFingerprint(gray, float((gray < LOOSE_INK).mean()), _dhash(gray))
+
+
+def _phase_shift(a: np.ndarray, b: np.ndarray) -> Tuple[int, int]:
+    """(dy, dx) such that a[y + dy, x + dx] lines up with b[y, x]."""
+    cross = np.fft.rfft2(a) * np.conj(np.fft.rfft2(b))
+    cross /= np.abs(cross) + 1e-6
+    peak = np.fft.irfft2(cross, s=a.shape)
+    dy, dx = np.unravel_index(int(np.argmax(peak)), peak.shape)
+    return (int(dy) - a.shape[0] if dy > a.shape[0] // 2 else int(dy),
+            int(dx) - a.shape[1] if dx > a.shape[1] // 2 else int(dx))
+
+
+def _profile_shift(a: np.ndarray, b: np.ndarray, radius: int) -> int:
+    a, b = a - a.mean(), b - b.mean()
+    n = len(a)
+    scores = [float(a[max(0, s):n + min(0, s)] @ b[max(0, -s):n - max(0, s)]) for s in range(-radius, radius + 1)]
+    return int(np.argmax(scores)) - radius
+
+
+def _overlap(a: np.ndarray, b: np.ndarray, dy: int, dx: int) -> Tuple[np.ndarray, np.ndarray]:
+    h, w = a.shape[-2:]
+    return (a[..., max(0, dy):h + min(0, dy), max(0, dx):w + min(0, dx)],
+            b[..., max(0, -dy):h - max(0, dy), max(0, -dx):w - max(0, dx)])
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """3 x 3 binary dilation."""
+    h, w = mask.shape
+    padded = np.pad(mask, 1)
+    out = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            out |= padded[dy:dy + h, dx:dx + w]
+    return out
+
+
+def uncovered_ink(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Share of the ink of two aligned gray maps that has no (lighter) ink of the
+    other page within a pixel; about 0 for the same page scanned twice.
+    """
+    h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+    a, b = a[:h, :w], b[:h, :w]
+    # Coarse alignment on 4x smaller maps, refined per tile
+    dy, dx = _phase_shift((_block_min(a, 4) < LOOSE_INK).astype(np.float32),
+                          (_block_min(b, 4) < LOOSE_INK).astype(np.float32))
+    masks_a = np.stack([a < INK, a < LOOSE_INK])
+    masks_b = np.stack([b < INK, b < LOOSE_INK])
+    masks_a, masks_b = _overlap(masks_a, masks_b, dy * 4, dx * 4)
+
+    height, width = masks_a.shape[1:]
+    missing, total = 0, 0
+    for i in range(TILES):
+        for j in range(TILES):
+            tile = (slice(None), slice(i * height // TILES, (i + 1) * height // TILES),
+                    slice(j * width // TILES, (j + 1) * width // TILES))
+            ta, tb = masks_a[tile], masks_b[tile]
+            ty = _profile_shift(ta[1].sum(axis=1, dtype=np.float32), tb[1].sum(axis=1, dtype=np.float32), TILE_SHIFT)
+            tx = _profile_shift(ta[1].sum(axis=0, dtype=np.float32), tb[1].sum(axis=0, dtype=np.float32), TILE_SHIFT)
+            ta, tb = _overlap(ta, tb, ty, tx)
+            missing += int((ta[0] & ~_dilate(tb[1])).sum()) + int((tb[0] & ~_dilate(ta[1])).sum())
+            total += int(ta[0].sum()) + int(tb[0].sum())
+    return missing / max(1, total)
+
+
+class PageFilter:
+    """
+    Per-document record of the pages seen so far; one instance per document.
+    Checks are serialized, so pages of a document may be checked from several threads,
+    and a duplicate checked while the page it repeats is still in inference waits
+    for that page's result.
+    """
+
+    def __init__(self):
+        self._recent: Deque[Tuple[int, PageFingerprint]] = deque(maxlen=DUPLICATE_WINDOW)
+        self._results: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def check(self, page: int, image_np: np.ndarray) -> PageVerdict:
+        """
+        Decide whether a page needs inference.
+
+        Args:
+            page: Page number within the document
+            image_np: The rasterized page
+
+        Returns:
+            The verdict; pages that are neither blank nor a repeat are remembered
+            for comparison with later pages
+        """
+        if not ENABLED:
+            return PageVerdict(None)
+        with span("page_filter", page=page) as s:
+            blank, fp = fingerprint(image_np)
+            with self._lock:
+                verdict = PageVerdict("blank") if blank else self._find_duplicate(fp)
+                if verdict.skipped is None:
+                    self._recent.append((page, fp))
+                    self._results[page] = Future()
+            s.set(skipped=verdict.skipped, duplicate_of=verdict.duplicate_of)
+        if verdict.skipped:
+            print(f"[PAGE FILTER] Page {page} skipped: {verdict.skipped}"
+                  + (f" of page {verdict.duplicate_of}" if verdict.duplicate_of else ""))
+        return verdict
+
+    def _find_duplicate(self, fp: PageFingerprint) -> PageVerdict:
+        for page, seen in reversed(self._recent):
+            if bin(fp.dhash ^ seen.dhash).count("1") > HASH_BITS_MAX:
+                continue
+            if max(fp.ink, seen.ink) > INK_RATIO_MAX * min(fp.ink, seen.ink):
+                continue
+            if uncovered_ink(fp.gray, seen.gray) <= DUPLICATE_UNCOVERED:
+                return PageVerdict("duplicate", page)
+        return PageVerdict(None)
+
+    def remember(self, page: int, result: Any) -> None:
+        """Keep a processed page's result so its duplicates can reuse it; None when it failed."""
+        with self._lock:
+            future = self._results.setdefault(page, Future())
+        if not future.done():
+            future.set_result(result)
+
+    def forget(self, page: int) -> None:
+        """A checked page failed: its duplicates go on without its result."""
+        with self._lock:
+            future = self._results.get(page)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def result_of(self, page: int) -> Any:
+        """The result of a remembered page, once it has been processed; None when it failed."""
+        with self._lock:
+            future = self._results.get(page)
+        return await asyncio.wrap_future(future) if future is not None else None
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from models.document import LayoutPage
+from models.schema import PipelineOptions
+from services import languages, search_index
+from services.input_limits import RasterPlan, plan_rasterization
+from services.layout_analyzer import analyze_layout_page
+from services.layout_postprocessor import LayoutPostprocessor
+from services.markdown_processor import MarkdownProcessor
+from services.pdf_to_image import RASTER_DPI, convert_pdf_to_images
+from services.tracing import span
+
+'''
+On-demand page processing.
+
+Instead of running a whole document through the pipeline, a viewer asks for a
+range of pages and each page goes through the stages it needs, the first
+time it is needed:
+
+    image (pdftoppm, one page) -> layout (analysis + reclassification) -> markdown (LLM)
+
+Each (page, stage) result is memoized as an asyncio task, so a page that is
+already being processed, e.g. by a prefetch, is awaited rather than processed
+again. Waiters shield the task, so a client that goes away does not cancel
+work others are waiting for; a failed stage is dropped from the memo so the
+next request retries it. After serving a range, the next
+LEVIOSA_PREFETCH_PAGES pages are taken through the same stages in the
+background, one at a time.
+
+Documents are keyed by file, modification time and pipeline options; the
+LEVIOSA_PAGE_CACHE_DOCS most recently used stay in memory. Cross-page passes
+(boilerplate, blank and duplicate pages) need the whole document and do not
+run here.
+'''
+
+PREFETCH_PAGES = int(os.getenv("LEVIOSA_PREFETCH_PAGES", "2"))
+CACHE_DOCS = int(os.getenv("LEVIOSA_PAGE_CACHE_DOCS", "32"))
+MAX_RANGE = 20  # pages per request
+
+
+class DocumentPages:
+    """The lazily processed pages of one document."""
+
+    def __init__(self, path: str, options: Optional[PipelineOptions],
+                 postprocessor: LayoutPostprocessor, markdown_processor: MarkdownProcessor):
+        self.path = path
+        self.options = options
+        self.postprocessor = postprocessor
+        self.markdown_processor = markdown_processor
+        self.is_pdf = path.lower().endswith(".pdf")
+        self._plan: Optional[RasterPlan] = None
+        self._tasks: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._prefetch: Optional[asyncio.Task] = None
+
+    async def page_count(self) -> int:
+        if not self.is_pdf:
+            return 1
+        if self._plan is None:
+            self._plan = await asyncio.to_thread(plan_rasterization, self.path, RASTER_DPI)
+        return self._plan.pages
+
+    def _stage(self, page: int, stage: str, run: Callable[[], Awaitable[Any]]) -> "asyncio.Task":
+        """The memoized task of a page stage, started on first use."""
+        key = (page, stage)
+        task = self._tasks.get(key)
+        if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+            task = asyncio.ensure_future(run())
+            self._tasks[key] = task
+        return task
+
+    def image(self, page: int) -> "asyncio.Task":
+        async def run() -> str:
+            if not self.is_pdf:
+                return self.path
+            await self.page_count()
+            paths = await asyncio.to_thread(convert_pdf_to_images, self.path, plan=self._plan,
+                                            first_page=page, last_page=page)
+            return paths[0]
+        return self._stage(page, "image", run)
+
+    def layout(self, page: int) -> "asyncio.Task":
+        async def run() -> LayoutPage:
+            image_path = await self.image(page)
+            layout_page = await analyze_layout_page(image_path, page, self.options)
+            self.options = languages.keep_detected(self.options, layout_page.lang)
+            self.postprocessor.process_regions([layout_page])
+            await asyncio.to_thread(search_index.index_document, self.path,
+                                    search_index.layout_entries([layout_page]), search_index.LAYOUT)
+            return layout_page
+        return self._stage(page, "layout", run)
+
+    def markdown(self, page: int, llm_provider: Optional[str] = None) -> "asyncio.Task":
+        async def run() -> str:
+            layout_page = await self.layout(page)
+            with span("page_pipeline.markdown", page=page):
+                return await self.markdown_processor.convert_page(
+                    self.markdown_processor.build_structured_page(layout_page), llm_provider=llm_provider)
+        return self._stage(page, f"markdown:{llm_provider or ''}", run)
+
+    def prefetch(self, pages: Iterable[int], markdown: bool, llm_provider: Optional[str] = None) -> None:
+        """Take pages through the stages in the background, one after the other."""
+        if self._prefetch is not None and not self._prefetch.done():
+            self._prefetch.cancel()  # the viewer moved on; pages already started finish in their own tasks
+
+        async def run():
+            for page in pages:
+                try:
+                    await asyncio.shield(self.markdown(page, llm_provider) if markdown else self.layout(page))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[PAGES] Prefetch of page {page} of {self.path} failed: {e}")
+                    return
+
+        self._prefetch = asyncio.ensure_future(run())
+
+
+class PagePipeline:
+    """Documents being viewed, least recently used evicted first."""
+
+    def __init__(self, postprocessor: LayoutPostprocessor, markdown_processor: MarkdownProcessor,
+                 max_documents: int = CACHE_DOCS):
+        self.postprocessor = postprocessor
+        self.markdown_processor = markdown_processor
+        self.max_documents = max_documents
+        self._documents: "OrderedDict[Tuple[str, float, str], DocumentPages]" = OrderedDict()
+
+    def document(self, path: str, options: Optional[PipelineOptions] = None) -> DocumentPages:
+        key = (path, os.path.getmtime(path), json.dumps(options.dict(), sort_keys=True) if options else "")
+        document = self._documents.get(key)
+        if document is None:
+            document = DocumentPages(path, options, self.postprocessor, self.markdown_processor)
+            self._documents[key] = document
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        self._documents.move_to_end(key)
+        return document
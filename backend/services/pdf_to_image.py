@@ -1,11 +1,24 @@
 import os
+import shutil
 import uuid
-from typing import List
+from typing import List, Optional
 from pdf2image import convert_from_path
+from PIL import Image
+from services.input_limits import RasterPlan, plan_rasterization
+from services.tracing import span
 
-def convert_pdf_to_images(pdf_path: str) -> List[str]:
+# Rasterization resolution for the whole document; OCR with re-OCR on renders
+# at the lower LEVIOSA_REOCR_BASE_DPI instead (services/reocr.py)
+RASTER_DPI = int(os.getenv("LEVIOSA_RASTER_DPI", "200"))
+
+def convert_pdf_to_images(pdf_path: str, dpi: Optional[int] = None, max_pages: Optional[int] = None,
+                          plan: Optional[RasterPlan] = None, first_page: int = 1,
+                          last_page: Optional[int] = None) -> List[str]:
     """
-    Convert all pages of a PDF into PNG images, save them to uploads/ as filename_page_#.png with a UUID suffix, and return a list of file paths.
+    Convert the pages of a PDF into PNG images, save them to uploads/ as filename_page_#.png with a UUID suffix, and return a list of file paths.
+    Pages are rendered at `dpi`, LEVIOSA_RASTER_DPI by default, lowered when a page would exceed the pixel budget.
+    Only the first `max_pages` pages are rendered when given. Callers that already checked the PDF pass its `plan`.
+    `first_page` and `last_page` (1-based, inclusive) select a range within those pages.
     """
     # Ensure uploads directory exists
     os.makedirs("uploads", exist_ok=True)
@@ -14,12 +27,28 @@ def convert_pdf_to_images(pdf_path: str) -> List[str]:
     base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
     unique_id = str(uuid.uuid4())
 
-    # Convert PDF to images
-    images = convert_from_path(pdf_path)
-    image_paths = []
-    for i, image in enumerate(images):
-        image_filename = f"{base_filename}_page_{i+1}_{unique_id}.png"
-        image_path = os.path.join("uploads", image_filename)
-        image.save(image_path, "PNG")
-        image_paths.append(image_path)
-    return image_paths 
\ No newline at end of file
+    plan = plan or plan_rasterization(pdf_path, dpi or RASTER_DPI, max_pages)
+    last_page = min(plan.pages, last_page or plan.pages)
+    if first_page > last_page:
+        return []
+
+    # pdftoppm writes the pages straight to disk, so no page is decoded in this process
+    output_folder = os.path.join("uploads", f"raster_{unique_id}")
+    os.makedirs(output_folder)
+    try:
+        with span("pdf.rasterize", path=pdf_path, dpi=plan.dpi, first_page=first_page, last_page=last_page):
+            rendered = convert_from_path(pdf_path, dpi=plan.dpi, output_folder=output_folder, fmt="png",
+                                         first_page=first_page, last_page=last_page, paths_only=True)
+        image_paths = []
+        for i, rendered_path in enumerate(sorted(rendered)):
+            image_path = os.path.join("uploads", f"{base_filename}_page_{first_page + i}_{unique_id}.png")
+            os.replace(rendered_path, image_path)
+            image_paths.append(image_path)
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+    return image_paths
+
+def render_pdf_page(pdf_path: str, page: int, dpi: int) -> Image.Image:
+    """Render a single PDF page (1-based) in memory, for re-reading parts of it at a higher DPI."""
+    with span("pdf.render_page", page=page, dpi=dpi):
+        return convert_from_path(pdf_path, dpi=dpi, first_page=page, last_page=page)[0]
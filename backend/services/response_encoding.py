@@ -0,0 +1,209 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import Request # type: ignore
+from fastapi.responses import Response # type: ignore
+
+from models.document import LayoutDocument
+from models.schema import OCRResponse
+from services.tracing import span
+
+try:
+    import orjson # type: ignore
+except ImportError:  # optional: falls back to the standard library encoder
+    orjson = None
+
+try:
+    import msgpack # type: ignore
+except ImportError:  # optional: msgpack is only offered when installed
+    msgpack = None
+
+'''
+Accept-header negotiation for OCR and layout responses.
+
+- application/json (default): the regular row-oriented response, encoded with
+  orjson when it is installed instead of FastAPI's generic encoder.
+- application/vnd.leviosa.columnar+json: one set of parallel arrays per page
+  (text, confidence, flattened bboxes, ...) instead of an object per line.
+- application/msgpack (or application/x-msgpack): the columnar layout as
+  msgpack, with single-precision floats.
+
+NDJSON stream routes negotiate between newline-delimited JSON and a stream of
+concatenated msgpack objects.
+'''
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.leviosa.columnar+json"
+MSGPACK = "application/msgpack"
+MSGPACK_ALIASES = ("application/msgpack", "application/x-msgpack")
+NDJSON = "application/x-ndjson"
+MSGPACK_STREAM = "application/vnd.msgpack-stream"
+
+
+def _parse_accept(header: Optional[str]) -> List[Tuple[str, float]]:
+    """Media ranges from an Accept header, highest quality first."""
+    ranges = []
+    for index, part in enumerate((header or "").split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        quality = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        ranges.append((fields[0].lower(), quality, index))
+    ranges.sort(key=lambda r: (-r[1], r[2]))
+    return [(media, quality) for media, quality, _ in ranges if quality > 0]
+
+
+def negotiate(request: Optional[Request], offers: List[str]) -> str:
+    """
+    Pick the first offered media type the client accepts, by preference.
+    Falls back to the first offer when nothing matches or no Accept header is sent.
+    """
+    if request is None:
+        return offers[0]
+    for media, _ in _parse_accept(request.headers.get("accept")):
+        if media in ("*/*", "application/*"):
+            return offers[0]
+        if media in offers:
+            return media
+        if media in MSGPACK_ALIASES and msgpack is not None:
+            for offer in offers:
+                if offer in MSGPACK_ALIASES:
+                    return offer
+    return offers[0]
+
+
+def dumps_json(data: Any) -> bytes:
+    """Fast JSON encoding; orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def _msgpack_default(value: Any) -> Any:
+    """numpy arrays and scalars in region content, as orjson's OPT_SERIALIZE_NUMPY handles them for JSON."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialize {type(value).__name__} as msgpack")
+
+
+def dumps_msgpack(data: Any) -> bytes:
+    return msgpack.packb(data, use_bin_type=True, use_single_float=True, default=_msgpack_default)
+
+
+def _flatten(values: List[Any]) -> List[float]:
+    flat: List[float] = []
+    for value in values:
+        if isinstance(value, (list, tuple)):
+            flat.extend(_flatten(value))
+        else:
+            flat.append(value)
+    return flat
+
+
+def ocr_to_columnar(response: OCRResponse) -> Dict[str, Any]:
+    """
+    Columnar form of an OCRResponse: per page, parallel arrays indexed by line.
+    bbox_norm is flattened to 4 values per line and bbox_raw to 8 (4 points).
+    """
+    pages = []
+    for page in response.pages:
+        lines = page.results
+        pages.append({
+            "page": page.page,
+            "rotation": page.rotation,
+            "skipped": page.skipped,
+            "duplicate_of": page.duplicate_of,
+            "lang": page.lang,
+            "line_id": [line.line_id for line in lines],
+            "text": [line.text for line in lines],
+            "confidence": [line.confidence for line in lines],
+            "bbox_norm": _flatten([line.bbox_norm for line in lines]),
+            "bbox_raw": _flatten([line.bbox_raw for line in lines]),
+            "low_confidence": [i for i, line in enumerate(lines) if line.low_confidence],
+            "line_class": [line.line_class for line in lines] if any(line.line_class for line in lines) else None,
+        })
+    return {"format": "columnar", "kind": "ocr", "pages": pages}
+
+
+def layout_to_columnar(response: Any) -> Dict[str, Any]:
+    """Columnar form of a layout result: per page, parallel arrays indexed by region."""
+    pages = []
+    for page in response.pages:
+        regions = page.results
+        pages.append({
+            "page": page.page,
+            "rotation": page.rotation,
+            "skipped": page.skipped,
+            "duplicate_of": page.duplicate_of,
+            "lang": page.lang,
+            "region_id": [r.region_id for r in regions],
+            "region_type": [r.region_type for r in regions],
+            "bbox_norm": _flatten([list(r.bbox_norm) for r in regions]),
+            "bbox_raw": _flatten([list(r.bbox_raw) for r in regions]),
+            "content": [r.content for r in regions],
+        })
+    boilerplate = (response.metadata.get("boilerplate") if isinstance(response, LayoutDocument)
+                   else getattr(response, "boilerplate", None))
+    return {"format": "columnar", "kind": "layout", "pages": pages,
+            "boilerplate": [entry if isinstance(entry, dict) else entry.dict() for entry in boilerplate or []] or None}
+
+
+def _row_dict(result: Any) -> Dict[str, Any]:
+    if isinstance(result, LayoutDocument):
+        return result.to_dict()
+    return result.dict()
+
+
+def encode_response(request: Optional[Request], result: Any) -> Any:
+    """
+    Encode an OCR or layout result in the format the client asked for.
+
+    Args:
+        request: The incoming request (None when a route is called directly)
+        result: OCRResponse, LayoutAnalysisResponse or LayoutDocument
+
+    Returns:
+        A Response with the encoded body, or the result unchanged when there
+        is no request so in-process callers keep getting models
+    """
+    if request is None:
+        return result.to_response() if isinstance(result, LayoutDocument) else result
+
+    offers = [JSON, COLUMNAR_JSON]
+    if msgpack is not None:
+        offers.append(MSGPACK)
+    media_type = negotiate(request, offers)
+
+    with span("response.encode", media_type=media_type) as s:
+        if media_type == JSON:
+            body = dumps_json(_row_dict(result))
+        else:
+            columnar = ocr_to_columnar(result) if isinstance(result, OCRResponse) else layout_to_columnar(result)
+            body = dumps_msgpack(columnar) if media_type == MSGPACK else dumps_json(columnar)
+        s.set(bytes=len(body))
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def stream_encoder(request: Optional[Request]) -> Tuple[str, Callable[[Dict[str, Any]], bytes]]:
+    """
+    Pick the encoding for a streamed route.
+
+    Returns:
+        The stream media type and a function encoding one item
+    """
+    offers = [NDJSON, JSON]
+    if msgpack is not None:
+        offers += [MSGPACK_STREAM, MSGPACK]
+    media_type = negotiate(request, offers)
+    if media_type in (MSGPACK_STREAM, MSGPACK):
+        return MSGPACK_STREAM, dumps_msgpack
+    return NDJSON, lambda item: dumps_json(item) + b"\n"
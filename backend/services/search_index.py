@@ -0,0 +1,262 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.tracing import span
+
+'''
+Full-text index over processed documents.
+
+OCR lines and layout regions of files in uploads/ are written to an embedded
+SQLite FTS5 index (LEVIOSA_SEARCH_INDEX, default data/search_index.db) as
+extract_text_and_boxes / extract_pdf_pages / analyze_layout_document produce
+them. Each row keeps its document, page and normalized box, so a search
+returns what the viewer needs to highlight a hit. Reprocessing a page replaces
+the rows the same pipeline wrote for it: the OCR lines (kind "line") and the
+layout regions (kind = region type) of a page are kept side by side, so a
+layout run does not replace line boxes with coarser region boxes. Direct
+uploads that were never saved to uploads/ have no document to point at and
+are not indexed.
+
+Row data lives in an ordinary table indexed by (doc_id, page, kind) and the
+FTS5 table is an external-content index over it, so replacing a page is an
+indexed delete and a query is an FTS lookup plus rowid joins.
+'''
+
+INDEX_PATH = os.getenv("LEVIOSA_SEARCH_INDEX", os.path.join("data", "search_index.db"))
+ENABLED = INDEX_PATH.lower() not in ("", "0", "false", "no")
+MAX_HITS = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    pages INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    x1 REAL, y1 REAL, x2 REAL, y2 REAL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_page_kind ON entries (doc_id, page, kind);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    text, content='entries', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# (page, kind, bbox_norm, text)
+Entry = Tuple[int, str, List[float], str]
+
+LINE = "line"  # kind of OCR lines; layout regions use their region type
+OCR, LAYOUT = "ocr", "layout"
+_REPLACE = {
+    OCR: "DELETE FROM entries WHERE doc_id = ? AND page = ? AND kind = 'line'",
+    LAYOUT: "DELETE FROM entries WHERE doc_id = ? AND page = ? AND kind <> 'line'",
+}
+
+
+def match_expression(query: str) -> str:
+    """
+    Turn a user query into an FTS5 expression: every word must match, and
+    "double-quoted" parts must match as phrases. Operators and punctuation in
+    the query are treated as text, so no query is a syntax error.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        tokens = re.findall(r'\w+', phrase or word)
+        if tokens:
+            terms.append('"' + " ".join(tokens) + '"')
+    return " ".join(terms)
+
+
+def _strip_html(html: str) -> str:
+    return re.sub(r'\s+', ' ', re.sub(r'<[^>]+>', ' ', html)).strip()
+
+
+def ocr_entries(pages: Iterable[Any]) -> Dict[int, List[Entry]]:
+    """Index entries of OCR pages (OCRPageResult), one per text line."""
+    entries = {}
+    for page in pages:
+        entries[page.page] = [(page.page, LINE, line.bbox_norm, line.text) for line in page.results if line.text]
+    return entries
+
+
+def layout_entries(pages: Iterable[Any]) -> Dict[int, List[Entry]]:
+    """Index entries of layout pages, one per region; tables are indexed by their cell text."""
+    entries = {}
+    for page in pages:
+        rows = []
+        for region in page.results:
+            content = region.content or {}
+            text = content.get("text") or _strip_html(content.get("html", ""))
+            if text:
+                rows.append((page.page, region.region_type, list(region.bbox_norm), text))
+        entries[page.page] = rows
+    return entries
+
+
+class SearchIndex:
+    """
+    The SQLite index. Writes go through one connection, serialized by a lock;
+    each reading thread has a connection of its own, so searches see only
+    committed data and are not blocked by a writer (WAL).
+    """
+
+    def __init__(self, path: str = INDEX_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+
+    def _reader(self) -> sqlite3.Connection:
+        """The calling thread's read connection, opened on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    def index_pages(self, doc_id: str, entries: Dict[int, List[Entry]], pipeline: str = LAYOUT) -> int:
+        """
+        Replace the indexed content a pipeline produced for the given pages of a document.
+
+        Args:
+            doc_id: The file name in uploads/
+            entries: Index entries per page number; pages without entries are cleared
+            pipeline: OCR or LAYOUT; the rows of the other pipeline are kept
+
+        Returns:
+            The number of entries written
+        """
+        rows = [
+            (doc_id, page, kind, *(list(bbox)[:4] if len(bbox) >= 4 else [None] * 4), text)
+            for page_entries in entries.values()
+            for page, kind, bbox, text in page_entries
+        ]
+        with span("search_index.write", doc_id=doc_id, pages=len(entries), entries=len(rows)), self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(_REPLACE[pipeline], [(doc_id, page) for page in entries])
+                self._conn.executemany(
+                    "INSERT INTO entries (doc_id, page, kind, x1, y1, x2, y2, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows)
+                self._conn.execute(
+                    "INSERT INTO documents (doc_id, pages, indexed_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (doc_id) DO UPDATE SET pages = max(pages, excluded.pages), indexed_at = excluded.indexed_at",
+                    (doc_id, max(entries, default=0), time.time()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM entries WHERE doc_id = ?", (doc_id,))
+                self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def search(self, query: str, doc_id: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Find indexed lines and regions matching a query, best matches first.
+
+        Args:
+            query: Words, all of which must match; "quoted" parts match as phrases
+            doc_id: Only search this document
+            limit: Maximum number of hits (at most MAX_HITS)
+            offset: Hits to skip, for paging
+
+        Returns:
+            Hits with document, page, normalized box, text and a highlighted snippet
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        sql = ("SELECT e.doc_id, e.page, e.kind, e.x1, e.y1, e.x2, e.y2, e.text, "
+               "highlight(entries_fts, 0, '<mark>', '</mark>'), bm25(entries_fts) "
+               "FROM entries_fts JOIN entries e ON e.id = entries_fts.rowid WHERE entries_fts MATCH ?")
+        params: List[Any] = [expression]
+        if doc_id is not None:
+            sql += " AND e.doc_id = ?"
+            params.append(doc_id)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        params += [min(limit, MAX_HITS), offset]
+
+        with span("search_index.query", query=query) as s:
+            rows = self._reader().execute(sql, params).fetchall()
+            s.set(hits=len(rows))
+        return [
+            {
+                "doc_id": doc, "page": page, "region_type": kind,
+                "bbox_norm": [x1, y1, x2, y2] if x1 is not None else [],
+                "text": text, "highlight": highlight, "score": round(-score, 4),
+            }
+            for doc, page, kind, x1, y1, x2, y2, text, highlight, score in rows
+        ]
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self._conn.close()
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SearchIndex:
+    """The process-wide index, opened on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex()
+    return _index
+
+
+def doc_id_of(source: Any) -> Optional[str]:
+    """The document a processed file is indexed under; None for direct uploads, which are not indexed."""
+    return os.path.basename(source) if isinstance(source, str) else None
+
+
+def index_document(source: Any, entries: Dict[int, List[Entry]], pipeline: str = LAYOUT) -> None:
+    """
+    Index the pages of a file processed by a pipeline (OCR or LAYOUT); does
+    nothing for direct uploads or with the index disabled. Failures are logged, never raised: the index must
+    not break the request that produced the results.
+    """
+    doc_id = doc_id_of(source)
+    if not ENABLED or doc_id is None or not entries:
+        return
+    try:
+        count = get_index().index_pages(doc_id, entries, pipeline)
+        print(f"[SEARCH INDEX] {doc_id}: {count} entries on {len(entries)} pages")
+    except sqlite3.Error as e:
+        print(f"[SEARCH INDEX] Could not index {doc_id}: {e}")
@@ -0,0 +1,143 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import UploadFile
+
+from services.tracing import span
+
+'''
+In-flight request coalescing ("singleflight").
+
+Identical work that is already running is joined instead of started again: a
+double-clicked upload, or the frontend asking for `/layout/path` and
+`/layout/enhanced/markdown` of the same file at the same moment, runs
+inference once. Work is keyed on the content of the input (a hash, so two
+uploads of the same file match), the stage and its options; see
+`content_key()`.
+
+Only concurrent work is shared; nothing is cached once it finishes. The
+computation runs in its own task, so a caller that goes away does not cancel
+it for the others, and every caller but the last to pick up the result gets a
+deep copy, because callers go on to modify what they get (region
+reclassification, boilerplate marks). LEVIOSA_SINGLEFLIGHT=0 turns it off.
+'''
+
+ENABLED = os.getenv("LEVIOSA_SINGLEFLIGHT", "1").lower() not in ("0", "false", "no")
+HASH_CACHE_SIZE = 256  # file hashes kept, keyed by path, size and modification time
+HASH_CHUNK = 1 << 20
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """In-flight computations of one event loop, by key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `compute()`, or wait for the identical computation already in flight.
+
+        Args:
+            key: Identifies the computation; equal keys must give equal results.
+                None runs it without coalescing
+            compute: Starts the computation
+
+        Returns:
+            The result; a private copy unless this caller is the only one left
+        """
+        if not ENABLED or key is None:
+            return await compute()
+
+        flight = self._flights.get(key)
+        joined = flight is not None and not flight.task.done()
+        if joined:
+            print(f"[SINGLEFLIGHT] Joining in-flight {self.name}")
+        else:
+            flight = _Flight(asyncio.ensure_future(compute()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task, key=key, flight=flight: self._land(key, flight))
+
+        flight.waiters += 1
+        try:
+            with span("singleflight.wait", flight=self.name, joined=joined):
+                result = await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+        return result if flight.waiters == 0 else copy.deepcopy(result)
+
+    def _land(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            flight.task.exception()  # the waiters re-raise it; keeps asyncio from logging it as never retrieved
+
+
+_hashes: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_hash_lock = threading.Lock()
+
+
+def file_digest(path: str) -> str:
+    """Content hash of a file, remembered while its size and modification time stay the same."""
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if key in _hashes:
+            _hashes.move_to_end(key)
+            return _hashes[key]
+
+    with open(path, "rb") as f:
+        digest = stream_digest(f)
+    with _hash_lock:
+        _hashes[key] = digest
+        while len(_hashes) > HASH_CACHE_SIZE:
+            _hashes.popitem(last=False)
+    return digest
+
+
+def stream_digest(f: BinaryIO) -> str:
+    """Content hash of a file object, read in chunks from the start; the position is put back at the start."""
+    digest = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+async def content_key(source: Any, stage: str, *params: Any) -> Optional[Tuple]:
+    """
+    The key of a stage run on a file path or upload, or None when the input
+    cannot be hashed (the caller then runs without coalescing). Parameters are
+    JSON-serialized, so Pydantic options are compared by value.
+    """
+    if isinstance(source, str):
+        if not os.path.exists(source):
+            return None
+        digest = await asyncio.to_thread(file_digest, source)
+        kind = os.path.splitext(source)[1].lower()
+    elif isinstance(source, UploadFile):
+        # Hashed in chunks from the spooled file, so the body is not held in memory twice
+        digest = await asyncio.to_thread(stream_digest, source.file)
+        kind = getattr(source, "content_type", "") or ""
+    else:
+        return None
+    return (stage, digest, kind, json_key(*params))
+
+
+def json_key(*params: Any) -> str:
+    return json.dumps([p.dict() if hasattr(p, "dict") else p for p in params], sort_keys=True, default=str)
@@ -0,0 +1,352 @@
+import asyncio
+import math
+import os
+import re
+from difflib import SequenceMatcher
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.tracing import span
+
+'''
+Tiled processing of very large pages (600-DPI scans, drawings, posters).
+
+The engines scale a page down to their input size (960 px for text
+detection), so on a large page small text becomes unreadable. Pages whose
+longer side exceeds LEVIOSA_TILE_ABOVE pixels are instead cut into
+overlapping LEVIOSA_TILE_SIZE tiles, LEVIOSA_TILE_OVERLAP pixels apart at the
+seams, and each tile runs through the engine on its own, one after the
+other: the tiles share the page's engine, and Paddle predictors must not be
+called from two threads at once. A tile is copied out of the page only when
+its turn comes, so the memory on top of the page is bounded by the tile size,
+not by the page size.
+
+The results are merged back into page coordinates, in the engine's own output
+format, so the callers build their lines, regions and bbox_norm as for an
+untiled page:
+
+- text lines seen by two tiles are one line: a line that fits in the overlap
+  is kept from the tile that saw more of it, and a line cut by a seam is
+  joined from its pieces where their readings of the overlap agree, so a
+  word cut at a tile edge comes from the tile that saw it whole
+- regions of the same type cut by a seam are united, and their text lines
+  merged the same way; other content (table HTML) comes from the largest
+  piece, so a table larger than a tile is best read with a larger tile size
+
+The overlap has to be taller than a text line and wider than a long word, so
+every line and word is whole in at least one tile; the default fits 600-DPI
+body text. LEVIOSA_TILE_ABOVE=0 turns tiling off.
+'''
+
+TILE_ABOVE = int(os.getenv("LEVIOSA_TILE_ABOVE", "4000"))
+TILE_SIZE = int(os.getenv("LEVIOSA_TILE_SIZE", "2048"))
+TILE_OVERLAP = int(os.getenv("LEVIOSA_TILE_OVERLAP", "512"))
+ENABLED = TILE_ABOVE > 0
+SAME_ROW = 0.5  # vertical overlap, relative to the lower line, for two pieces to be one line
+CONTAIN_SLACK = 0.25  # detection jitter, relative to the line height, when one piece holds the other
+
+# [[x, y], ...] corners, as the OCR engine returns them
+Quad = List[List[float]]
+
+
+class Tile(NamedTuple):
+    index: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def should_tile(width: int, height: int) -> bool:
+    return ENABLED and max(width, height) > TILE_ABOVE
+
+
+def _starts(length: int, size: int, overlap: int) -> List[int]:
+    """Tile origins along one axis: evenly spread, at least `overlap` apart at each seam."""
+    if length <= size:
+        return [0]
+    count = math.ceil((length - overlap) / (size - overlap))
+    return [round(i * (length - size) / (count - 1)) for i in range(count)]
+
+
+def plan_tiles(width: int, height: int, size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> List[Tile]:
+    """Overlapping tiles covering a page, row by row."""
+    size = max(size, 2 * overlap + 1)
+    tiles = []
+    for y in _starts(height, size, overlap):
+        for x in _starts(width, size, overlap):
+            tiles.append(Tile(len(tiles), x, y, min(size, width - x), min(size, height - y)))
+    return tiles
+
+
+def crop(image_np: np.ndarray, tile: Tile) -> np.ndarray:
+    return np.ascontiguousarray(image_np[tile.y:tile.y + tile.height, tile.x:tile.x + tile.width])
+
+
+async def map_tiles(image_np: np.ndarray, tiles: Sequence[Tile], run: Callable[[np.ndarray], Any]) -> List[Any]:
+    """
+    Run `run` on every tile in a worker thread, one tile at a time, since the
+    tiles of a page share one engine.
+
+    Returns:
+        The results, in tile order
+    """
+    def process(tile: Tile) -> Any:
+        return run(crop(image_np, tile))
+
+    results = []
+    for tile in tiles:
+        with span("tile", index=tile.index, x=tile.x, y=tile.y, width=tile.width, height=tile.height):
+            results.append(await asyncio.to_thread(process, tile))
+    return results
+
+
+class _Piece:
+    """A line or region found in one tile, in page coordinates."""
+
+    __slots__ = ("tile", "box", "text", "confidence", "data", "cut")
+
+    def __init__(self, tile: int, box: Sequence[float], text: str = "", confidence: float = 1.0, data: Any = None,
+                 cut: FrozenSet[str] = frozenset()):
+        self.tile = tile
+        self.box = [float(v) for v in box]
+        self.text = text
+        self.confidence = confidence
+        self.data = data
+        self.cut = cut  # sides touching an edge of the tile inside the page: maybe only part of it was seen
+
+    @property
+    def width(self) -> float:
+        return self.box[2] - self.box[0]
+
+    @property
+    def height(self) -> float:
+        return self.box[3] - self.box[1]
+
+    @property
+    def area(self) -> float:
+        return self.width * self.height
+
+
+def _cut_sides(box: Sequence[float], tile: Tile, page_width: int, page_height: int) -> FrozenSet[str]:
+    slack = CONTAIN_SLACK * (box[3] - box[1])
+    sides = {
+        "left": tile.x > 0 and box[0] - tile.x <= slack,
+        "top": tile.y > 0 and box[1] - tile.y <= slack,
+        "right": tile.x + tile.width < page_width and tile.x + tile.width - box[2] <= slack,
+        "bottom": tile.y + tile.height < page_height and tile.y + tile.height - box[3] <= slack,
+    }
+    return frozenset(side for side, cut in sides.items() if cut)
+
+
+def _page_size(tiles: Sequence[Tile]) -> Sequence[int]:
+    return max(t.x + t.width for t in tiles), max(t.y + t.height for t in tiles)
+
+
+def _overlap(a: _Piece, b: _Piece, axis: int) -> float:
+    return min(a.box[axis + 2], b.box[axis + 2]) - max(a.box[axis], b.box[axis])
+
+
+def _groups(pieces: List[_Piece], related: Callable[[_Piece, _Piece], bool]) -> List[List[_Piece]]:
+    """Pieces of different tiles connected by `related` (union-find)."""
+    parent = list(range(len(pieces)))
+
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    order = sorted(range(len(pieces)), key=lambda i: pieces[i].box[0])
+    for n, i in enumerate(order):
+        for j in order[n + 1:]:
+            if pieces[j].box[0] >= pieces[i].box[2]:
+                break  # sorted by left edge: nothing further right overlaps
+            if pieces[i].tile != pieces[j].tile and related(pieces[i], pieces[j]):
+                parent[root(i)] = root(j)
+
+    groups: Dict[int, List[_Piece]] = {}
+    for i, piece in enumerate(pieces):
+        groups.setdefault(root(i), []).append(piece)
+    return list(groups.values())
+
+
+def _same_line(a: _Piece, b: _Piece) -> bool:
+    return (_overlap(a, b, 0) > 0 and _overlap(a, b, 1) > 0
+            and _overlap(a, b, 1) >= SAME_ROW * min(a.height, b.height))
+
+
+def _words(piece: _Piece) -> List[Tuple[str, float]]:
+    """The words of a piece with their estimated centers; characters are taken as evenly spaced."""
+    length = len(piece.text) or 1
+    return [
+        (m.group(), piece.box[0] + (m.start() + m.end()) / 2 / length * piece.width)
+        for m in re.finditer(r'\S+', piece.text)
+    ]
+
+
+def _stitch(a: _Piece, b: _Piece) -> str:
+    """
+    The text of a line cut by a seam, from its left piece `a` and right piece `b`.
+
+    The words both pieces read inside the overlap are lined up, and the line
+    switches from `a` to `b` in the middle of the longest run they agree on;
+    words at a tile edge may be cut, the ones in the middle of the overlap are
+    whole in both. Without such a run, each word comes from the piece that has
+    its center on its side of the middle of the overlap.
+    """
+    left, right = _words(a), _words(b)
+    start, end = max(a.box[0], b.box[0]), min(a.box[2], b.box[2])
+    slack = min(a.height, b.height)
+    in_a = [i for i, (_, x) in enumerate(left) if start - slack <= x <= end + slack]
+    in_b = [i for i, (_, x) in enumerate(right) if start - slack <= x <= end + slack]
+    if in_a and in_b:
+        match = SequenceMatcher(None, [left[i][0] for i in in_a], [right[i][0] for i in in_b],
+                                autojunk=False).find_longest_match(0, len(in_a), 0, len(in_b))
+        if match.size and abs(left[in_a[match.a]][1] - right[in_b[match.b]][1]) <= 2 * slack:
+            half = match.size // 2
+            i, j = in_a[match.a] + half, in_b[match.b] + half
+            return " ".join([w for w, _ in left[:i]] + [w for w, _ in right[j:]])
+    seam = (start + end) / 2
+    return " ".join([w for w, x in left if x < seam] + [w for w, x in right if x >= seam])
+
+
+def _join(a: _Piece, b: _Piece) -> _Piece:
+    """Two readings of the same line, `a` starting further left."""
+    slack = CONTAIN_SLACK * min(a.height, b.height)
+    for whole, part in ((a, b), (b, a)):
+        if whole.box[0] - slack <= part.box[0] and part.box[2] <= whole.box[2] + slack:
+            left, right = part.box[0] <= whole.box[0] + slack, part.box[2] >= whole.box[2] - slack
+            if left and right:
+                # Both saw the same stretch: keep the reading least cut by tile edges
+                return min((whole, part), key=lambda p: (len(p.cut), -p.confidence))
+            # The longer reading is cut where the shorter one goes on: stitch them, the shorter one on that side
+            if left and "left" in whole.cut - part.cut:
+                a, b = part, whole
+            elif right and "right" in whole.cut - part.cut:
+                a, b = whole, part
+            else:
+                # One tile saw the whole line, the other a piece of it
+                return whole
+            break
+    box = [min(a.box[0], b.box[0]), min(a.box[1], b.box[1]), max(a.box[2], b.box[2]), max(a.box[3], b.box[3])]
+    right = b if b.box[2] >= a.box[2] else a
+    cut = (a.cut & {"left"}) | (right.cut & {"right"}) | ((a.cut | b.cut) & {"top", "bottom"})
+    return _Piece(a.tile, box, _stitch(a, b), min(a.confidence, b.confidence), cut=frozenset(cut))
+
+
+def _merge_line_pieces(pieces: List[_Piece]) -> List[_Piece]:
+    merged = []
+    for group in _groups(pieces, _same_line):
+        group.sort(key=lambda p: p.box[0])
+        line = group[0]
+        for piece in group[1:]:
+            line = _join(line, piece)
+        merged.append(line)
+    return merged
+
+
+def _quad_box(quad: Quad) -> List[float]:
+    xs, ys = [p[0] for p in quad], [p[1] for p in quad]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def _box_quad(box: Sequence[float]) -> Quad:
+    x1, y1, x2, y2 = box
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+def _offset_quad(quad: Quad, tile: Tile) -> Quad:
+    return [[float(x) + tile.x, float(y) + tile.y] for x, y in quad]
+
+
+def merge_ocr(tiles: Sequence[Tile], results: Sequence[Any]) -> List[List[Any]]:
+    """
+    Merge per-tile OCR engine results into one page result.
+
+    Args:
+        tiles: The tiles, as planned
+        results: The engine output of each tile ([[quad, (text, confidence)], ...] in a list)
+
+    Returns:
+        The page's lines in the engine's format, [[quad, (text, confidence)], ...], top to bottom
+    """
+    page_width, page_height = _page_size(tiles)
+    pieces = []
+    for tile, result in zip(tiles, results):
+        for quad, (text, confidence) in (result[0] if result else None) or []:
+            page_quad = _offset_quad(quad, tile)
+            box = _quad_box(page_quad)
+            pieces.append(_Piece(tile.index, box, text, confidence, page_quad,
+                                 cut=_cut_sides(box, tile, page_width, page_height)))
+
+    lines = []
+    for piece in _merge_line_pieces(pieces):
+        # Lines kept whole keep the engine's quad; joined lines get their box
+        quad = piece.data if piece.data is not None else _box_quad(piece.box)
+        lines.append([quad, (piece.text, piece.confidence)])
+    lines.sort(key=lambda line: (line[0][0][1], line[0][0][0]))
+    return lines
+
+
+def _same_region(a: _Piece, b: _Piece) -> bool:
+    """Pieces of one region cut by a seam: the same type, overlapping, and lined up along the seam."""
+    if a.text != b.text or _overlap(a, b, 0) <= 0 or _overlap(a, b, 1) <= 0:
+        return False
+    return (_overlap(a, b, 1) >= SAME_ROW * min(a.height, b.height)
+            or _overlap(a, b, 0) >= SAME_ROW * min(a.width, b.width))
+
+
+def _text_lines(res: Any) -> Optional[List[Dict[str, Any]]]:
+    if isinstance(res, list) and all(isinstance(item, dict) and "text_region" in item for item in res):
+        return res
+    return None
+
+
+def merge_structure(tiles: Sequence[Tile], results: Sequence[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Merge per-tile structure engine results into one page result.
+
+    Args:
+        tiles: The tiles, as planned
+        results: The engine output of each tile ([{"type", "bbox", "res", ...}, ...])
+
+    Returns:
+        The page's regions in the engine's format, in page coordinates; text
+        lines of regions cut by a seam are merged and ordered top to bottom
+    """
+    page_width, page_height = _page_size(tiles)
+    pieces = []
+    for tile, regions in zip(tiles, results):
+        for region in regions:
+            x1, y1, x2, y2 = region.get("bbox", [0, 0, 0, 0])
+            box = [x1 + tile.x, y1 + tile.y, x2 + tile.x, y2 + tile.y]
+            lines = _text_lines(region.get("res"))
+            if lines is not None:
+                # Text regions: their lines as pieces, to merge with the other pieces' lines
+                lines = [
+                    _Piece(tile.index, _quad_box(quad), line.get("text", ""), line.get("confidence", 1.0), quad,
+                           cut=_cut_sides(_quad_box(quad), tile, page_width, page_height))
+                    for line in lines
+                    for quad in [_offset_quad(line["text_region"], tile)]
+                ]
+            data = ({**region, "bbox": box, "img": None}, lines)
+            pieces.append(_Piece(tile.index, box, region.get("type", "unknown"), data=data))
+
+    merged = []
+    for group in _groups(pieces, _same_region):
+        region = dict(max(group, key=lambda p: p.area).data[0])
+        region["bbox"] = [min(p.box[0] for p in group), min(p.box[1] for p in group),
+                          max(p.box[2] for p in group), max(p.box[3] for p in group)]
+        if all(p.data[1] is not None for p in group):
+            lines = _merge_line_pieces([line for p in group for line in p.data[1]])
+            lines.sort(key=lambda p: (p.box[1], p.box[0]))
+            region["res"] = [
+                {"text": p.text, "confidence": p.confidence,
+                 "text_region": p.data if p.data is not None else _box_quad(p.box)}
+                for p in lines
+            ]
+        merged.append(region)
+    merged.sort(key=lambda r: (r["bbox"][1], r["bbox"][0]))
+    return merged
@@ -0,0 +1,280 @@
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from services import memory
+
+'''
+Opt-in per-request tracing.
+
+A request is traced when it carries the `X-Leviosa-Trace` header or a `trace`
+query parameter. Spans recorded while the request runs (including inside
+`asyncio.to_thread` workers, which inherit the context) are written to
+TRACE_DIR as a Chrome trace file, viewable in chrome://tracing or Perfetto.
+With the value `profile`, a sampling profiler also runs for the duration of
+the request and its samples are written next to the trace in speedscope format.
+
+Spans double as the stages of per-request memory accounting
+(services/memory.py). When neither is active `span()` returns a shared no-op
+object, so instrumented code pays for two context variable lookups.
+'''
+
+TRACE_DIR = os.environ.get("LEVIOSA_TRACE_DIR", "traces")
+TRACE_HEADER = "X-Leviosa-Trace"
+TRACE_QUERY_PARAM = "trace"
+TRACE_ID_HEADER = "X-Trace-Id"
+PROFILE_INTERVAL = float(os.environ.get("LEVIOSA_PROFILE_INTERVAL", "0.005"))
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("leviosa_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("leviosa_span", default=None)
+
+
+class _NullSpan:
+    """Span returned when tracing is disabled; does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """A timed region of work recorded into the active trace."""
+
+    def __init__(self, trace: "Trace", name: str, args: Dict[str, Any],
+                 memory_stage: Optional[memory.MemoryStage] = None):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id: Optional[str] = None
+        self._token = None
+        self._start = 0.0
+        self._memory_stage = memory_stage
+
+    def __enter__(self):
+        self.parent_id = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        if self._memory_stage is not None:
+            self._memory_stage.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if self._memory_stage is not None:
+            self._memory_stage.__exit__(exc_type, exc, tb)
+            self.args["memory_peak_mb"] = round(self._memory_stage.peak / 2**20, 2)
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.trace.record(self, self._start, end)
+        return False
+
+    def set(self, **args: Any) -> None:
+        """Attach extra attributes to the span once they are known."""
+        self.args.update(args)
+
+
+def span(name: str, **args: Any):
+    """
+    Open a span in the current request's trace.
+
+    Args:
+        name: Span name shown in the trace viewer
+        **args: Attributes stored with the span (page number, sizes, ...)
+
+    Returns:
+        A context manager; a shared no-op one when neither tracing nor memory
+        accounting is active for the request
+    """
+    trace = _current_trace.get()
+    report = memory.current_report()
+    if trace is None:
+        return report.stage(name) if report is not None else _NULL_SPAN
+    return _Span(trace, name, args, report.stage(name) if report is not None else None)
+
+
+def is_tracing() -> bool:
+    """Whether the current context belongs to a traced request."""
+    return _current_trace.get() is not None
+
+
+class Trace:
+    """Collects the spans of one request and writes them to disk."""
+
+    def __init__(self, name: str, profile: bool = False):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._root: Optional[_Span] = None
+        self.profiler = SamplingProfiler() if profile else None
+
+    def record(self, span_obj: _Span, start: float, end: float) -> None:
+        event = {
+            "name": span_obj.name,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {
+                **{k: _jsonable(v) for k, v in span_obj.args.items()},
+                "span_id": span_obj.span_id,
+                "parent_id": span_obj.parent_id,
+            },
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def start(self) -> None:
+        """Activate the trace in the current context and open the root span."""
+        _current_trace.set(self)
+        self._root = _Span(self, self.name, {})
+        self._root.__enter__()
+        if self.profiler:
+            self.profiler.start()
+
+    def finish(self) -> None:
+        """Close the root span and stop the profiler."""
+        if self.profiler:
+            self.profiler.stop()
+        if self._root is not None:
+            self._root.__exit__(None, None, None)
+            self._root = None
+
+    def save(self, directory: str = TRACE_DIR) -> str:
+        """
+        Write the trace (and profile, if captured) to disk.
+
+        Returns:
+            Path of the Chrome trace file
+        """
+        os.makedirs(directory, exist_ok=True)
+        trace_path = os.path.join(directory, f"{self.trace_id}.trace.json")
+        with self._lock:
+            events = list(self.events)
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}}, f)
+
+        if self.profiler:
+            profile_path = os.path.join(directory, f"{self.trace_id}.speedscope.json")
+            with open(profile_path, "w") as f:
+                json.dump(self.profiler.to_speedscope(self.name), f)
+
+        return trace_path
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of all other threads at a fixed interval.
+    Only meant for traced requests; the sampler thread runs until stop().
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.frames: List[Dict[str, Any]] = []
+        self._frame_index: Dict[tuple, int] = {}
+        self.samples: Dict[int, List[List[int]]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._stopped = 0.0
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="leviosa-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._stopped = time.perf_counter()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.setdefault(thread_id, []).append(stack)
+
+    def _frame_id(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = len(self.frames)
+            self._frame_index[key] = index
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """Render the collected samples as a speedscope file."""
+        duration = self._stopped - self._started
+        profiles = []
+        for thread_id, stacks in self.samples.items():
+            profiles.append({
+                "type": "sampled",
+                "name": f"{name} (thread {thread_id})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": duration,
+                "samples": stacks,
+                "weights": [self.interval] * len(stacks),
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": self.frames},
+            "profiles": profiles,
+            "name": name,
+            "exporter": "leviosa",
+        }
+
+
+def requested_mode(headers, query_params) -> Optional[str]:
+    """
+    Read the tracing flag from a request.
+
+    Returns:
+        None when tracing was not requested, otherwise "trace" or "profile"
+    """
+    value = headers.get(TRACE_HEADER) or query_params.get(TRACE_QUERY_PARAM)
+    if not value or value.lower() in ("0", "false", "off"):
+        return None
+    return "profile" if value.lower() == "profile" else "trace"
+
+
+async def finish_and_save(trace: Trace) -> str:
+    """Close the trace and write it to disk off the event loop."""
+    trace.finish()
+    path = await asyncio.to_thread(trace.save)
+    print(f"[TRACE] {trace.name} written to {path}")
+    return path
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
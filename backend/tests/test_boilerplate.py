@@ -0,0 +1,50 @@
+from models.document import LayoutDocument, LayoutPage, LayoutRegion
+from services.boilerplate import mark_boilerplate
+
+
+def _region(page: int, index: int, text: str, x: float, y: float) -> LayoutRegion:
+    bbox = [x - 0.1, y - 0.01, x + 0.1, y + 0.01]
+    return LayoutRegion(f"p{page}_r{index}", "text", [v * 1000 for v in bbox], bbox, {"text": text}, page)
+
+
+def _document(pages):
+    return LayoutDocument([
+        LayoutPage(page, [_region(page, i, text, x, y) for i, (text, x, y) in enumerate(regions)])
+        for page, regions in enumerate(pages, start=1)
+    ])
+
+
+def test_header_jittering_across_a_grid_line_is_boilerplate():
+    # Centres on both sides of the 0.05 grid line between pages
+    document = _document([
+        [("ACME Corp - Annual Report", 0.5, 0.049), ("Revenue grew in the first quarter.", 0.5, 0.4)],
+        [("ACME Corp - Annual Report", 0.5, 0.051), ("Costs were flat over the year.", 0.5, 0.4)],
+        [("ACME Corp - Annual Report", 0.5, 0.048), ("Outlook for the next year.", 0.5, 0.4)],
+    ])
+    entries = mark_boilerplate(document)
+    assert [entry["text"] for entry in entries] == ["ACME Corp - Annual Report"]
+    assert entries[0]["pages"] == [1, 2, 3]
+    assert document.metadata["boilerplate_ids"] == {"p1_r0", "p2_r0", "p3_r0"}
+
+
+def test_page_numbers_repeat_on_most_pages_of_a_short_document():
+    document = _document([
+        [("Page 1 of 3", 0.5, 0.97)],
+        [("Page 2 of 3", 0.52, 0.96)],
+        [("Figure 3", 0.5, 0.5)],
+    ])
+    assert [entry["pages"] for entry in mark_boilerplate(document)] == [[1, 2]]
+
+
+def test_same_text_far_apart_is_not_boilerplate():
+    document = _document([
+        [("Confidential", 0.5, 0.03)],
+        [("Confidential", 0.5, 0.5)],
+        [("Confidential", 0.1, 0.9)],
+    ])
+    assert mark_boilerplate(document) == []
+
+
+def test_short_documents_have_no_boilerplate():
+    document = _document([[("ACME Corp", 0.5, 0.03)], [("ACME Corp", 0.5, 0.03)]])
+    assert mark_boilerplate(document) == []
@@ -0,0 +1,16 @@
+from services.markdown_refiner import lint_section
+
+
+def test_clean_aligned_table_is_clean():
+    section = (
+        "## Totals\n\n"
+        "| Item      | Qty | Amount   |\n"
+        "|:----------|----:|---------:|\n"
+        "| Paper     |   2 |    10.00 |\n"
+        "| Toner     |   1 |   125.50 |\n"
+    )
+    assert lint_section(section) == []
+
+
+def test_run_of_spaces_in_prose_is_noise():
+    assert "run of spaces" in lint_section("The invoice    was paid on time.\n")
@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from services.page_filter import PageFilter
+
+
+def _font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        pytest.skip("needs Pillow >= 10.1")
+
+
+def _statement(seed: int, dpi: int) -> Image.Image:
+    """A letter page: 40 rows of dates, labels and random amounts."""
+    rng = random.Random(seed)
+    img = Image.new("L", (int(8.5 * dpi), 11 * dpi), 255)
+    draw = ImageDraw.Draw(img)
+    font = _font(int(dpi * 0.12))
+    draw.text((int(0.8 * dpi), int(0.6 * dpi)), "ACCOUNT STATEMENT", font=_font(int(dpi * 0.2)), fill=0)
+    row = int(0.2 * dpi)
+    for r in range(40):
+        y = int(1.5 * dpi) + r * row
+        draw.text((int(0.8 * dpi), y), f"2024-03-{r % 28 + 1:02d}", font=font, fill=0)
+        draw.text((int(2.2 * dpi), y), ["Transfer", "Card payment", "Direct debit", "Deposit"][r % 4], font=font, fill=0)
+        draw.text((int(5.8 * dpi), y), f"{rng.uniform(1, 9999):>10.2f}", font=font, fill=0)
+        draw.text((int(7.0 * dpi), y), f"{rng.uniform(1, 99999):>10.2f}", font=font, fill=0)
+        draw.line((int(0.8 * dpi), y + row - 3, int(7.8 * dpi), y + row - 3), fill=160)
+    return img
+
+
+def _rescan(img: Image.Image, seed: int) -> np.ndarray:
+    """The same page scanned again: shifted, slightly rotated, blurred and noisy."""
+    rng = np.random.default_rng(seed)
+    out = img.rotate(0.3, resample=Image.BILINEAR, fillcolor=255, translate=(3, 5))
+    out = out.filter(ImageFilter.GaussianBlur(0.8))
+    noisy = np.asarray(out).astype(np.int16) + rng.normal(0, 8, (out.height, out.width)).astype(np.int16)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def _verdicts(*pages: np.ndarray):
+    page_filter = PageFilter()
+    return [page_filter.check(number, page) for number, page in enumerate(pages, start=1)]
+
+
+def test_rescan_is_a_duplicate():
+    for dpi in (100, 150, 200):
+        original = _statement(1, dpi)
+        _, verdict = _verdicts(np.asarray(original), _rescan(original, seed=dpi))
+        assert verdict.skipped == "duplicate"
+        assert verdict.duplicate_of == 1
+
+
+def test_same_template_with_other_figures_is_not_a_duplicate():
+    for dpi in (100, 150, 200):
+        first = np.asarray(_statement(1, dpi))
+        for seed in (2, 3):
+            _, verdict = _verdicts(first, np.asarray(_statement(seed, dpi)))
+            assert verdict.skipped is None
+            _, verdict = _verdicts(first, _rescan(_statement(seed, dpi), seed))
+            assert verdict.skipped is None
+
+
+def test_duplicate_waits_for_the_page_it_repeats():
+    original = _statement(1, 100)
+    page_filter = PageFilter()
+    page_filter.check(1, np.asarray(original))
+    verdict = page_filter.check(2, _rescan(original, seed=1))
+    assert verdict.duplicate_of == 1
+
+    async def run():
+        waiting = asyncio.ensure_future(page_filter.result_of(1))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        page_filter.remember(1, "page 1")
+        return await waiting
+
+    assert asyncio.run(run()) == "page 1"
+
+
+def test_duplicate_of_a_failed_page_gets_no_result():
+    page_filter = PageFilter()
+    page_filter.check(1, np.asarray(_statement(1, 100)))
+    page_filter.forget(1)
+    assert asyncio.run(page_filter.result_of(1)) is None
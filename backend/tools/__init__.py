@@ -0,0 +1 @@
+# Model maintenance scripts; run with `python -m tools.<script>` from backend/
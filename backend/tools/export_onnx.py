@@ -0,0 +1,88 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from typing import List, Optional
+
+'''
+Export the Paddle inference models to ONNX for the onnx engine backend.
+
+Writes det.onnx, rec.onnx, layout.onnx, cls.onnx (when the angle classifier
+model is found) and rec_dict.txt into LEVIOSA_ONNX_MODEL_DIR (models/onnx),
+the layout services/onnx_engines.py loads. Only this step needs paddle2onnx;
+the serving image needs onnxruntime and opencv, not paddle.
+
+    pip install paddle2onnx
+    python -m tools.export_onnx
+    LEVIOSA_ENGINE_BACKEND=onnx uvicorn main:app
+'''
+
+# The fp32 model directories used by services/engines.py (not imported, since
+# importing the engines module loads the models)
+MODELS = {
+    "det": "models/en_PP-OCRv3_det_infer",
+    "rec": "models/en_PP-OCRv3_rec_infer",
+    "layout": "models/layout_ppv3_infer",
+}
+# Where PaddleOCR downloads the default angle classifier
+DEFAULT_CLS_DIR = os.path.expanduser("~/.paddleocr/whl/cls/ch_ppocr_mobile_v2.0_cls_infer")
+ONNX_MODEL_DIR = os.getenv("LEVIOSA_ONNX_MODEL_DIR", "models/onnx")
+
+
+def export(name: str, model_dir: str, output_dir: str, opset: int) -> bool:
+    """Convert one model with the paddle2onnx CLI; False when its weights are missing."""
+    if not os.path.exists(os.path.join(model_dir, "inference.pdiparams")):
+        print(f"[EXPORT] Skipping {name}: no weights in {model_dir}")
+        return False
+    save_file = os.path.join(output_dir, f"{name}.onnx")
+    print(f"[EXPORT] {name}: {model_dir} -> {save_file}")
+    subprocess.run([
+        "paddle2onnx",
+        "--model_dir", model_dir,
+        "--model_filename", "inference.pdmodel",
+        "--params_filename", "inference.pdiparams",
+        "--save_file", save_file,
+        "--opset_version", str(opset),
+        "--enable_onnx_checker", "True",
+    ], check=True)
+    return True
+
+
+def copy_rec_dict(output_dir: str, dict_path: Optional[str]) -> None:
+    """The recognizer's character list; PaddleOCR's en_dict.txt for the English model."""
+    if dict_path is None:
+        try:
+            import paddleocr  # type: ignore
+        except ImportError:
+            print("[EXPORT] paddleocr not installed; pass --rec-dict to copy the character dictionary")
+            return
+        dict_path = os.path.join(os.path.dirname(paddleocr.__file__), "ppocr", "utils", "en_dict.txt")
+    shutil.copy(dict_path, os.path.join(output_dir, "rec_dict.txt"))
+    print(f"[EXPORT] rec dictionary: {dict_path}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export the Paddle models to ONNX")
+    parser.add_argument("--output", default=ONNX_MODEL_DIR)
+    parser.add_argument("--cls-model-dir", default=DEFAULT_CLS_DIR, help="Angle classifier inference model")
+    parser.add_argument("--rec-dict", help="Character dictionary of the rec model (default: PaddleOCR's en_dict.txt)")
+    parser.add_argument("--opset", type=int, default=11)
+    args = parser.parse_args(argv)
+
+    if shutil.which("paddle2onnx") is None:
+        print("[EXPORT] paddle2onnx is not installed: pip install paddle2onnx")
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    exported = {name: export(name, model_dir, args.output, args.opset) for name, model_dir in MODELS.items()}
+    exported["cls"] = export("cls", args.cls_model_dir, args.output, args.opset)
+    copy_rec_dict(args.output, args.rec_dict)
+
+    for name, ok in exported.items():
+        print(f"[EXPORT] {name}: {'ok' if ok else 'skipped'}")
+    return 0 if all(exported[name] for name in MODELS) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import argparse
+import os
+import shutil
+import sys
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import PAGE_KINDS, SyntheticPage, generate_page
+
+'''
+Post-training int8 quantization of the det, rec and layout models.
+
+Calibrates each fp32 model in models/ on synthetic pages (preprocessed the way
+PaddleOCR / PP-Structure feed them) and writes the quantized model to
+models/int8/<model name>/inference.pdmodel, where the `int8` inference profile
+picks it up (LEVIOSA_INFERENCE_PROFILE=int8).
+
+Requires paddlepaddle and paddleslim:
+    pip install paddleslim
+    python -m tools.quantize_models
+    python -m benchmarks.compare_profiles   # accuracy and latency against fp32
+'''
+
+# The fp32 model directories used by services/engines.py (not imported, since
+# importing the engines module loads the models)
+MODELS = {
+    "det": "models/en_PP-OCRv3_det_infer",
+    "rec": "models/en_PP-OCRv3_rec_infer",
+    "layout": "models/layout_ppv3_infer",
+}
+INT8_MODEL_ROOT = os.getenv("LEVIOSA_INT8_MODEL_DIR", "models/int8")
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+DET_LIMIT_SIDE = 960
+REC_SHAPE = (48, 320)
+LAYOUT_SHAPE = (800, 608)
+
+
+def _normalize_imagenet(image: Image.Image) -> np.ndarray:
+    array = (np.asarray(image, dtype=np.float32) / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    return array.transpose(2, 0, 1)
+
+
+def det_input(page: SyntheticPage) -> List[np.ndarray]:
+    """DB detector input: longest side limited to 960, both sides multiples of 32."""
+    width, height = page.image.size
+    ratio = min(1.0, DET_LIMIT_SIDE / max(width, height))
+    size = (max(32, int(round(width * ratio / 32)) * 32), max(32, int(round(height * ratio / 32)) * 32))
+    return [_normalize_imagenet(page.image.resize(size))[None]]
+
+
+def rec_inputs(page: SyntheticPage, batch_size: int = 8) -> Iterator[List[np.ndarray]]:
+    """Recognizer input: ground-truth line crops, height 48, right-padded to 320."""
+    height, max_width = REC_SHAPE
+    batch = []
+    for line in page.lines:
+        crop = page.image.crop(tuple(int(v) for v in line.bbox))
+        width = min(max_width, max(1, int(np.ceil(height * crop.width / max(1, crop.height)))))
+        array = (np.asarray(crop.resize((width, height)), dtype=np.float32) / 255.0 - 0.5) / 0.5
+        padded = np.zeros((3, height, max_width), dtype=np.float32)
+        padded[:, :, :width] = array.transpose(2, 0, 1)
+        batch.append(padded)
+        if len(batch) == batch_size:
+            yield [np.stack(batch)]
+            batch = []
+    if batch:
+        yield [np.stack(batch)]
+
+
+def layout_input(page: SyntheticPage) -> List[np.ndarray]:
+    """PicoDet layout input: fixed 800x608 plus the scale factor."""
+    height, width = LAYOUT_SHAPE
+    scale = np.array([[height / page.image.height, width / page.image.width]], dtype=np.float32)
+    return [_normalize_imagenet(page.image.resize((width, height)))[None], scale]
+
+
+def calibration_batches(model: str, pages: List[SyntheticPage]) -> Callable[[], Iterator[List[np.ndarray]]]:
+    def generator():
+        for page in pages:
+            if model == "det":
+                yield det_input(page)
+            elif model == "rec":
+                yield from rec_inputs(page)
+            else:
+                yield layout_input(page)
+    return generator
+
+
+def _ordered_feeds(model_dir: str, batch_generator):
+    """Reorder the layout feeds to the model's feed order (image / scale_factor)."""
+    import paddle  # type: ignore
+
+    executor = paddle.static.Executor(paddle.CPUPlace())
+    _, feed_names, _ = paddle.static.load_inference_model(os.path.join(model_dir, "inference"), executor)
+    if feed_names[0] == "image" or len(feed_names) == 1:
+        return batch_generator
+
+    def reordered():
+        for image, scale in batch_generator():
+            yield [scale, image] if feed_names[0] == "scale_factor" else [image, scale]
+    return reordered
+
+
+def quantize(model: str, pages: List[SyntheticPage], algo: str, output_root: str) -> Optional[str]:
+    """
+    Quantize one model.
+
+    Returns:
+        The output directory, or None when the fp32 weights are missing
+    """
+    import paddle  # type: ignore
+    from paddleslim.quant import quant_post_static  # type: ignore
+
+    model_dir = MODELS[model]
+    if not os.path.exists(os.path.join(model_dir, "inference.pdiparams")):
+        print(f"[QUANT] Skipping {model}: no weights in {model_dir}")
+        return None
+
+    output_dir = os.path.join(output_root, os.path.basename(model_dir))
+    paddle.enable_static()
+    executor = paddle.static.Executor(paddle.CPUPlace())
+    print(f"[QUANT] {model}: {model_dir} -> {output_dir} ({algo}, {len(pages)} calibration pages)")
+    quant_post_static(
+        executor=executor,
+        model_dir=model_dir,
+        quantize_model_path=output_dir,
+        batch_generator=_ordered_feeds(model_dir, calibration_batches(model, pages)),
+        model_filename="inference.pdmodel",
+        params_filename="inference.pdiparams",
+        save_model_filename="inference.pdmodel",
+        save_params_filename="inference.pdiparams",
+        algo=algo,
+        quantizable_op_type=["conv2d", "depthwise_conv2d", "mul", "matmul", "matmul_v2"],
+    )
+    info = os.path.join(model_dir, "inference.pdiparams.info")
+    if os.path.exists(info):
+        shutil.copy(info, output_dir)
+    return output_dir
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Int8 post-training quantization of the Paddle models")
+    parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS))
+    parser.add_argument("--pages", type=int, default=20, help="Synthetic calibration pages")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--algo", default="hist", choices=["hist", "KL", "mse", "avg", "abs_max"])
+    parser.add_argument("--output", default=INT8_MODEL_ROOT)
+    args = parser.parse_args(argv)
+
+    try:
+        import paddleslim  # noqa: F401
+    except ImportError:
+        print("[QUANT] paddleslim is not installed: pip install paddleslim")
+        return 1
+
+    # Different seeds than the comparison reference set, so accuracy is not measured on calibration data
+    pages = [generate_page(PAGE_KINDS[i % len(PAGE_KINDS)], args.dpi, seed=1000 + i) for i in range(args.pages)]
+    results: Dict[str, Optional[str]] = {model: quantize(model, pages, args.algo, args.output) for model in args.models}
+    for model, output_dir in results.items():
+        print(f"[QUANT] {model}: {output_dir or 'skipped'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+from typing import Dict, List, Optional
+
+'''
+Memory per process of the pre-fork server (gunicorn.conf.py).
+
+RSS counts every page a process maps, so pages shared copy-on-write with the
+master are counted once per worker and the RSS of the workers adds up to far
+more than the machine actually uses. PSS splits each shared page between the
+processes sharing it, so the PSS of all processes adds up to the real total;
+the private (unshared) memory of a worker is what each additional worker
+costs. Linux only (/proc/<pid>/smaps_rollup).
+
+    ./serve.sh &
+    python -m tools.worker_memory                # master from data/gunicorn.pid
+    python -m tools.worker_memory --pid 12345 --json
+
+Measure again after some traffic: workers un-share pages as they write to
+them, so the numbers of an idle server are a lower bound.
+'''
+
+PIDFILE = os.getenv("LEVIOSA_PIDFILE", os.path.join("data", "gunicorn.pid"))
+FIELDS = ["Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"]
+
+
+def smaps_rollup(pid: int) -> Dict[str, float]:
+    """Memory counters of a process in MB."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024  # kB
+    return values
+
+
+def children(pid: int) -> List[int]:
+    result = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name is in parentheses and may contain spaces; the parent pid follows it
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            result.append(int(entry))
+    return sorted(result)
+
+
+def measure(master: int) -> Dict[str, object]:
+    processes = []
+    for role, pid in [("master", master)] + [("worker", pid) for pid in children(master)]:
+        values = smaps_rollup(pid)
+        processes.append({
+            "role": role,
+            "pid": pid,
+            "rss_mb": round(values.get("Rss", 0), 1),
+            "pss_mb": round(values.get("Pss", 0), 1),
+            "shared_mb": round(values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0), 1),
+            "private_mb": round(values.get("Private_Clean", 0) + values.get("Private_Dirty", 0), 1),
+        })
+    workers = [p for p in processes if p["role"] == "worker"]
+    return {
+        "processes": processes,
+        "workers": len(workers),
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes), 1),
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+        "private_per_worker_mb": round(sum(p["private_mb"] for p in workers) / len(workers), 1) if workers else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="RSS, PSS and shared memory of the pre-fork server's processes")
+    parser.add_argument("--pid", type=int, help=f"Master pid (default: read from {PIDFILE})")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    master = args.pid
+    if master is None:
+        try:
+            with open(PIDFILE) as f:
+                master = int(f.read().strip())
+        except (OSError, ValueError):
+            sys.exit(f"No master pid in {PIDFILE}; is the server running? Pass --pid")
+
+    report = measure(master)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{'role':<8}{'pid':>8}{'RSS MB':>10}{'PSS MB':>10}{'shared MB':>11}{'private MB':>12}")
+    for p in report["processes"]:
+        print(f"{p['role']:<8}{p['pid']:>8}{p['rss_mb']:>10.1f}{p['pss_mb']:>10.1f}"
+              f"{p['shared_mb']:>11.1f}{p['private_mb']:>12.1f}")
+    print(f"\n{report['workers']} workers; sum of RSS {report['total_rss_mb']:.1f} MB, "
+          f"actually used (sum of PSS) {report['total_pss_mb']:.1f} MB")
+    if report["private_per_worker_mb"] is not None:
+        print(f"Each additional worker costs about {report['private_per_worker_mb']:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()